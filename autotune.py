@@ -0,0 +1,189 @@
+"""启动时的性能自动调优：对当前机器做几秒钟的校准，测量不同 torch 线程数下一次环境交互（构造状态+贪婪前向）
+和不同批大小下一次学习更新的耗时，在用户给定的范围内选出每秒环境步数最高的线程数、BATCH_SIZE 和 REPLAY_INTERVAL。
+为了不改变训练的样本复用率，REPLAY_INTERVAL 随批大小等比例调整（保持 BATCH_SIZE / REPLAY_INTERVAL 不变）。
+学习耗时用算法3的 optimize_model_v3 测量，作为三个算法学习更新的代表。
+样本复用率固定时每步分摊的学习耗时约与 1/批大小 成正比，批越大通常越快，因此选出的 BATCH_SIZE
+实际上多由 --batch-sizes 的上限决定；调优主要作用在线程数上，批大小的取舍由候选范围控制。
+结果按主机（主机名、CPU核数、torch版本、设备）和调优范围缓存在本模块目录下的 autotune_cache.json 中，
+同一台机器之后直接复用。
+
+用法:
+    python main.py --autotune                                   # 训练前自动调优（有缓存时直接使用）
+    python autotune.py --threads 1 16 --batch-sizes 32 64 128 256 --replay-interval 5 80
+    python autotune.py --retune                                 # 忽略缓存重新校准
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import time
+
+import numpy as np
+import torch
+
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'autotune_cache.json')
+BATCH_SIZES = (32, 64, 128, 256)
+REPLAY_INTERVAL_BOUNDS = (5, 80)
+MEASURE_SECONDS = 0.2  # 每个配置的测量时间
+
+
+def training_module(module=None):
+    """被调优的训练模块：默认为 main；在 python main.py 中调用时传入 sys.modules['__main__']，避免再导入一份 main"""
+    if module is None:
+        import main as module
+    return module
+
+
+def host_key(module=None):
+    module = training_module(module)
+    return f"{platform.node()}|cpus={os.cpu_count()}|torch={torch.__version__}|{module.device}"
+
+
+def thread_candidates(min_threads, max_threads):
+    """范围内的2的幂以及上界本身"""
+    candidates = {max_threads}
+    n = 1
+    while n <= max_threads:
+        if n >= min_threads:
+            candidates.add(n)
+        n *= 2
+    return sorted(candidates)
+
+
+def time_per_call(fn, seconds=MEASURE_SECONDS, warmup=3, min_calls=5):
+    """反复调用fn至少seconds秒，返回平均每次耗时"""
+    for _ in range(warmup):
+        fn()
+    calls = 0
+    start_time = time.perf_counter()
+    while calls < min_calls or time.perf_counter() - start_time < seconds:
+        fn()
+        calls += 1
+    return (time.perf_counter() - start_time) / calls
+
+
+def calibrate(threads, batch_sizes, interval_bounds, sample_reuse, seconds=MEASURE_SECONDS, module=None):
+    """测量每个(线程数, 批大小)组合的每秒环境步数：每步耗时 = 交互耗时 + 学习耗时 / REPLAY_INTERVAL，
+    返回按吞吐量从高到低排序的结果列表。不改变调用前的随机数状态"""
+    main = training_module(module)
+    rng_states = random.getstate(), np.random.get_state(), torch.get_rng_state()
+    map_array = main.generate_map(size=20, obstacle_ratio=0.2)
+    free_cells = list(zip(*np.nonzero(map_array == 0)))
+    policy_net = main.DQN().to(main.device)
+    target_net = main.DQN().to(main.device)
+    target_net.load_state_dict(policy_net.state_dict())
+    optimizer = torch.optim.Adam(policy_net.parameters(), lr=main.LEARNING_RATE)
+    memory = main.ReplayMemory(max(batch_sizes) * 4)
+    for i in range(memory.capacity):
+        pos, next_pos = free_cells[i % len(free_cells)], free_cells[(i + 1) % len(free_cells)]
+        memory.push(main.matrix_to_img(pos, map_array).to(main.device), i % 4, -1.0,
+                    main.matrix_to_img(next_pos, map_array).to(main.device), False)
+    valid_actions = main.valid_action_mask(map_array)
+    pos = free_cells[0]
+
+    def act():
+        state = main.matrix_to_img(pos, map_array).to(main.device)
+        main.greedy_action(policy_net, state, valid_actions[pos])
+
+    results = []
+    original_threads = torch.get_num_threads()
+    try:
+        for num_threads in threads:
+            torch.set_num_threads(num_threads)
+            act_time = time_per_call(act, seconds)
+            for batch_size in batch_sizes:
+                replay_interval = int(round(batch_size / sample_reuse))
+                if not interval_bounds[0] <= replay_interval <= interval_bounds[1]:
+                    continue  # 保持样本复用率所需的学习间隔超出范围
+                learn_time = time_per_call(lambda: main.optimize_model_v3(
+                    policy_net, target_net, optimizer, memory, batch_size=batch_size), seconds)
+                results.append({
+                    'threads': num_threads,
+                    'batch_size': batch_size,
+                    'replay_interval': replay_interval,
+                    'act_ms': act_time * 1000,
+                    'learn_ms': learn_time * 1000,
+                    'steps_per_sec': 1.0 / (act_time + learn_time / replay_interval),
+                })
+    finally:
+        torch.set_num_threads(original_threads)
+        random.setstate(rng_states[0])
+        np.random.set_state(rng_states[1])
+        torch.set_rng_state(rng_states[2])
+    return sorted(results, key=lambda r: r['steps_per_sec'], reverse=True)
+
+
+def load_cache(cache_file):
+    if not os.path.exists(cache_file):
+        return {}
+    with open(cache_file, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def autotune(min_threads=1, max_threads=None, batch_sizes=BATCH_SIZES, interval_bounds=REPLAY_INTERVAL_BOUNDS,
+             cache_file=CACHE_FILE, retune=False, seconds=MEASURE_SECONDS, module=None):
+    """返回并应用（torch.set_num_threads）本机的最优配置 {'threads', 'batch_size', 'replay_interval', ...}，
+    BATCH_SIZE 和 REPLAY_INTERVAL 由调用方写回训练模块（见 apply_tuning）"""
+    main = training_module(module)
+    max_threads = max_threads or os.cpu_count() or 1
+    sample_reuse = main.BATCH_SIZE / main.REPLAY_INTERVAL
+    bounds = {
+        'threads': [min_threads, max_threads],
+        'batch_sizes': sorted(batch_sizes),
+        'replay_interval': list(interval_bounds),
+        'sample_reuse': sample_reuse,
+    }
+    key = host_key(main)
+    cache = load_cache(cache_file)
+    entry = cache.get(key)
+    if entry is not None and entry['bounds'] == bounds and not retune:
+        config = dict(entry['best'], cached=True)
+    else:
+        start_time = time.time()
+        results = calibrate(thread_candidates(min_threads, max_threads), bounds['batch_sizes'], interval_bounds,
+                            sample_reuse, seconds, main)
+        if not results:
+            raise ValueError('没有满足范围的配置：请放宽 --replay-interval 或增加 --batch-sizes')
+        cache[key] = {'bounds': bounds, 'best': results[0], 'results': results,
+                      'calibration_seconds': time.time() - start_time}
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        config = dict(results[0], cached=False)
+    torch.set_num_threads(config['threads'])
+    print(f"自动调优{'（使用缓存）' if config['cached'] else ''}: {key} -> 线程数 {config['threads']}, "
+          f"BATCH_SIZE {config['batch_size']}（候选上限 {max(bounds['batch_sizes'])}，由 --batch-sizes 限定）, "
+          f"REPLAY_INTERVAL {config['replay_interval']}, "
+          f"约 {config['steps_per_sec']:.0f} 环境步/秒")
+    return config
+
+
+def apply_tuning(config, module=None):
+    """把调优结果写入训练模块的超参数（默认为 main）"""
+    module = training_module(module)
+    torch.set_num_threads(config['threads'])
+    module.BATCH_SIZE = config['batch_size']
+    module.REPLAY_INTERVAL = config['replay_interval']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='校准本机最优的线程数、批大小和学习间隔')
+    parser.add_argument('--threads', type=int, nargs=2, metavar=('MIN', 'MAX'), default=None)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(BATCH_SIZES))
+    parser.add_argument('--replay-interval', type=int, nargs=2, metavar=('MIN', 'MAX'),
+                        default=list(REPLAY_INTERVAL_BOUNDS))
+    parser.add_argument('--seconds', type=float, default=MEASURE_SECONDS, help='每个配置的测量时间')
+    parser.add_argument('--cache', default=CACHE_FILE)
+    parser.add_argument('--retune', action='store_true', help='忽略缓存重新校准')
+    args = parser.parse_args()
+
+    min_threads, max_threads = args.threads or (1, None)
+    autotune(min_threads, max_threads, args.batch_sizes, tuple(args.replay_interval), args.cache, args.retune,
+             args.seconds)
+    entry = load_cache(args.cache)[host_key()]
+    for result in entry['results']:
+        print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""大地图的分层（由粗到细）规划：先把地图按 block x block 降采样为粗栅格并在其上规划航路点，
+再用训练好的目标条件DQN只在相邻航路点之间、以 20x20 局部窗口（与网络输入尺寸相同）推演，
+各段的推演合并成一次批量前向，相同窗口和起终点的局部路径会被缓存复用。
+每段推理代价与地图大小无关，因此可以扩展到仓库级别的大地图。
+
+用法:
+    python hierarchical.py goal_dqn_model.pth --size 200 --obstacle-ratio 0.2
+    python hierarchical.py goal_dqn_model.pth --map warehouse.npy --start 199 0 --goal 0 199
+
+DQN 在局部窗口内没有到达航路点时，默认用窗口内的BFS最短路径补全该段（结果中 fallback_segments 计数）。
+"""
+import argparse
+import heapq
+import json
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+WINDOW = 20  # 局部窗口大小，与DQN的输入尺寸相同
+BLOCK = 5  # 每个粗栅格对应的原地图格子数
+WAYPOINT_STRIDE = 2  # 每隔几个粗栅格取一个航路点，相邻航路点的距离约为 BLOCK * WAYPOINT_STRIDE
+BLOCKED_OCCUPANCY = 0.6  # 障碍物比例不低于该值的粗栅格视为不可通行
+SEGMENT_STEPS = 60  # 每段局部推演的最大步数
+COARSE_CACHE_SIZE = 8  # 粗栅格缓存保留的地图数（LRU）
+
+
+def coarse_grid(map_array, block=BLOCK):
+    """返回粗栅格的障碍物比例 (R, C) 和每个粗栅格的代表格子（离中心最近的可通行格子，全为障碍时为(-1, -1)）"""
+    rows, cols = map_array.shape
+    coarse_rows, coarse_cols = -(-rows // block), -(-cols // block)
+    padded = np.ones((coarse_rows * block, coarse_cols * block), dtype=np.float32)
+    padded[:rows, :cols] = map_array
+    blocks = padded.reshape(coarse_rows, block, coarse_cols, block).transpose(0, 2, 1, 3)
+    occupancy = blocks.mean(axis=(2, 3))
+    offsets = (np.arange(block) - (block - 1) / 2) ** 2
+    center_distance = (offsets[:, None] + offsets[None, :]).ravel()
+    cost = np.where(blocks.reshape(coarse_rows, coarse_cols, -1) == 0, center_distance, np.inf)
+    best = cost.argmin(axis=2)
+    representatives = np.stack((np.arange(coarse_rows)[:, None] * block + best // block,
+                                np.arange(coarse_cols)[None, :] * block + best % block), axis=-1)
+    representatives[np.isinf(cost.min(axis=2))] = -1
+    return occupancy, representatives
+
+
+def coarse_path(occupancy, start_block, goal_block, blocked=BLOCKED_OCCUPANCY):
+    """粗栅格上的Dijkstra，代价为 1 + 2 * 障碍物比例，返回粗栅格序列，不可达时返回None"""
+    coarse_rows, coarse_cols = occupancy.shape
+    distance = {start_block: 0.0}
+    previous = {}
+    heap = [(0.0, start_block)]
+    while heap:
+        d, current = heapq.heappop(heap)
+        if current == goal_block:
+            path = [current]
+            while current in previous:
+                current = previous[current]
+                path.append(current)
+            return path[::-1]
+        if d > distance[current]:
+            continue
+        for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            nr, nc = current[0] + dr, current[1] + dc
+            if not (0 <= nr < coarse_rows and 0 <= nc < coarse_cols):
+                continue
+            if occupancy[nr, nc] >= blocked and (nr, nc) != goal_block:
+                continue
+            nd = d + 1 + 2 * occupancy[nr, nc]
+            if nd < distance.get((nr, nc), np.inf):
+                distance[(nr, nc)] = nd
+                previous[(nr, nc)] = current
+                heapq.heappush(heap, (nd, (nr, nc)))
+    return None
+
+
+def bfs_path(map_array, start, goal):
+    """BFS最短路径（用于局部推演失败时补全），不可达时返回None"""
+    from main import bfs_distance_field
+    distance = bfs_distance_field(map_array, goal)
+    if distance[start] < 0:
+        return None
+    rows, cols = map_array.shape
+    path = [start]
+    while path[-1] != goal:
+        r, c = path[-1]
+        for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            nr, nc = r + dr, c + dc
+            if 0 <= nr < rows and 0 <= nc < cols and distance[nr, nc] == distance[r, c] - 1:
+                path.append((nr, nc))
+                break
+    return path
+
+
+class HierarchicalPlanner:
+    """分层规划器：policy_net 必须是目标条件网络（python main.py goal 训练），
+    cache_size 为局部路径缓存的条目数（LRU）"""
+    def __init__(self, policy_net, block=BLOCK, stride=WAYPOINT_STRIDE, window=WINDOW,
+                 segment_steps=SEGMENT_STEPS, cache_size=4096, fallback=True):
+        if policy_net.conv1.in_channels != 2:
+            raise ValueError('分层规划需要目标条件模型（python main.py goal 训练）')
+        if block * (stride + 1) >= window:
+            raise ValueError('相邻航路点必须能放进同一个局部窗口：block * (stride + 1) < window')
+        self.policy_net = policy_net
+        self.block = block
+        self.stride = stride
+        self.window = window
+        self.segment_steps = segment_steps
+        self.cache_size = cache_size
+        self.fallback = fallback
+        self.cache = OrderedDict()  # (窗口字节, 局部起点, 局部终点) -> 局部路径
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.coarse = OrderedDict()  # (地图形状, 地图字节) -> (障碍物比例, 代表格子)
+
+    def waypoints(self, map_array, start, goal):
+        """在粗栅格上规划，返回包括起点和终点在内的航路点列表，粗栅格不可达时返回None"""
+        key = (map_array.shape, map_array.tobytes())
+        if key in self.coarse:
+            self.coarse.move_to_end(key)
+        else:
+            self.coarse[key] = coarse_grid(map_array, self.block)
+            if len(self.coarse) > COARSE_CACHE_SIZE:
+                self.coarse.popitem(last=False)
+        occupancy, representatives = self.coarse[key]
+        blocks = coarse_path(occupancy, (start[0] // self.block, start[1] // self.block),
+                             (goal[0] // self.block, goal[1] // self.block))
+        if blocks is None:
+            return None
+        points = [start]
+        for r, c in blocks[self.stride:-1:self.stride]:
+            if representatives[r, c, 0] >= 0:
+                points.append(tuple(int(v) for v in representatives[r, c]))
+        points.append(goal)
+        return points
+
+    def window_origin(self, shape, a, b):
+        """包含 a、b 两点、以其中点为中心的局部窗口左上角坐标"""
+        return tuple(int(min(max((a[i] + b[i]) // 2 - self.window // 2, 0), max(shape[i] - self.window, 0)))
+                     for i in range(2))
+
+    def plan(self, map_array, start, goal):
+        """返回完整路径及航路点、分段数、缓存命中和补全段数等统计"""
+        from main import plan_goals, count_turns
+        start, goal = tuple(start), tuple(goal)
+        points = self.waypoints(map_array, start, goal)
+        if points is None:
+            return {'path': [start], 'length': 1, 'turns': 0, 'reached': False, 'waypoints': [],
+                    'segments': 0, 'cache_hits': 0, 'fallback_segments': 0}
+        # 地图不足一个窗口时用障碍物补齐
+        rows, cols = map_array.shape
+        padded = np.ones((max(rows, self.window), max(cols, self.window)), dtype=np.float32)
+        padded[:rows, :cols] = map_array
+        segments = []
+        for a, b in zip(points[:-1], points[1:]):
+            origin = self.window_origin(padded.shape, a, b)
+            local = padded[origin[0]:origin[0] + self.window, origin[1]:origin[1] + self.window]
+            local_a = (a[0] - origin[0], a[1] - origin[1])
+            local_b = (b[0] - origin[0], b[1] - origin[1])
+            segments.append((origin, local, (local.astype(np.uint8).tobytes(), local_a, local_b)))
+
+        local_paths = [self.cache.get(key) for _, _, key in segments]
+        hits = sum(path is not None for path in local_paths)
+        self.cache_hits += hits
+        self.cache_misses += len(segments) - hits
+        misses = [i for i, path in enumerate(local_paths) if path is None]
+        fallback_segments = 0
+        if misses:
+            # 所有未命中缓存的段合并为一次批量推演
+            windows = np.stack([segments[i][1] for i in misses])
+            pairs = [(segments[i][2][1], segments[i][2][2]) for i in misses]
+            for i, path in zip(misses, plan_goals(self.policy_net, windows, pairs, self.segment_steps)):
+                _, local, key = segments[i]
+                if path[-1] != key[2] and self.fallback:
+                    shortest = bfs_path(local, key[1], key[2])
+                    if shortest is not None:
+                        path = shortest
+                        fallback_segments += 1
+                local_paths[i] = path
+                self.cache[key] = path
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        for _, _, key in segments:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+
+        path = [start]
+        reached = True
+        for (origin, _, key), local_path in zip(segments, local_paths):
+            path.extend((r + origin[0], c + origin[1]) for r, c in local_path[1:])
+            if tuple(local_path[-1]) != key[2]:
+                reached = False  # 该段没有到达航路点，后续各段无法衔接
+                break
+        return {
+            'path': [tuple(int(v) for v in p) for p in path],
+            'length': len(path),
+            'turns': count_turns(path),
+            'reached': reached and path[-1] == goal,
+            'waypoints': points,
+            'segments': len(segments),
+            'cache_hits': hits,
+            'fallback_segments': fallback_segments,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='大地图的分层规划（粗栅格航路点 + 局部窗口DQN）')
+    parser.add_argument('model', help='目标条件模型 .pth 文件')
+    parser.add_argument('--map', help='地图文件(.npy/.txt/.csv)，不指定时随机生成')
+    parser.add_argument('--size', type=int, default=200, help='随机生成地图的边长')
+    parser.add_argument('--obstacle-ratio', type=float, default=0.2)
+    parser.add_argument('--start', type=int, nargs=2, metavar=('ROW', 'COL'))
+    parser.add_argument('--goal', type=int, nargs=2, metavar=('ROW', 'COL'))
+    parser.add_argument('--block', type=int, default=BLOCK)
+    parser.add_argument('--stride', type=int, default=WAYPOINT_STRIDE)
+    parser.add_argument('--no-fallback', action='store_true', help='局部推演失败时不用BFS补全')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    import main as training
+    from plan import load_map, load_policy
+    training.seed_everything(args.seed)
+    map_array = load_map(args.map) if args.map else training.generate_map(args.size, args.obstacle_ratio)
+    rows, cols = map_array.shape
+    start = tuple(args.start) if args.start else (rows - 1, 0)
+    goal = tuple(args.goal) if args.goal else (0, cols - 1)
+    planner = HierarchicalPlanner(load_policy(args.model), args.block, args.stride, fallback=not args.no_fallback)
+    for attempt in ('cold', 'cached'):
+        start_time = time.time()
+        result = planner.plan(map_array, start, goal)
+        summary = {key: value for key, value in result.items() if key not in ('path', 'waypoints')}
+        summary['elapsed'] = time.time() - start_time
+        print(attempt, json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
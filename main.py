@@ -3,13 +3,14 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
-from torch.utils.data import Dataset, DataLoader
 import random
+import sys
+import threading
+import multiprocessing as mp
 from collections import deque
-import matplotlib.pyplot as plt
 import time
-from queue import Queue
-import scipy.interpolate as interpolate
+from queue import Queue, Empty, Full
+# matplotlib、scipy、pandas 仅在绘图/平滑/保存数据时按需导入，加快仅评估场景的启动速度
 N_STEPS = 3  # n步引导长度
 
 def generate_map(size=20, obstacle_ratio=0.2):
@@ -59,6 +60,113 @@ def generate_map(size=20, obstacle_ratio=0.2):
         # 检查是否存在可达路径
         if is_path_exists(map_array, start_pos, target_pos):
             return map_array
+
+# 多地图训练用的地图库
+class MapBank:
+    """按多个障碍物比例预生成地图，每个比例留出held_out_per_ratio张地图用于测试泛化能力"""
+    def __init__(self, obstacle_ratios=(0.1, 0.2, 0.3), maps_per_ratio=5, held_out_per_ratio=1, size=20):
+        self.maps = []
+        self.obstacle_ratios = []
+        self.train_ids = []
+        self.held_out_ids = []
+        for ratio in obstacle_ratios:
+            for i in range(maps_per_ratio):
+                map_index = len(self.maps)
+                self.maps.append(generate_map(size=size, obstacle_ratio=ratio))
+                self.obstacle_ratios.append(ratio)
+                if i < held_out_per_ratio:
+                    self.held_out_ids.append(map_index)
+                else:
+                    self.train_ids.append(map_index)
+
+    def sample(self):
+        """随机抽取一张训练地图，返回 (地图, 地图编号)"""
+        map_index = random.choice(self.train_ids)
+        return self.maps[map_index], map_index
+
+    def __len__(self):
+        return len(self.maps)
+
+def bfs_distance_field(map_array, target):
+    """从终点出发做BFS，返回每个格子到终点的最短步数，不可达或障碍物为-1"""
+    rows, cols = map_array.shape
+    distance = np.full((rows, cols), -1, dtype=np.int64)
+    if map_array[target] != 0:
+        return distance
+    distance[target] = 0
+    queue = deque([target])
+    while queue:
+        r, c = queue.popleft()
+        for dr, dc in [(-1,0), (1,0), (0,-1), (0,1)]:
+            nr, nc = r + dr, c + dc
+            if 0 <= nr < rows and 0 <= nc < cols and distance[nr, nc] < 0 and map_array[nr, nc] == 0:
+                distance[nr, nc] = distance[r, c] + 1
+                queue.append((nr, nc))
+    return distance
+
+# 单张地图的缓存数据
+class MapCache:
+    """缓存一张地图上所有格子的状态张量、靠近障碍物标记、有效动作、到终点的BFS距离场和可达性，
+    障碍物发生变化时通过 apply_diff 只刷新受影响的部分"""
+    def __init__(self, map_array, target):
+        self.map = map_array.copy()
+        self.target = tuple(target)
+        rows, cols = self.map.shape
+        cell_idx = np.arange(rows * cols)
+        states = np.repeat(self.map[None], rows * cols, axis=0)
+        states[cell_idx, cell_idx // cols, cell_idx % cols] = 2
+        self.states = torch.tensor(states, dtype=torch.float32).unsqueeze(1).to(device)
+        self.near_obstacle = self._near_obstacle_region(0, rows, 0, cols)
+        self.valid_actions = valid_action_mask(self.map)
+        self.distance = bfs_distance_field(self.map, self.target)
+
+    @property
+    def reachable(self):
+        return self.distance >= 0
+
+    def state(self, pos):
+        """与 matrix_to_img 结果相同，但直接取缓存"""
+        return self.states[pos[0] * self.map.shape[1] + pos[1]].unsqueeze(0)
+
+    def _near_obstacle_region(self, r0, r1, c0, c1):
+        # 统计[r0,r1)x[c0,c1)内每个格子的8邻域是否有障碍物
+        padded = np.pad(self.map, 1)
+        near = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+        for dr in [-1, 0, 1]:
+            for dc in [-1, 0, 1]:
+                if dr == 0 and dc == 0:
+                    continue
+                near |= padded[r0 + 1 + dr:r1 + 1 + dr, c0 + 1 + dc:c1 + 1 + dc] == 1
+        return near
+
+    def apply_diff(self, changes):
+        """changes 为 (row, col, value) 列表，返回实际发生变化的格子"""
+        rows, cols = self.map.shape
+        changed = [(r, c, v) for r, c, v in changes if self.map[r, c] != v]
+        if not changed:
+            return []
+        # 距离场只有在变化格子原本可达或与可达区域相邻时才需要重算
+        reachable = self.reachable
+        affects_distance = any(
+            reachable[r, c] or any(0 <= r + dr < rows and 0 <= c + dc < cols and reachable[r + dr, c + dc]
+                                   for dr, dc in [(-1,0), (1,0), (0,-1), (0,1)])
+            for r, c, _ in changed)
+        for r, c, v in changed:
+            self.map[r, c] = v
+        changed_rows = np.array([r for r, _, _ in changed])
+        changed_cols = np.array([c for _, c, _ in changed])
+        values = torch.tensor([v for _, _, v in changed], dtype=torch.float32, device=device)
+        # 旧的状态张量可能仍被经验池中的转移引用，先复制再修改
+        self.states = self.states.clone()
+        self.states[:, 0, changed_rows, changed_cols] = values
+        self.states[changed_rows * cols + changed_cols, 0, changed_rows, changed_cols] = 2
+        for r, c, _ in changed:
+            r0, r1, c0, c1 = max(r - 1, 0), min(r + 2, rows), max(c - 1, 0), min(c + 2, cols)
+            self.near_obstacle[r0:r1, c0:c1] = self._near_obstacle_region(r0, r1, c0, c1)
+        self.valid_actions = valid_action_mask(self.map)
+        if affects_distance:
+            self.distance = bfs_distance_field(self.map, self.target)
+        return [(r, c) for r, c, _ in changed]
 # 超参数配置
 BATCH_SIZE = 64
 GAMMA = 0.9
@@ -67,16 +175,38 @@ MEMORY_SIZE = 10000
 LEARNING_RATE = 0.005
 NUM_EPISODES = 500
 REPLAY_INTERVAL = 20
+# 收敛早停配置
+EARLY_STOP = True
+CONVERGENCE_WINDOW = 5  # 贪婪路径连续多少次检查长度稳定即认为收敛
+CONVERGENCE_CHECK_INTERVAL = 5  # 每隔多少轮做一次贪婪路径检查
+CONVERGENCE_MIN_EPISODES = 50  # 至少训练多少轮后才允许早停
+# 最近 CONVERGENCE_WINDOW * CONVERGENCE_CHECK_INTERVAL 轮的前后两半，平均步数和平均奖励的相对变化都不超过该比例才允许早停，
+# None为只看贪婪路径检查
+CONVERGENCE_TOLERANCE = 0.2
+def seed_everything(seed):
+    """固定random、numpy和torch的随机种子，用于复现实验"""
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    if torch.cuda.is_available():
+        torch.cuda.manual_seed_all(seed)
+    torch.backends.cudnn.deterministic = True
+    torch.backends.cudnn.benchmark = False
+
+# 当前使用的地图编号（单地图训练时为-1），写入经验池用于标记经验来自哪张地图
+current_map_id = -1
 # 设备配置
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 class DQN(nn.Module):
-    def __init__(self):
+    # in_channels=2 为目标条件网络，第二个通道为目标位置的one-hot
+    # num_actions 默认为 4 * MACRO_MAX_LENGTH（宏动作模式下每个方向有多个步长）
+    def __init__(self, in_channels=1, num_actions=None):
         super(DQN, self).__init__()
-        self.conv1 = nn.Conv2d(1, 16, kernel_size=3)
+        self.conv1 = nn.Conv2d(in_channels, 16, kernel_size=3)
         self.conv2 = nn.Conv2d(16, 32, kernel_size=3)
         # 输入20x20，经过两次3x3卷积（无padding，stride=1），输出为32x16x16
         self.fc1 = nn.Linear(32 * 16 * 16, 64)
-        self.fc2 = nn.Linear(64, 4)
+        self.fc2 = nn.Linear(64, num_actions or len(ACTIONS) * MACRO_MAX_LENGTH)
 
     def forward(self, x):
         x = F.relu(self.conv1(x))
@@ -84,29 +214,362 @@ class DQN(nn.Module):
         x = x.view(x.size(0), -1)
         x = F.relu(self.fc1(x))
         return self.fc2(x)
+# n步转移构建器，所有经验池共用
+class NStepTransitionBuilder:
+    """以滑动折扣和增量维护n步回报，每步O(1)。
+    输出转移为 (state, action, n步回报, next_state, done, discount, pos)，
+    其中 discount 为自举项的折扣系数 gamma^k（k为实际累计的时间步数）。
+    宏动作的一次决策持续 duration 个时间步（SMDP），其奖励已按步折扣累加，后续决策的折扣按累计时间步计算"""
+    def __init__(self, n_steps=N_STEPS, gamma=GAMMA):
+        self.n_steps = n_steps
+        self.gamma = gamma
+        self.buffer = deque()  # (state, action, reward, pos, duration)
+        self.elapsed = 0  # 缓存中决策的总时间步数
+        self.discounted_sum = 0.0
+        self.pops_since_rebase = 0
+
+    def append(self, state, action, reward, next_state, done, pos=None, truncated=False, duration=1):
+        """加入一次决策，返回可以写入经验池的n步转移列表"""
+        self.discounted_sum += self.gamma ** self.elapsed * reward
+        self.buffer.append((state, action, reward, pos, duration))
+        self.elapsed += duration
+        if done or truncated:
+            return self.flush(next_state, done)
+        if len(self.buffer) == self.n_steps:
+            return [self._pop(next_state, False)]
+        return []
+
+    def flush(self, next_state, done=False):
+        """回合结束时清空缓存：终止时不再自举，超时截断时以最后的next_state自举"""
+        transitions = []
+        while self.buffer:
+            transitions.append(self._pop(next_state, done))
+        return transitions
+
+    def _pop(self, next_state, done):
+        k = self.elapsed
+        state, action, reward, pos, duration = self.buffer.popleft()
+        self.elapsed -= duration
+        n_reward = self.discounted_sum
+        if not self.buffer:
+            self.discounted_sum = 0.0
+            self.pops_since_rebase = 0
+        elif self.gamma == 0 or self.pops_since_rebase >= self.n_steps:
+            # 每n次弹出重新精确求和一次，避免除以gamma造成的舍入误差累积（均摊仍为O(1)）
+            self.discounted_sum = 0.0
+            elapsed = 0
+            for item in self.buffer:
+                self.discounted_sum += self.gamma ** elapsed * item[2]
+                elapsed += item[4]
+            self.pops_since_rebase = 0
+        else:
+            self.discounted_sum = (self.discounted_sum - reward) / self.gamma ** duration
+            self.pops_since_rebase += 1
+        if done:
+            return state, action, n_reward, None, True, 0.0, pos
+        return state, action, n_reward, next_state, False, self.gamma ** k, pos
 # 首先添加一个普通的经验回放缓冲区类
 class ReplayMemory:
     def __init__(self, capacity):
         self.capacity = capacity
         self.memory = []
         self.position = 0
+        self.map_ids = np.full(capacity, -1, dtype=np.int64)
         
-    def push(self, state, action, reward, next_state, done):
+    def push(self, state, action, reward, next_state, done, discount=GAMMA, map_id=-1):
         if len(self.memory) < self.capacity:
             self.memory.append(None)
-        self.memory[self.position] = (state, action, reward, next_state, done)
+        self.memory[self.position] = (state, action, reward, next_state, done, discount)
+        self.map_ids[self.position] = map_id
         self.position = (self.position + 1) % self.capacity
         
     def sample(self, batch_size):
         batch = random.sample(self.memory, batch_size)
         return batch, None, np.ones(batch_size)  # 返回权重全为1的数组
+
+    # 以下三个方法供 MultiPoolSampler 使用
+    def draw(self, u, beta=None):
+        """根据[0,1)均匀随机数u均匀抽取下标，权重全为1"""
+        indices = (u * len(self.memory)).astype(np.int64)
+        return indices, np.ones(len(u), dtype=np.float32)
+
+    def gather(self, indices):
+        return [self.memory[i] for i in indices]
+
+    def update_priorities(self, indices, priorities):
+        pass  # 普通经验池没有优先级
+
+    def stored_map_ids(self):
+        return self.map_ids[:len(self.memory)]
+
+    def stored_transitions(self):
+        return self.memory
+
+    def filter(self, keep):
+        """只保留keep为True的经验，空出的位置由后续push填充"""
+        if keep.all():
+            return
+        map_ids = self.map_ids[:len(self.memory)][keep]
+        self.memory = [t for t, k in zip(self.memory, keep) if k]
+        self.map_ids[:] = -1
+        self.map_ids[:len(self.memory)] = map_ids
+        self.position = len(self.memory) % self.capacity
         
     def __len__(self):
         return len(self.memory)
+# 多经验池分层采样器
+class MultiPoolSampler:
+    """按目标比例为任意多个经验池一次性分配子批次并抽样。
+    每个池需提供 draw(u, beta)、gather(indices)、update_priorities(indices, priorities) 和 __len__，
+    返回的索引为连续的 (池编号数组, 池内下标数组)，优先级/损失据此回传给各池，
+    各池平均损失用固定大小的累加器统计。
+    store 不为None时各池是同一个列式存储的子集，draw 返回存储中的槽位，整批经验一次从存储中取出"""
+    def __init__(self, pools, ratios=None, store=None):
+        self.pools = list(pools)
+        self.store = store
+        num_pools = len(self.pools)
+        self.ratios = np.full(num_pools, 1.0 / num_pools) if ratios is None else np.asarray(ratios, dtype=np.float64)
+        self.loss_sums = np.zeros(num_pools)
+        self.loss_counts = np.zeros(num_pools, dtype=np.int64)
+
+    def set_ratios(self, ratios):
+        self.ratios = np.asarray(ratios, dtype=np.float64)
+
+    def allocate(self, batch_size):
+        """按比例分配各池的子批次大小，样本不足的池由其余池按顺序补足"""
+        sizes = np.array([len(pool) for pool in self.pools], dtype=np.int64)
+        ratio_sum = self.ratios.sum()
+        ratios = self.ratios / ratio_sum if ratio_sum > 0 else np.full(len(sizes), 1.0 / len(sizes))
+        targets = np.floor(batch_size * ratios[:-1]).astype(np.int64)
+        targets = np.append(targets, batch_size - targets.sum())  # 余数归最后一个池
+        counts = np.minimum(targets, sizes)
+        shortfall = batch_size - counts.sum()
+        if shortfall > 0:
+            spare = sizes - counts
+            filled_before = np.cumsum(spare) - spare
+            counts += np.minimum(spare, np.maximum(shortfall - filled_before, 0))
+        return counts
+
+    def sample(self, batch_size, beta=0.4):
+        counts = self.allocate(batch_size)
+        total = int(counts.sum())
+        if total == 0:
+            return [], (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)), np.array([])
+        pool_ids = np.repeat(np.arange(len(self.pools)), counts)
+        pool_indices = np.empty(total, dtype=np.int64)
+        weights = np.empty(total, dtype=np.float32)
+        u = np.random.random(total)  # 一次生成所有子批次所需的随机数
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        batch = []
+        for k in np.flatnonzero(counts):
+            segment = slice(offsets[k], offsets[k + 1])
+            pool_indices[segment], weights[segment] = self.pools[k].draw(u[segment], beta)
+            if self.store is None:
+                batch.extend(self.pools[k].gather(pool_indices[segment]))
+        if self.store is not None:
+            batch = self.store.gather(pool_indices)
+        return batch, (pool_ids, pool_indices), weights
+
+    def update_priorities(self, indices, priorities):
+        pool_ids, pool_indices = indices
+        if len(pool_ids) == 0:
+            return
+        priorities = np.asarray(priorities, dtype=np.float64)
+        self.loss_sums += np.bincount(pool_ids, weights=priorities, minlength=len(self.pools))
+        self.loss_counts += np.bincount(pool_ids, minlength=len(self.pools))
+        for k in np.unique(pool_ids):
+            mask = pool_ids == k
+            self.pools[k].update_priorities(pool_indices[mask], priorities[mask])
+
+    def mean_losses(self):
+        return np.divide(self.loss_sums, self.loss_counts,
+                         out=np.zeros(len(self.pools)), where=self.loss_counts > 0)
+
+    def reset_losses(self):
+        self.loss_sums[:] = 0
+        self.loss_counts[:] = 0
+# 列式存储直接取出的批次
+class ColumnBatch:
+    """已经是 collate_batch 输出格式的批次，collate_batch 直接返回其中的张量"""
+    def __init__(self, tensors):
+        self.tensors = tensors
+
+    def __len__(self):
+        return len(self.tensors[2])
+
+# 近障碍物经验与全部经验共用的列式存储
+class ObstacleTransitionStore:
+    """所有经验按列预分配存放一次（状态取值只有0/1/2，用uint8存储），近障碍物经验只是其中的一个槽位下标集合。
+    全部经验为容量capacity的环形缓冲区；近障碍物子集为容量near_capacity的环形下标表，
+    两者都按先进先出淘汰，存储淘汰某个槽位时它一定也是近障碍物子集中最早的一条，因此两者始终一致"""
+    def __init__(self, capacity, near_capacity):
+        self.capacity = capacity
+        self.near_capacity = near_capacity
+        self.columns = None  # 第一次push时按状态形状分配
+        self.map_ids = np.full(capacity, -1, dtype=np.int64)
+        self.is_near = np.zeros(capacity, dtype=bool)
+        self.position = 0
+        self.size = 0
+        self.near_slots = np.zeros(near_capacity, dtype=np.int64)
+        self.near_pointer = 0
+        self.near_size = 0
+        self.all_view = ObstacleStoreView(self, near=False)
+        self.near_view = ObstacleStoreView(self, near=True)
+
+    def _allocate(self, state):
+        shape = (self.capacity,) + tuple(state.shape[1:])
+        self.columns = {
+            'state': torch.zeros(shape, dtype=torch.uint8, device=device),
+            'next_state': torch.zeros(shape, dtype=torch.uint8, device=device),
+            'non_final': torch.zeros(self.capacity, dtype=torch.bool, device=device),
+            'action': torch.zeros(self.capacity, dtype=torch.int64, device=device),
+            'reward': torch.zeros(self.capacity, dtype=torch.float32, device=device),
+            'discount': torch.zeros(self.capacity, dtype=torch.float32, device=device),
+        }
+
+    def push(self, state, action, reward, next_state, done, discount, map_id, near):
+        if self.columns is None:
+            self._allocate(state)
+        slot = self.position
+        if self.size == self.capacity and self.is_near[slot]:
+            self.near_size -= 1  # 被淘汰的槽位是近障碍物子集中最早的一条
+        columns = self.columns
+        columns['state'][slot] = state[0]
+        columns['non_final'][slot] = next_state is not None
+        if next_state is not None:
+            columns['next_state'][slot] = next_state[0]
+        columns['action'][slot] = action
+        columns['reward'][slot] = reward
+        columns['discount'][slot] = discount
+        self.map_ids[slot] = map_id
+        self.is_near[slot] = False
+        if near:
+            if self.near_size == self.near_capacity:
+                self.is_near[self.near_slots[self.near_pointer]] = False
+            else:
+                self.near_size += 1
+            self.near_slots[self.near_pointer] = slot
+            self.near_pointer = (self.near_pointer + 1) % self.near_capacity
+            self.is_near[slot] = True
+        self.position = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def temporal_order(self):
+        """所有有效槽位，按写入先后排列"""
+        return (self.position - self.size + np.arange(self.size)) % self.capacity
+
+    def near_order(self):
+        """近障碍物子集的槽位，按写入先后排列"""
+        return self.near_slots[(self.near_pointer - self.near_size + np.arange(self.near_size)) % self.near_capacity]
+
+    def gather(self, slots):
+        """按槽位整批取出，返回 ColumnBatch"""
+        columns = self.columns
+        slots = torch.as_tensor(np.asarray(slots), dtype=torch.int64, device=device)
+        non_final_mask = columns['non_final'][slots]
+        return ColumnBatch((
+            columns['state'][slots].float(),
+            columns['action'][slots].unsqueeze(1),
+            columns['reward'][slots],
+            non_final_mask,
+            columns['next_state'][slots[non_final_mask]].float(),
+            columns['discount'][slots],
+        ))
+
+    def transitions(self, slots):
+        """按槽位还原为 (state, action, reward, next_state, done, discount) 元组，供重规划删除经验时检查"""
+        if self.columns is None or len(slots) == 0:
+            return []
+        states, actions, rewards, non_final, _, discounts = self.gather(slots).tensors
+        next_states = self.columns['next_state'][torch.as_tensor(slots, device=device)].float()
+        return [(states[i:i + 1], int(actions[i]), float(rewards[i]),
+                 next_states[i:i + 1] if non_final[i] else None, not bool(non_final[i]), float(discounts[i]))
+                for i in range(len(slots))]
+
+    def _rebuild_near(self, order):
+        """按写入顺序重建近障碍物下标表，只保留最近的 near_capacity 条"""
+        near = order[self.is_near[order]][-self.near_capacity:]
+        self.is_near[:] = False
+        self.is_near[near] = True
+        self.near_slots[:len(near)] = near
+        self.near_size = len(near)
+        self.near_pointer = len(near) % self.near_capacity
+
+    def compact(self, keep_slots):
+        """只保留给定槽位（按写入顺序），压缩到存储开头，近障碍物子集随之更新"""
+        keep_slots = np.asarray(keep_slots, dtype=np.int64)
+        count = len(keep_slots)
+        index = torch.as_tensor(keep_slots, device=device)
+        for name, column in self.columns.items():
+            column[:count] = column[index].clone()
+        self.map_ids[:count] = self.map_ids[keep_slots]
+        self.map_ids[count:] = -1
+        is_near = self.is_near[keep_slots]
+        self.is_near[:] = False
+        self.is_near[:count] = is_near
+        self.size = count
+        self.position = count % self.capacity
+        self._rebuild_near(np.arange(count))
+
+    def drop_near(self, slots):
+        """把槽位移出近障碍物子集（经验仍保留在全部经验中）"""
+        self.is_near[np.asarray(slots, dtype=np.int64)] = False
+        self._rebuild_near(self.temporal_order())
+
+class ObstacleStoreView:
+    """列式存储的一个子集（全部经验或近障碍物经验），实现 MultiPoolSampler 的经验池协议，draw 直接返回存储槽位"""
+    def __init__(self, store, near):
+        self.store = store
+        self.near = near
+
+    def slots(self):
+        return self.store.near_order() if self.near else self.store.temporal_order()
+
+    def draw(self, u, beta=None):
+        """均匀抽取，权重全为1"""
+        if self.near:
+            store = self.store
+            offsets = (u * store.near_size).astype(np.int64)
+            return (store.near_slots[(store.near_pointer - 1 - offsets) % store.near_capacity],
+                    np.ones(len(u), dtype=np.float32))
+        # 未满时有效槽位为 0..size-1，满时为全部槽位
+        return (u * self.store.size).astype(np.int64), np.ones(len(u), dtype=np.float32)
+
+    def gather(self, indices):
+        return self.store.gather(indices)
+
+    def update_priorities(self, indices, priorities):
+        pass  # 没有优先级
+
+    def stored_map_ids(self):
+        return self.store.map_ids[self.slots()]
+
+    def stored_transitions(self):
+        return self.store.transitions(self.slots())
+
+    def filter(self, keep):
+        slots = self.slots()
+        if keep.all():
+            return
+        if self.near:
+            self.store.drop_near(slots[~keep])
+        else:
+            self.store.compact(slots[keep])
+
+    def __len__(self):
+        return self.store.near_size if self.near else self.store.size
+
 class DualReplayMemoryObstacle:
     def __init__(self, near_capacity, all_capacity, p0=0.3, p1=0.6, beta_t=0.4, total_episodes=NUM_EPISODES):
-        self.near_memory = ReplayMemory(near_capacity)
-        self.all_memory = ReplayMemory(all_capacity)
+        if REPLAY_ENGINE != 'dedup':
+            # 近障碍物经验与全部经验共用一份列式存储
+            self.store = ObstacleTransitionStore(all_capacity, near_capacity)
+            self.near_memory = self.store.near_view
+            self.all_memory = self.store.all_view
+        else:
+            self.store = None
+            self.near_memory = make_replay_pool(near_capacity)
+            self.all_memory = make_replay_pool(all_capacity)
         self.near_ratio = 0.4 # 初始采样比例
         self.beta_t = 0.4  # 强制前200轮 near_ratio 不为0
         self.min_ratio = 0
@@ -117,8 +580,7 @@ class DualReplayMemoryObstacle:
         self.total_episodes = total_episodes
         self.current_episode = 0
         self.epsilon_t = 1.0
-        self.near_losses = []
-        self.all_losses = []
+        self.sampler = MultiPoolSampler([self.near_memory, self.all_memory], store=self.store)
 
     def is_near_obstacle(self, pos, map_array):
         r, c = pos
@@ -134,10 +596,14 @@ class DualReplayMemoryObstacle:
         return False
 
     # 修改 DualReplayMemoryObstacle 的 push 方法
-    def push(self, state, action, reward, next_state, done, pos, map_array, is_episode_end=False):
-        self.all_memory.push(state, action, reward, next_state, done)
-        if self.is_near_obstacle(pos, map_array):
-            self.near_memory.push(state, action, reward, next_state, done)
+    def push(self, state, action, reward, next_state, done, pos, map_array, is_episode_end=False, discount=GAMMA, map_id=-1):
+        near = self.is_near_obstacle(pos, map_array)
+        if self.store is not None:
+            self.store.push(state, action, reward, next_state, done, discount, map_id, near)
+        else:
+            self.all_memory.push(state, action, reward, next_state, done, discount, map_id)
+            if near:
+                self.near_memory.push(state, action, reward, next_state, done, discount, map_id)
         if done and is_episode_end:
             self.current_episode += 1
             self.adjust_sampling_ratio()
@@ -145,58 +611,38 @@ class DualReplayMemoryObstacle:
     def adjust_sampling_ratio(self):
         t = self.current_episode / self.total_episodes
         self.epsilon_t = max(0.01, self.epsilon_t * 0.995)
-        l0 = np.mean(self.all_losses) if self.all_losses else 0
-        l1 = np.mean(self.near_losses) if self.near_losses else 0
+        l1, l0 = self.sampler.mean_losses()
         total_loss = l0 + l1 if (l0 + l1) > 0 else 1
         if t < self.beta_t:
             self.near_ratio = (self.p0 * self.epsilon_t + self.p1 * (l1 / total_loss))
         else:
             self.near_ratio = 0
         self.near_ratio = max(self.min_ratio, min(self.max_ratio, self.near_ratio))
-        self.all_losses = []
-        self.near_losses = []
+        self.sampler.reset_losses()
 
     def sample(self, batch_size, beta=0.4):
-        near_size = int(batch_size * self.near_ratio)
-        all_size = batch_size - near_size
-        near_size = min(near_size, len(self.near_memory))
-        all_size = min(all_size, len(self.all_memory))
-        if near_size == 0 and all_size == 0:
-            self.last_indices_type = "empty"
-            return [], None, np.array([])
-        if near_size == 0:
-            self.last_indices_type = "all_only"
-            batch, _, _ = self.all_memory.sample(all_size)
-            return batch, None, np.ones(len(batch))
-        if all_size == 0:
-            self.last_indices_type = "near_only"
-            batch, _, _ = self.near_memory.sample(near_size)
-            return batch, None, np.ones(len(batch))
-        near_batch, _, _ = self.near_memory.sample(near_size)
-        all_batch, _, _ = self.all_memory.sample(all_size)
-        batch = near_batch + all_batch
-        self.last_indices_type = "mixed"
-        self.last_near_size = near_size
-        return batch, None, np.ones(len(batch))
+        self.sampler.set_ratios((self.near_ratio, 1 - self.near_ratio))
+        return self.sampler.sample(batch_size, beta)
 
     def update_priorities(self, indices, priorities):
         # 这里只用于记录损失，便于动态采样调整
-        if self.last_indices_type == "near_only":
-            self.near_losses.extend(priorities)
-        elif self.last_indices_type == "all_only":
-            self.all_losses.extend(priorities)
-        elif self.last_indices_type == "mixed":
-            self.near_losses.extend(priorities[:self.last_near_size])
-            self.all_losses.extend(priorities[self.last_near_size:])
+        self.sampler.update_priorities(indices, priorities)
+
+    def stored_map_ids(self):
+        # near池中的经验同时存在于all池中，只统计all池
+        return self.all_memory.stored_map_ids()
 
     def __len__(self):
-        return len(self.near_memory) + len(self.all_memory)
+        # 近障碍物经验都在全部经验中（共享存储时近障碍物池只是其下标子集），不重复计数
+        return len(self.all_memory)
 
 # 定义SumTree
 class SumTree:
     def __init__(self, capacity):
         self.capacity = capacity
         self.tree = np.zeros(2 * capacity - 1)
+        # 与求和树同构的最小值树，空叶子记为inf，根节点即为最小非零优先级
+        self.min_tree = np.full(2 * capacity - 1, np.inf)
         self.data = np.zeros(capacity, dtype=object)
         self.data_pointer = 0
         self.size = 0
@@ -208,6 +654,15 @@ class SumTree:
         if parent != 0:
             self.propagate(parent, change)
 
+    def propagate_min(self, idx):
+        while idx != 0:
+            parent = (idx - 1) // 2
+            new_min = min(self.min_tree[2 * parent + 1], self.min_tree[2 * parent + 2])
+            if self.min_tree[parent] == new_min:
+                break  # 上层最小值不再变化，提前结束
+            self.min_tree[parent] = new_min
+            idx = parent
+
     def retrieve(self, idx, s):
         left = 2 * idx + 1
         right = left + 1
@@ -232,6 +687,23 @@ class SumTree:
         change = priority - self.tree[idx]
         self.tree[idx] = priority
         self.propagate(idx, change)
+        self.min_tree[idx] = priority if priority > 0 else np.inf
+        self.propagate_min(idx)
+
+    def retrieve_batch(self, values):
+        """向量化的retrieve：所有查询值同时逐层向下查找叶子节点"""
+        values = np.array(values, dtype=np.float64)
+        idx = np.zeros(len(values), dtype=np.int64)
+        while True:
+            left = 2 * idx + 1
+            active = left < len(self.tree)
+            if not active.any():
+                return idx
+            left = left[active]
+            left_values = self.tree[left]
+            go_left = values[active] <= left_values
+            values[active] = np.where(go_left, values[active], values[active] - left_values)
+            idx[active] = np.where(go_left, left, left + 1)
 
     def get_leaf(self, value):
         idx = self.retrieve(0, value)
@@ -242,13 +714,11 @@ class SumTree:
         return max(self.tree[0], 1e-8)  # 确保总优先级不为0
 
     def get_min_priority(self):
-        if self.size == 0:
-            return 1.0
-        non_zero_priorities = self.tree[self.capacity-1:self.capacity-1+self.size]
-        non_zero_priorities = non_zero_priorities[non_zero_priorities > 0]
-        if len(non_zero_priorities) == 0:
+        # O(1)读取最小值树的根节点
+        min_priority = self.min_tree[0]
+        if self.size == 0 or not np.isfinite(min_priority):
             return 1.0
-        return np.min(non_zero_priorities)
+        return min_priority
 
 # 定义PrioritizedReplayMemory（算法12）
 class PrioritizedReplayMemoryV1:
@@ -259,79 +729,376 @@ class PrioritizedReplayMemoryV1:
         self.beta_frames = beta_frames
         self.frame_idx = 1
         self.epsilon = 1e-6
-
-    def push(self, state, action, reward, next_state, done):
-        max_priority = max(self.tree.max_priority, 1.0)
+        self.map_ids = np.full(capacity, -1, dtype=np.int64)
+        self.versions = np.zeros(capacity, dtype=np.int64)  # 槽位被覆盖或删除的次数
+        self.valid = np.zeros(capacity, dtype=bool)  # 被filter删除的槽位为False，直到被新经验覆盖
+        self.num_valid = 0
+
+    def push(self, state, action, reward, next_state, done, discount=GAMMA, map_id=-1, priority=None):
+        # priority 为None时使用当前最大优先级（示范经验可指定优先级）
+        max_priority = max(self.tree.max_priority, 1.0) if priority is None else priority
         
-        experience = (state, action, reward, next_state, done)
+        experience = (state, action, reward, next_state, done, discount)
+        slot = self.tree.data_pointer
+        self.map_ids[slot] = map_id
+        self.versions[slot] += 1
+        if not self.valid[slot]:
+            self.valid[slot] = True
+            self.num_valid += 1
         self.tree.add(max_priority, experience)
 
     def sample(self, batch_size, beta=None):
+        if self.num_valid == 0:
+            # 如果经验池为空，返回空列表
+            return [], [], np.array([])
+        indices, weights = self.draw(np.random.random(batch_size), beta)
+        return self.gather(indices), indices, weights
+
+    def draw(self, u, beta=None):
+        """分层采样：第i个样本落在第i段优先级区间内，u为段内位置，返回树下标和归一化的IS权重"""
         if beta is None:
             beta = min(1.0, self.beta + self.frame_idx * (1.0 - self.beta) / self.beta_frames)
             self.frame_idx += 1
 
-        if self.tree.size == 0:
-            # 如果经验池为空，返回空列表
-            return [], [], np.array([])
-
-        batch = []
-        indices = []
-        priorities = []
-        
-        segment = self.tree.total_priority() / batch_size
-        
+        batch_size = len(u)
         # 确保min_prob不会导致除零
         total_priority = self.tree.total_priority()
-        min_priority = self.tree.get_min_priority()
-        min_prob = min_priority / total_priority if total_priority > 0 else 1.0
-
-        for i in range(batch_size):
-            a = segment * i
-            b = segment * (i + 1)
-            
-            if a == b:  # 处理边界情况
-                b = a + 1e-8
-                
-            value = np.random.uniform(a, b)
-            
-            index, priority, data = self.tree.get_leaf(value)
-            
-            # 确保prob不会导致除零或无效值
-            prob = priority / total_priority if total_priority > 0 else 1.0
-            
-            # 计算权重前确保除数不为零
-            if min_prob > 0:
-                weight = (prob / min_prob) ** (-beta)
-            else:
-                weight = 1.0
-            
-            batch.append(data)
-            indices.append(index)
-            priorities.append(weight)  # 直接存储计算好的权重
-
-        # 不再需要额外的权重计算
-        weights = np.array(priorities, dtype=np.float32)
+        segment = total_priority / batch_size
+        values = (np.arange(batch_size) + u) * segment
+        indices = self.tree.retrieve_batch(values)
+
+        min_prob = self.tree.get_min_priority() / total_priority
+        probs = self.tree.tree[indices] / total_priority
+        # 计算权重前确保除数不为零
+        if min_prob > 0:
+            weights = np.power(np.maximum(probs, 1e-12) / min_prob, -beta)
+        else:
+            weights = np.ones(batch_size)
+        weights = weights.astype(np.float32)
         weights = weights / weights.max() if weights.max() > 0 else weights
+        return indices, weights
 
-        return batch, indices, weights
+    def gather(self, indices):
+        return list(self.tree.data[np.asarray(indices) - self.tree.capacity + 1])
+
+    def slot_versions(self, indices):
+        return self.versions[np.asarray(indices) - self.tree.capacity + 1]
 
     def update_priorities(self, indices, priorities):
         priorities = np.power(priorities + self.epsilon, self.alpha)
         for idx, priority in zip(indices, priorities):
             self.tree.update(idx, priority)
 
+    def stored_slots(self):
+        """未被删除的经验所在的槽位，stored_map_ids / stored_transitions / filter 都按它对齐"""
+        return np.flatnonzero(self.valid[:self.tree.size])
+
+    def stored_map_ids(self):
+        return self.map_ids[self.stored_slots()]
+
+    def stored_transitions(self):
+        return list(self.tree.data[self.stored_slots()])
+
+    def filter(self, keep):
+        """keep 与 stored_transitions() 对齐：keep为False的经验优先级置0并标记为已删除，之后会被新经验覆盖"""
+        removed = self.stored_slots()[~keep]
+        for data_idx in removed:
+            self.tree.update(data_idx + self.tree.capacity - 1, 0)
+            self.versions[data_idx] += 1
+        self.valid[removed] = False
+        self.num_valid -= len(removed)
+
+    def __len__(self):
+        return self.num_valid
+# 去重计数经验池
+class CountReplayMemory:
+    """20x20地图上不同的(格子, 动作)组合很少，普通经验池大部分槽位存的是相同转移。
+    本经验池对 (地图, 格子, 动作, 下一格子, 奖励, done, 折扣) 相同的转移只保存一份并记录出现次数，
+    采样概率正比于 count**count_exponent：1 为原始的经验分布，0 为对不同转移均匀采样，
+    correct_bias=True 时用IS权重校正回原始经验分布。容量按不同转移数计，满了以后按先进先出淘汰"""
+    prioritized = False
+
+    def __init__(self, capacity, count_exponent=1.0, correct_bias=True):
+        self.tree = SumTree(capacity)
+        self.capacity = capacity
+        self.count_exponent = count_exponent
+        self.correct_bias = correct_bias
+        self.counts = np.zeros(capacity)
+        self.base_priorities = np.ones(capacity)
+        self.keys = [None] * capacity
+        self.index = {}
+        self.map_ids = np.full(capacity, -1, dtype=np.int64)
+        self.versions = np.zeros(capacity, dtype=np.int64)  # 槽位被新转移占用或删除的次数
+        self.valid = np.zeros(capacity, dtype=bool)  # 被filter删除的槽位为False，直到被新转移占用
+        self.num_valid = 0
+
+    def transition_key(self, state, action, reward, next_state, done, discount, map_id):
+        # 每个通道的最大值位置：通道0为智能体所在格子（值为2），目标条件状态的通道1为目标格子
+        cell = tuple(state.view(state.shape[1], -1).argmax(1).tolist())
+        next_cell = -1 if next_state is None else tuple(next_state.view(next_state.shape[1], -1).argmax(1).tolist())
+        return map_id, cell, action, next_cell, round(float(reward), 6), bool(done), round(float(discount), 6)
+
+    def new_priority(self):
+        return 1.0
+
+    def push(self, state, action, reward, next_state, done, discount=GAMMA, map_id=-1, priority=None):
+        key = self.transition_key(state, action, reward, next_state, done, discount, map_id)
+        slot = self.index.get(key)
+        priority = self.new_priority() if priority is None else priority
+        if slot is None:
+            slot = self.tree.data_pointer
+            if self.keys[slot] is not None:
+                self.index.pop(self.keys[slot], None)  # 淘汰最早加入的转移
+            self.keys[slot] = key
+            self.index[key] = slot
+            self.counts[slot] = 1
+            self.base_priorities[slot] = priority
+            self.map_ids[slot] = map_id
+            self.versions[slot] += 1
+            if not self.valid[slot]:
+                self.valid[slot] = True
+                self.num_valid += 1
+            self.tree.add(self.leaf_priority(slot), (state, action, reward, next_state, done, discount))
+        else:
+            self.counts[slot] += 1
+            self.base_priorities[slot] = max(self.base_priorities[slot], priority)
+            self.tree.update(slot + self.capacity - 1, self.leaf_priority(slot))
+
+    def leaf_priority(self, slot):
+        return self.counts[slot] ** self.count_exponent * self.base_priorities[slot]
+
+    def sample(self, batch_size, beta=0.4):
+        if self.num_valid == 0:
+            return [], [], np.array([])
+        indices, weights = self.draw(np.random.random(batch_size), beta)
+        return self.gather(indices), indices, weights
+
+    def draw(self, u, beta=0.4):
+        """分层采样，返回槽位下标和IS权重（校正到按出现次数的原始经验分布）"""
+        batch_size = len(u)
+        total_priority = self.tree.total_priority()
+        values = (np.arange(batch_size) + u) * (total_priority / batch_size)
+        slots = self.tree.retrieve_batch(values) - self.capacity + 1
+        if not self.correct_bias:
+            return slots, np.ones(batch_size, dtype=np.float32)
+        probs = self.tree.tree[slots + self.capacity - 1] / total_priority
+        empirical = self.counts[slots] / max(self.counts[:self.tree.size].sum(), 1)
+        weights = np.power(np.maximum(probs, 1e-12) / np.maximum(empirical, 1e-12), -self.weight_exponent(beta))
+        return slots, (weights / weights.max()).astype(np.float32)
+
+    def weight_exponent(self, beta):
+        return 1.0  # 非优先级经验池完全校正计数重加权带来的偏差
+
+    def gather(self, indices):
+        return list(self.tree.data[np.asarray(indices)])
+
+    def slot_versions(self, indices):
+        return self.versions[np.asarray(indices)]
+
+    def update_priorities(self, indices, priorities):
+        pass  # 非优先级版本没有TD优先级
+
+    def stored_slots(self):
+        """未被删除的转移所在的槽位，stored_map_ids / stored_transitions / filter 都按它对齐"""
+        return np.flatnonzero(self.valid[:self.tree.size])
+
+    def stored_map_ids(self):
+        return self.map_ids[self.stored_slots()]
+
+    def stored_transitions(self):
+        return list(self.tree.data[self.stored_slots()])
+
+    def filter(self, keep):
+        """keep 与 stored_transitions() 对齐：keep为False的转移不再被采样，并从去重索引中移除"""
+        removed = self.stored_slots()[~keep]
+        for slot in removed:
+            self.index.pop(self.keys[slot], None)
+            self.keys[slot] = None
+            self.counts[slot] = 0
+            self.versions[slot] += 1
+            self.tree.update(slot + self.capacity - 1, 0)
+        self.valid[removed] = False
+        self.num_valid -= len(removed)
+
     def __len__(self):
-        return self.tree.size
+        return self.num_valid
+
+class CountPrioritizedReplayMemory(CountReplayMemory):
+    """去重计数经验池的优先级版本：叶子优先级为 count**count_exponent * (|TD|+eps)**alpha，
+    优先级更新次数只与不同转移的数量有关"""
+    prioritized = True
+
+    def __init__(self, capacity, alpha=0.6, count_exponent=1.0):
+        super().__init__(capacity, count_exponent)
+        self.alpha = alpha
+        self.epsilon = 1e-6
+        self.max_priority = 1.0
+
+    def new_priority(self):
+        return self.max_priority
+
+    def weight_exponent(self, beta):
+        return beta
+
+    def update_priorities(self, indices, priorities):
+        priorities = np.power(np.asarray(priorities) + self.epsilon, self.alpha)
+        for slot, priority in zip(indices, priorities):
+            if self.counts[slot] == 0:
+                continue  # 已被filter删除
+            self.base_priorities[slot] = priority
+            self.max_priority = max(self.max_priority, priority)
+            self.tree.update(slot + self.capacity - 1, self.leaf_priority(slot))
+
+# 基于排名的优先级经验池
+RANK_SORT_INTERVAL = 1000  # 累计多少次优先级变化（新经验或TD更新）后重新排序
+RANK_SORT_FRACTION = 0.01  # 大容量时重新排序的间隔至少为已排名经验数的这一比例，使排序开销均摊后与容量无关
+
+class RankPrioritizedReplayMemory:
+    """按TD误差排名的优先级经验回放：第 i 名的采样概率正比于 (1/i)**alpha，只依赖排名而不依赖TD误差的大小，
+    对离群值不敏感。排名不实时维护，优先级累计变化 RANK_SORT_INTERVAL 次（经验较少时为经验条数，
+    大容量时为 RANK_SORT_FRACTION 比例的经验条数）后在下一次采样前整体重新排序（均摊）；按 (排名数, 批大小, alpha) 缓存把概率质量等分为批大小个区间的边界和IS权重，
+    每次抽样只需在对应区间内均匀取一个排名，为O(1)。新经验的优先级为当前最大值，重新排序后排在最前"""
+    prioritized = True
+
+    def __init__(self, capacity, alpha=0.7, sort_interval=None):
+        self.capacity = capacity
+        self.alpha = alpha
+        self.sort_interval = sort_interval or RANK_SORT_INTERVAL
+        self.data = np.zeros(capacity, dtype=object)
+        self.priorities = np.zeros(capacity)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.num_valid = 0
+        self.map_ids = np.full(capacity, -1, dtype=np.int64)
+        self.versions = np.zeros(capacity, dtype=np.int64)
+        self.position = 0
+        self.size = 0
+        self.max_priority = 1.0
+        self.order = np.zeros(0, dtype=np.int64)  # 上次排序时的槽位，按优先级从高到低
+        self.changes = 0
+        self.sorts = 0
+        self.segment_cache = {}
+
+    def push(self, state, action, reward, next_state, done, discount=GAMMA, map_id=-1, priority=None):
+        slot = self.position
+        self.data[slot] = (state, action, reward, next_state, done, discount)
+        self.priorities[slot] = self.max_priority if priority is None else priority
+        if not self.valid[slot]:
+            self.valid[slot] = True
+            self.num_valid += 1
+        self.map_ids[slot] = map_id
+        self.versions[slot] += 1
+        self.position = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.changes += 1
+
+    def sort(self):
+        """在上次排序结果的基础上重新排序：数据基本有序，稳定排序（timsort）只需处理变化的部分"""
+        ranked = np.zeros(self.size, dtype=bool)
+        ranked[self.order] = True
+        slots = np.concatenate((self.order, np.flatnonzero(~ranked)))
+        slots = slots[self.valid[slots]]
+        self.order = slots[np.argsort(-self.priorities[slots], kind='stable')]
+        self.changes = 0
+        self.sorts += 1
+
+    def segments(self, num_ranks, batch_size):
+        """把排名 1..num_ranks 的概率质量等分为 batch_size 段：返回各段起点、宽度和段内每个排名的归一化IS权重指数底"""
+        key = (num_ranks, batch_size, self.alpha)
+        cached = self.segment_cache.get(key)
+        if cached is None:
+            probs = np.arange(1, num_ranks + 1, dtype=np.float64) ** -self.alpha
+            cdf = np.cumsum(probs / probs.sum())
+            bounds = np.searchsorted(cdf, np.arange(1, batch_size) / batch_size, side='right')
+            starts = np.concatenate(([0], bounds))
+            ends = np.concatenate((bounds, [num_ranks]))
+            starts = np.minimum(starts, num_ranks - 1)
+            widths = np.maximum(ends - starts, 1)
+            # 段内均匀抽样时每个排名被抽中的概率为 1 / (batch_size * width)
+            sample_probs = 1.0 / (batch_size * widths)
+            cached = (starts, widths, num_ranks * sample_probs)
+            if len(self.segment_cache) >= 64:
+                self.segment_cache.clear()
+            self.segment_cache[key] = cached
+        return cached
+
+    def sample(self, batch_size, beta=0.4):
+        if self.num_valid == 0:
+            return [], [], np.array([])
+        indices, weights = self.draw(np.random.random(batch_size), beta)
+        return self.gather(indices), indices, weights
+
+    def draw(self, u, beta=0.4):
+        """第j个样本在第j段内均匀抽取一个排名，返回槽位和归一化的IS权重"""
+        ranked = len(self.order)
+        if ranked == 0 or self.changes >= min(max(self.sort_interval, int(ranked * RANK_SORT_FRACTION)), ranked):
+            self.sort()
+        starts, widths, scaled_probs = self.segments(len(self.order), len(u))
+        ranks = np.minimum(starts + (u * widths).astype(np.int64), len(self.order) - 1)
+        weights = np.power(scaled_probs, -beta)
+        return self.order[ranks], (weights / weights.max()).astype(np.float32)
+
+    def gather(self, indices):
+        return list(self.data[np.asarray(indices)])
+
+    def slot_versions(self, indices):
+        return self.versions[np.asarray(indices)]
+
+    def update_priorities(self, indices, priorities):
+        priorities = np.abs(np.asarray(priorities, dtype=np.float64))
+        indices = np.asarray(indices)
+        live = self.valid[indices]
+        self.priorities[indices[live]] = priorities[live]
+        if live.any():
+            self.max_priority = max(self.max_priority, float(priorities[live].max()))
+        self.changes += int(live.sum())
+
+    def stored_slots(self):
+        """未被删除的经验所在的槽位，stored_map_ids / stored_transitions / filter 都按它对齐"""
+        return np.flatnonzero(self.valid[:self.size])
+
+    def stored_map_ids(self):
+        return self.map_ids[self.stored_slots()]
+
+    def stored_transitions(self):
+        return list(self.data[self.stored_slots()])
+
+    def filter(self, keep):
+        """keep 与 stored_transitions() 对齐：keep为False的经验不再参与排名和采样，之后会被新经验覆盖"""
+        removed = self.stored_slots()[~keep]
+        if len(removed):
+            self.valid[removed] = False
+            self.versions[removed] += 1
+            self.num_valid -= len(removed)
+            self.sort()
+
+    def __len__(self):
+        return self.num_valid
+
+# 经验池实现选择：'standard' 为原始实现（按比例的SumTree PER），'dedup' 为去重计数经验池，
+# 'rank' 的优先级经验池改为按排名的 RankPrioritizedReplayMemory（非优先级经验池与 'standard' 相同）
+REPLAY_ENGINE = 'standard'
+# 去重经验池的采样重加权指数：1 按原始经验分布采样，0 对不同转移均匀采样
+DEDUP_COUNT_EXPONENT = 1.0
+
+def make_replay_pool(capacity, prioritized=False, alpha=0.6):
+    """按 REPLAY_ENGINE 创建单个经验池，双经验池和PER-DDQN都通过它创建"""
+    if REPLAY_ENGINE == 'dedup':
+        if prioritized:
+            return CountPrioritizedReplayMemory(capacity, alpha, count_exponent=DEDUP_COUNT_EXPONENT)
+        return CountReplayMemory(capacity, count_exponent=DEDUP_COUNT_EXPONENT)
+    if REPLAY_ENGINE == 'rank' and prioritized:
+        return RankPrioritizedReplayMemory(capacity, alpha)
+    return PrioritizedReplayMemoryV1(capacity, alpha) if prioritized else ReplayMemory(capacity)
+
 # 定义双经验池类
 class DualPrioritizedReplayMemory:
     def __init__(self, normal_capacity, elite_capacity, alpha=0.7, elite_threshold=2, p0=0.4, p1=0.5, beta_t=0.4):
-        self.normal_memory = PrioritizedReplayMemoryV1(normal_capacity, alpha)
-        self.elite_memory = PrioritizedReplayMemoryV1(elite_capacity, alpha)
+        self.normal_memory = make_replay_pool(normal_capacity, prioritized=True, alpha=alpha)
+        self.elite_memory = make_replay_pool(elite_capacity, prioritized=True, alpha=alpha)
         self.elite_threshold = elite_threshold
         self.normal_ratio = 0.5  # 初始采样比例
         self.alpha = alpha
-        self.last_indices_type = None
+        self.sampler = MultiPoolSampler([self.normal_memory, self.elite_memory])
 
         # 动态调整相关属性（保留必要参数）
         self.min_ratio = 0.3  # 最小采样比例
@@ -345,19 +1112,15 @@ class DualPrioritizedReplayMemory:
         self.current_episode = 0
         self.epsilon_t = 1.0  # 初始化衰减因子
 
-        # 用于计算平均损失
-        self.normal_losses = []
-        self.elite_losses = []
-
-    def push(self, state, action, reward, next_state, done):
+    def push(self, state, action, reward, next_state, done, discount=GAMMA, is_episode_end=True, map_id=-1):
         # 根据奖励决定存入哪个池
         if reward >= self.elite_threshold:
-            self.elite_memory.push(state, action, reward, next_state, done)
+            self.elite_memory.push(state, action, reward, next_state, done, discount, map_id)
         else:
-            self.normal_memory.push(state, action, reward, next_state, done)
+            self.normal_memory.push(state, action, reward, next_state, done, discount, map_id)
 
-        # 每隔固定episodes调整采样比例
-        if done:
+        # 每隔固定episodes调整采样比例（n步清空缓存时只在最后一条转移上计数）
+        if done and is_episode_end:
             self.current_episode += 1
             if self.current_episode % 10 == 0:
                 self.adjust_sampling_ratio()
@@ -370,8 +1133,7 @@ class DualPrioritizedReplayMemory:
         self.epsilon_t = max(0.01, self.epsilon_t * 0.995)  # 缓慢衰减
 
         # 计算平均损失
-        l0 = np.mean(self.normal_losses) if self.normal_losses else 0
-        l1 = np.mean(self.elite_losses) if self.elite_losses else 0
+        l0, l1 = self.sampler.mean_losses()
         total_loss = l0 + l1 if (l0 + l1) > 0 else 1  # 避免除零
 
         if t < self.beta_t:  # 在辅助训练阶段
@@ -384,8 +1146,7 @@ class DualPrioritizedReplayMemory:
         self.normal_ratio = max(self.min_ratio, min(self.max_ratio, self.normal_ratio))
 
         # 清空损失记录
-        self.normal_losses = []
-        self.elite_losses = []
+        self.sampler.reset_losses()
 
     def get_memory_stats(self):
         return {
@@ -395,85 +1156,19 @@ class DualPrioritizedReplayMemory:
         }
 
     def sample(self, batch_size, beta=0.4):
-        # 如果两个池都是空的，返回空列表
-        if self.normal_memory.tree.size == 0 and self.elite_memory.tree.size == 0:
-            self.last_indices_type = "empty"
-            return [], [], np.array([])
-        
-        # 根据比例从两个经验池中抽样
-        normal_size = int(batch_size * self.normal_ratio)
-        elite_size = batch_size - normal_size
-        
-        # 确保两个池子都有足够的样本
-        if (self.normal_memory.tree.size < normal_size) and (self.elite_memory.tree.size < elite_size):
-            normal_size = self.normal_memory.tree.size
-            elite_size = self.elite_memory.tree.size
-        
-        if self.normal_memory.tree.size < normal_size:
-            normal_size = self.normal_memory.tree.size
-            elite_size = min(batch_size - normal_size, self.elite_memory.tree.size)
-        
-        if self.elite_memory.tree.size < elite_size:
-            elite_size = self.elite_memory.tree.size
-            normal_size = min(batch_size - elite_size, self.normal_memory.tree.size)
-        
-        # 如果一个池为空，则从另一个池中抽取全部样本
-        if normal_size == 0:
-            self.last_indices_type = "elite_only"
-            return self.elite_memory.sample(elite_size, beta)
-        
-        if elite_size == 0:
-            self.last_indices_type = "normal_only"
-            return self.normal_memory.sample(normal_size, beta)
-        
-        # 从两个池中抽样
-        normal_batch, normal_indices, normal_weights = self.normal_memory.sample(normal_size, beta)
-        elite_batch, elite_indices, elite_weights = self.elite_memory.sample(elite_size, beta)
-        
-        # 合并样本
-        batch = normal_batch + elite_batch
-        
-        # 使用两个独立的索引列表
-        self.last_normal_indices = normal_indices
-        self.last_elite_indices = elite_indices
-        self.last_indices_type = "mixed"
-        
-        # 合并权重
-        weights = np.concatenate((normal_weights, elite_weights))
-        
-        return batch, (normal_indices, elite_indices), weights
+        # 根据比例从两个经验池中抽样，某个池样本不足时由另一个池补足
+        self.sampler.set_ratios((self.normal_ratio, 1 - self.normal_ratio))
+        return self.sampler.sample(batch_size, beta)
 
     def update_priorities(self, indices, priorities):
-        if self.last_indices_type == "empty":
-            return
-        
-        if self.last_indices_type == "normal_only":
-            self.normal_memory.update_priorities(indices, priorities)
-            self.normal_losses.extend(priorities)  # 记录损失
-            return
-        
-        if self.last_indices_type == "elite_only":
-            self.elite_memory.update_priorities(indices, priorities)
-            self.elite_losses.extend(priorities)  # 记录损失
-            return
-        
-        if self.last_indices_type == "mixed":
-            normal_indices, elite_indices = indices
-            normal_size = len(normal_indices)
-            
-            # 分别更新两个池的优先级
-            if len(normal_indices) > 0:
-                normal_priorities = priorities[:normal_size]
-                self.normal_memory.update_priorities(normal_indices, normal_priorities)
-                self.normal_losses.extend(normal_priorities)  # 记录损失
-                
-            if len(elite_indices) > 0:
-                elite_priorities = priorities[normal_size:]
-                self.elite_memory.update_priorities(elite_indices, elite_priorities)
-                self.elite_losses.extend(elite_priorities)  # 记录损失
+        # 分别更新两个池的优先级并记录损失
+        self.sampler.update_priorities(indices, priorities)
     
+    def stored_map_ids(self):
+        return np.concatenate((self.normal_memory.stored_map_ids(), self.elite_memory.stored_map_ids()))
+
     def __len__(self):
-        return self.normal_memory.tree.size + self.elite_memory.tree.size
+        return len(self.normal_memory) + len(self.elite_memory)
 
 def initialize_q_values(map, target_pos):
     rows, cols = map.shape
@@ -501,8 +1196,8 @@ def initialize_network_weights(net, map_array, target_pos):
             if map_array[r, c] == 0:
                 with torch.no_grad():
                     q_outputs = net(state)
-                    for action in range(4):
-                        q_outputs[0, action] = q_values[r, c, action]
+                    for action in range(q_outputs.shape[1]):
+                        q_outputs[0, action] = q_values[r, c, action % 4]  # 宏动作取其方向的初始值
                     net.fc2.bias.data = q_outputs[0]
 # 共用函数
 def matrix_to_img(pos, map_array):
@@ -511,18 +1206,295 @@ def matrix_to_img(pos, map_array):
     state[row, col] = 2
     return torch.tensor(state, dtype=torch.float32).unsqueeze(0).unsqueeze(0).to(device)
 
+# 动作编号与位移对应关系（上下左右），与step函数一致
+ACTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+# 有效动作屏蔽：不选择撞墙/撞障碍物的动作，设为False可恢复原来的行为
+USE_ACTION_MASK = True
+
+# 宏动作：动作编号 a 表示沿方向 ACTIONS[a % 4] 最多走 a // 4 + 1 格，1 为原始的单格动作
+MACRO_MAX_LENGTH = 1
+
+def tile_action_mask(mask, num_actions):
+    """把按方向的有效动作（最后一维为4）扩展到宏动作：宏动作有效当且仅当其方向的第一格有效"""
+    repeats = num_actions // len(ACTIONS)
+    if repeats == 1:
+        return mask
+    if isinstance(mask, torch.Tensor):
+        return mask.repeat(*([1] * (mask.dim() - 1)), repeats)
+    return np.tile(mask, repeats)
+
+def valid_action_mask(map_array):
+    """每个格子的四个动作是否移动到界内的可通行格子，形状为 (rows, cols, 4)"""
+    rows, cols = map_array.shape
+    padded = np.pad(map_array, 1, constant_values=1)
+    return np.stack([padded[1 + dr:1 + dr + rows, 1 + dc:1 + dc + cols] == 0 for dr, dc in ACTIONS], axis=-1)
+
+def action_mask_from_states(states):
+    """直接从状态图像批量计算有效动作，返回 (B, 4) 的布尔张量；无有效动作的状态不做屏蔽。
+    只使用通道0（地图和智能体位置），目标条件状态的目标通道被忽略"""
+    batch_size, _, rows, cols = states.shape
+    grid = states[:, 0]
+    padded = F.pad(grid, (1, 1, 1, 1), value=1).reshape(batch_size, -1)
+    agent = grid.reshape(batch_size, -1).argmax(1)  # 智能体所在格子值为2
+    agent_padded = (agent // cols + 1) * (cols + 2) + agent % cols + 1
+    offsets = torch.tensor([dr * (cols + 2) + dc for dr, dc in ACTIONS], device=states.device)
+    mask = padded.gather(1, agent_padded.unsqueeze(1) + offsets) != 1
+    mask[~mask.any(1)] = True
+    return mask
+
+def greedy_action(policy_net, state, valid_actions=None):
+    """贪婪动作，valid_actions为长度4的布尔数组时只在有效动作中选择"""
+    with torch.no_grad():
+        q_values = policy_net(state)
+    if valid_actions is not None and valid_actions.any():
+        valid_actions = tile_action_mask(torch.as_tensor(valid_actions, device=q_values.device), q_values.shape[1])
+        q_values = q_values.masked_fill(~valid_actions, float('-inf'))
+    return q_values.max(1)[1].item()
+
+def select_next_actions(policy_net, next_states):
+    """Double DQN中由策略网络为下一状态选择动作（可选地屏蔽无效动作）"""
+    q_values = policy_net(next_states)
+    if USE_ACTION_MASK:
+        q_values = q_values.masked_fill(~tile_action_mask(action_mask_from_states(next_states), q_values.shape[1]),
+                                        float('-inf'))
+    return q_values.max(1)[1].unsqueeze(1)
+
 #贪婪策略选择动作函数
-def choose_action(state, policy_net, epsilon):
+def choose_action(state, policy_net, epsilon, valid_actions=None):
     if random.random() < epsilon:
-        return random.randint(0, 3)  #
+        num_actions = policy_net.fc2.out_features
+        if valid_actions is not None and valid_actions.any():
+            return random.choice([a for a in range(num_actions) if valid_actions[a % 4]])
+        return random.randint(0, num_actions - 1)  #
     else:
-        with torch.no_grad():
-            return policy_net(state).max(1)[1].view(1, 1).item()
+        return greedy_action(policy_net, state, valid_actions)
   
 #软更细机制
 def soft_update(target_net, policy_net, tau):
     for target_param, policy_param in zip(target_net.parameters(), policy_net.parameters()):
         target_param.data.copy_(tau * policy_param.data + (1.0 - tau) * target_param.data)
+
+# 学习调度器
+class LearnerScheduler:
+    """控制环境交互与学习的比例：每replay_interval个环境步触发一次学习，每次做updates_per_trigger次梯度更新，
+    前warmup_steps步只收集经验不学习。target_sync_interval为None时每次更新后按tau软更新目标网络，
+    否则每target_sync_interval次更新硬同步一次。
+    schedule 为 [(起始环境步, {参数名: 新值}), ...]，训练到对应步数后覆盖参数，用于随训练进程调整"""
+    def __init__(self, replay_interval=None, updates_per_trigger=1, batch_size=None, warmup_steps=0,
+                 tau=0.01, target_sync_interval=None, schedule=None):
+        self.replay_interval = replay_interval or REPLAY_INTERVAL
+        self.updates_per_trigger = updates_per_trigger
+        self.batch_size = batch_size or BATCH_SIZE
+        self.warmup_steps = warmup_steps
+        self.tau = tau
+        self.target_sync_interval = target_sync_interval
+        self.schedule = sorted(schedule or [], key=lambda phase: phase[0])
+        self.env_steps = 0
+        self.updates = 0
+        self.samples_drawn = 0
+
+    def updates_due(self, steps_done, memory_size):
+        """每个环境步调用一次，返回本步需要做的梯度更新次数"""
+        self.env_steps = steps_done + 1
+        while self.schedule and steps_done >= self.schedule[0][0]:
+            for name, value in self.schedule.pop(0)[1].items():
+                setattr(self, name, value)
+        if steps_done < self.warmup_steps or steps_done % self.replay_interval != 0:
+            return 0
+        if memory_size < self.batch_size:
+            return 0
+        return self.updates_per_trigger
+
+    def record_batch(self, num_samples):
+        """由 optimize_* 在完成一次更新时调用，记录实际抽到的样本数（可能少于 batch_size）"""
+        self.samples_drawn += num_samples
+
+    def after_update(self, target_net, policy_net):
+        """每次梯度更新后调用：统计更新次数并同步目标网络"""
+        self.updates += 1
+        if self.target_sync_interval is None:
+            soft_update(target_net, policy_net, self.tau)
+        elif self.updates % self.target_sync_interval == 0:
+            target_net.load_state_dict(policy_net.state_dict())
+
+    def stats(self):
+        # sample_reuse: 平均每条收集到的经验被用于训练的次数
+        return {
+            'updates': self.updates,
+            'samples_drawn': self.samples_drawn,
+            'env_steps': self.env_steps,
+            'sample_reuse': self.samples_drawn / self.env_steps if self.env_steps else 0.0,
+        }
+
+# 后台预取的批次数上限，0为不预取。预取线程与环境交互并发使用全局随机数，开启后固定种子的训练不再可复现
+PREFETCH_DEPTH = 0
+
+class BatchPrefetcher:
+    """包装经验池：后台线程提前抽样并用 collate_batch 整理好下一批训练数据，环境交互期间抽样和整理同时进行。
+    队列最多缓存 depth 个批次；push/sample/update_priorities 由同一把锁保护，其余属性直接转发给经验池。
+    抽样时记录各槽位的版本号，优先级更新到达时槽位已被新经验覆盖（或被filter删除）的部分会被丢弃"""
+    def __init__(self, memory, batch_size=None, beta=0.4, depth=PREFETCH_DEPTH):
+        self.memory = memory
+        self.batch_size = batch_size or BATCH_SIZE
+        self.beta = beta
+        self.queue = Queue(maxsize=max(depth, 1))
+        self.lock = threading.Lock()
+        self.data_ready = threading.Event()
+        self.stopped = threading.Event()
+        self.pending_versions = None
+        self.prefetched = 0
+        self.sync_batches = 0
+        self.stale_updates = 0
+        self.sample_time = 0.0
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.memory, name)
+
+    def __len__(self):
+        return len(self.memory)
+
+    def push(self, *args, **kwargs):
+        with self.lock:
+            self.memory.push(*args, **kwargs)
+        if len(self.memory) >= self.batch_size:
+            self.data_ready.set()
+
+    def _versions(self, indices):
+        """抽样下标对应槽位的当前版本号，经验池不记录版本时返回None"""
+        if isinstance(indices, tuple):  # MultiPoolSampler 的 (池编号数组, 池内下标数组)
+            pool_ids, pool_indices = indices
+            pools = [(k, pool) for k, pool in enumerate(self.memory.sampler.pools) if hasattr(pool, 'slot_versions')]
+            if not pools:
+                return None
+            versions = np.zeros(len(pool_ids), dtype=np.int64)
+            for k, pool in pools:
+                mask = pool_ids == k
+                versions[mask] = pool.slot_versions(pool_indices[mask])
+            return versions
+        if indices is None or not hasattr(self.memory, 'slot_versions'):
+            return None
+        return self.memory.slot_versions(indices)
+
+    def _draw(self, batch_size, beta):
+        """锁内抽样并记录版本号，锁外整理成张量"""
+        with self.lock:
+            batch, indices, weights = self.memory.sample(batch_size, beta)
+            versions = self._versions(indices)
+        if len(batch) > 0:
+            batch = ColumnBatch(collate_batch(batch))
+        return batch_size, beta, batch, indices, weights, versions
+
+    def _worker(self):
+        while not self.stopped.is_set():
+            if len(self.memory) < self.batch_size:
+                self.data_ready.clear()
+                self.data_ready.wait(0.05)
+                continue
+            start_time = time.perf_counter()
+            item = self._draw(self.batch_size, self.beta)
+            self.sample_time += time.perf_counter() - start_time
+            while not self.stopped.is_set():
+                try:
+                    self.queue.put(item, timeout=0.05)
+                    break
+                except Full:
+                    continue
+
+    def sample(self, batch_size, beta=0.4):
+        """优先返回预取的批次；批大小或beta改变后，按旧配置预取的批次被丢弃，队列为空时同步抽样"""
+        self.batch_size, self.beta = batch_size, beta
+        item = None
+        while item is None:
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                break
+            if item[:2] != (batch_size, beta):
+                item = None
+        if item is None:
+            item = self._draw(batch_size, beta)
+            self.sync_batches += 1
+        else:
+            self.prefetched += 1
+        _, _, batch, indices, weights, self.pending_versions = item
+        return batch, indices, weights
+
+    def update_priorities(self, indices, priorities):
+        with self.lock:
+            versions = self._versions(indices)
+            if versions is not None and self.pending_versions is not None:
+                fresh = versions == self.pending_versions
+                if not fresh.all():
+                    self.stale_updates += int((~fresh).sum())
+                    priorities = np.asarray(priorities)[fresh]
+                    if isinstance(indices, tuple):
+                        indices = (indices[0][fresh], indices[1][fresh])
+                    else:
+                        indices = np.asarray(indices)[fresh]
+            self.memory.update_priorities(indices, priorities)
+
+    def close(self):
+        """停止预取线程，返回统计：预取命中、同步抽样、丢弃的过期优先级更新数和后台抽样耗时"""
+        self.stopped.set()
+        self.thread.join()
+        return {
+            'prefetched': self.prefetched,
+            'sync_batches': self.sync_batches,
+            'stale_updates': self.stale_updates,
+            'background_sample_time': self.sample_time,
+        }
+
+def start_prefetch(memory, scheduler):
+    """PREFETCH_DEPTH > 0 时用 BatchPrefetcher 包装经验池"""
+    if PREFETCH_DEPTH > 0:
+        return BatchPrefetcher(memory, scheduler.batch_size, depth=PREFETCH_DEPTH)
+    return memory
+
+def stop_prefetch(memory):
+    """停止预取并返回原经验池和预取统计（未预取时统计为None）"""
+    if isinstance(memory, BatchPrefetcher):
+        return memory.memory, memory.close()
+    return memory, None
+# 执行一次决策（单格动作或宏动作）
+def take_step(step_func, current_pos, action, target_pos, visited_positions, prev_action, *extra, gamma=GAMMA):
+    """单格动作直接调用 step_func；宏动作沿方向 action % 4 最多走 action // 4 + 1 格，到达终点时停止，
+    第一格之后前方是墙/障碍时停在障碍前（不走进去，也不计撞墙惩罚和时间步）。
+    每格奖励由 step_func 计算并按SMDP折扣累加 R = sum(gamma^i * r_i)。extra 为 step_v3 的 prev_actions。
+    返回 step_func 的结果并在末尾追加实际经过的时间步数 duration（自举折扣为 gamma^duration）"""
+    direction, length = action % len(ACTIONS), action // len(ACTIONS) + 1
+    if length == 1 and action == direction and (prev_action is None or prev_action < len(ACTIONS)):
+        return step_func(current_pos, action, target_pos, visited_positions, prev_action, *extra) + (1,)
+    if prev_action is not None:
+        prev_action %= len(ACTIONS)
+    dr, dc = ACTIONS[direction]
+    rows, cols = map.shape
+    total_reward = 0.0
+    duration = 0
+    while duration < length:
+        if duration > 0:
+            nr, nc = current_pos[0] + dr, current_pos[1] + dc
+            if not (0 <= nr < rows and 0 <= nc < cols and map[nr, nc] == 0):
+                break
+        result = step_func(current_pos, direction, target_pos, visited_positions, prev_action, *extra)
+        next_pos, reward, done, visited_positions = result[:4]
+        extra = result[4:]
+        total_reward += gamma ** duration * reward
+        duration += 1
+        if done or next_pos == current_pos:
+            break
+        current_pos = next_pos
+        prev_action = direction
+    return (next_pos, total_reward, done, visited_positions) + tuple(extra) + (duration,)
+
+def straight_cells(start, end):
+    """宏动作沿直线经过的格子（不含起点），单格动作时即 [end]"""
+    dr, dc = int(np.sign(end[0] - start[0])), int(np.sign(end[1] - start[1]))
+    steps = abs(end[0] - start[0]) + abs(end[1] - start[1])
+    return [(start[0] + dr * i, start[1] + dc * i) for i in range(1, steps + 1)] or [end]
+
 #测试函数
 def test_net(policy_net, current_pos, target_pos, step_func):
     current_pos = start_pos
@@ -530,36 +1502,495 @@ def test_net(policy_net, current_pos, target_pos, step_func):
     prev_action = None
     prev_actions = []
     visited_positions = {}
+    valid_actions = valid_action_mask(map) if USE_ACTION_MASK else None
     for _ in range(100):  # 最多允许100步
         state = matrix_to_img(current_pos, map).to(device)
-        with torch.no_grad():
-            action = policy_net(state).max(1)[1].item()
+        action = greedy_action(policy_net, state,
+                               valid_actions[current_pos] if valid_actions is not None else None)
 
         # 根据step_func类型决定参数
         if step_func.__name__ == "step_v3":
-            result = step_func(current_pos, action, target_pos, visited_positions, prev_action, prev_actions)
-            if isinstance(result, tuple) and len(result) == 5:
-                next_pos, reward, done, visited_positions, prev_actions = result
-            else:
-                next_pos, reward, done = result
+            next_pos, reward, done, visited_positions, prev_actions, _ = take_step(
+                step_func, current_pos, action, target_pos, visited_positions, prev_action, prev_actions)
         else:
-            result = step_func(current_pos, action, target_pos, visited_positions, prev_action)
-            if isinstance(result, tuple) and len(result) == 4:
-                next_pos, reward, done, visited_positions = result
-            else:
-                next_pos, reward, done = result
+            next_pos, reward, done, visited_positions, _ = take_step(
+                step_func, current_pos, action, target_pos, visited_positions, prev_action)
 
-        path.append(next_pos)
+        path.extend(straight_cells(current_pos, next_pos))  # 宏动作记录经过的每个格子
         if done:
             break
         prev_action = action
         current_pos = next_pos
     return path
 
-import matplotlib.pyplot as plt
-import numpy as np
+class ConvergenceMonitor:
+    """收敛监控：记录每轮步数和奖励，并定期做贪婪路径检查，
+    贪婪路径到达终点且长度在连续window次检查中保持不变、同时最近各轮的步数和奖励趋于平稳时停止训练。
+    参数为None时使用模块级的 EARLY_STOP / CONVERGENCE_* 配置（创建时读取，运行时修改同样生效）"""
+    def __init__(self, window=None, check_interval=None, min_episodes=None, enabled=None, tolerance=None):
+        self.window = CONVERGENCE_WINDOW if window is None else window
+        self.check_interval = CONVERGENCE_CHECK_INTERVAL if check_interval is None else check_interval
+        self.min_episodes = CONVERGENCE_MIN_EPISODES if min_episodes is None else min_episodes
+        self.enabled = EARLY_STOP if enabled is None else enabled
+        self.tolerance = CONVERGENCE_TOLERANCE if tolerance is None else tolerance
+        self.episode_steps = []
+        self.episode_rewards = []
+        self.greedy_checks = []  # (episode, 路径长度, 是否到达终点)
+        self.stable_lengths = deque(maxlen=self.window)
+        self.stop_episode = None
+
+    def episodes_stable(self):
+        """最近 window * check_interval 轮的前后两半，平均步数和平均奖励的相对变化都不超过tolerance"""
+        if self.tolerance is None:
+            return True
+        span = self.window * self.check_interval
+        if len(self.episode_steps) < span:
+            return False
+        half = span // 2
+        for values in (self.episode_steps[-span:], self.episode_rewards[-span:]):
+            earlier, recent = np.mean(values[:half]), np.mean(values[half:])
+            if abs(recent - earlier) > self.tolerance * max(abs(earlier), 1.0):
+                return False
+        return True
+
+    def update(self, episode, steps, reward, greedy_path_fn):
+        """每轮结束时调用，返回True表示已收敛应停止训练"""
+        self.episode_steps.append(steps)
+        self.episode_rewards.append(reward)
+        if not self.enabled or (episode + 1) % self.check_interval != 0:
+            return False
+        path = greedy_path_fn()
+        reached = path[-1] == target_pos
+        self.greedy_checks.append((episode, len(path), reached))
+        if not reached or (self.stable_lengths and self.stable_lengths[-1] != len(path)):
+            self.stable_lengths.clear()
+        if reached:
+            self.stable_lengths.append(len(path))
+        if episode + 1 >= self.min_episodes and len(self.stable_lengths) == self.window and self.episodes_stable():
+            self.stop_episode = episode
+            return True
+        return False
+
+    def summary(self):
+        return {
+            'stop_episode': self.stop_episode,
+            'episodes': len(self.episode_steps),
+            'greedy_checks': self.greedy_checks,
+        }
+
+# 切换全局地图（step函数、test_net等均读取全局map）
+def use_map(map_array, map_index=-1):
+    global map, current_map_id
+    map = map_array
+    current_map_id = map_index
+
+def replay_map_counts(memory):
+    """统计经验池中各地图的经验条数"""
+    ids, counts = np.unique(memory.stored_map_ids(), return_counts=True)
+    return {int(i): int(c) for i, c in zip(ids, counts)}
+
+# 内存统计
+MEMORY_REPORT_INTERVAL = 50  # 训练中每隔多少轮记录一次内存统计，0为只在训练结束时记录
+MEMORY_REPORT_SAMPLE = 256  # 估算每条经验字节数时抽查的经验条数，使每次统计的开销与经验池容量无关
+
+def storage_nbytes(tensor, seen):
+    """张量底层存储的字节数，返回 (字节数, 是否已被统计过)；多个张量共享同一存储时只计一次"""
+    storage = tensor.untyped_storage()
+    key = storage.data_ptr()
+    if key in seen:
+        return storage.nbytes(), True
+    seen.add(key)
+    return storage.nbytes(), False
+
+def container_nbytes(obj, seen):
+    """对象属性中numpy数组、张量、列表和字典（浅层）占用的字节数，用于缓存、地图库、SumTree、采样器等结构；
+    元素为数组或张量的列表（如地图库的地图列表）同时统计元素本身"""
+    total = 0
+    for value in vars(obj).values():
+        if isinstance(value, np.ndarray):
+            total += value.nbytes
+        elif torch.is_tensor(value):
+            nbytes, shared = storage_nbytes(value, seen)
+            total += 0 if shared else nbytes
+        elif isinstance(value, (list, dict, deque)):
+            total += sys.getsizeof(value)
+            if isinstance(value, list) and value and isinstance(value[0], np.ndarray):
+                total += sum(item.nbytes for item in value if isinstance(item, np.ndarray))
+    return total
+
+def replay_pools(memory):
+    """经验池中实际存放经验的子池，按 (名称, 池) 返回；near池排在all池之后，便于统计共享的张量"""
+    if isinstance(memory, BatchPrefetcher):
+        memory = memory.memory
+    if getattr(memory, 'store', None) is not None:
+        return [('store', memory.store)]
+    pools = [(name, getattr(memory, name))
+             for name in ('all_memory', 'near_memory', 'normal_memory', 'elite_memory') if hasattr(memory, name)]
+    return pools or [('replay', memory)]
+
+def pool_memory(pool, seen):
+    """单个经验池的内存：经验本身（元组、标量、state/next_state张量）、与其它池共享的张量以及SumTree等结构开销。
+    列式存储直接按列的大小计算；其余经验池抽查 MEMORY_REPORT_SAMPLE 条经验按比例估算，共享张量的统计也是估计值"""
+    if isinstance(pool, ObstacleTransitionStore):
+        # 列式存储按容量预分配，近障碍物子集只是下标表
+        column_bytes = sum(storage_nbytes(c, seen)[0] for c in (pool.columns or {}).values())
+        structure_bytes = container_nbytes(pool, seen)
+        return {
+            'transitions': pool.size,
+            'near_transitions': pool.near_size,
+            'bytes_per_transition': column_bytes / pool.capacity,
+            'transition_bytes': column_bytes,
+            'shared_bytes': 0,
+            'tree_bytes': 0,
+            'total_bytes': column_bytes + structure_bytes,
+        }
+    # 只抽查等间隔的 MEMORY_REPORT_SAMPLE 条经验，按比例估算全部经验的字节数
+    transitions = pool.stored_transitions()
+    count = len(transitions)
+    sample = [transitions[i] for i in np.unique(np.linspace(0, count - 1, min(count, MEMORY_REPORT_SAMPLE),
+                                                             dtype=np.int64))] if count else []
+    transition_bytes = shared_bytes = 0
+    for transition in sample:
+        transition_bytes += sys.getsizeof(transition)
+        for item in transition:
+            if torch.is_tensor(item):
+                nbytes, shared = storage_nbytes(item, seen)
+                if shared:
+                    shared_bytes += nbytes
+                else:
+                    transition_bytes += nbytes
+            elif item is not None:
+                transition_bytes += sys.getsizeof(item)
+    scale = count / len(sample) if sample else 0.0
+    transition_bytes, shared_bytes = int(transition_bytes * scale), int(shared_bytes * scale)
+    tree_bytes = container_nbytes(pool.tree, seen) if hasattr(pool, 'tree') else 0
+    structure_bytes = container_nbytes(pool, seen) + tree_bytes
+    return {
+        'transitions': count,
+        'bytes_per_transition': (transition_bytes + shared_bytes) / count if count else 0.0,
+        'transition_bytes': transition_bytes,
+        'shared_bytes': shared_bytes,  # 已在其它池或缓存中统计过的张量，不计入total_bytes
+        'tree_bytes': tree_bytes,
+        'total_bytes': transition_bytes + structure_bytes,
+    }
+
+def memory_report(memory=None, policy_net=None, target_net=None, optimizer=None, caches=None):
+    """统计各组件占用的字节数：经验池、采样器损失累加器、网络参数、优化器状态和缓存（{名称: 对象}），
+    用于按节点内存确定经验池容量"""
+    seen = set()
+    report = {'pools': {}, 'models': {}, 'caches': {}}
+    # 先统计缓存，经验中引用缓存状态张量的部分记为共享
+    for name, cache in (caches or {}).items():
+        report['caches'][name] = container_nbytes(cache, seen)
+    if memory is not None:
+        for name, pool in replay_pools(memory):
+            report['pools'][name] = pool_memory(pool, seen)
+        if hasattr(memory, 'sampler'):
+            report['sampler_bytes'] = container_nbytes(memory.sampler, seen)
+    for name, net in (('policy_net', policy_net), ('target_net', target_net)):
+        if net is not None:
+            report['models'][name] = sum(t.nelement() * t.element_size()
+                                         for t in list(net.parameters()) + list(net.buffers()))
+    if optimizer is not None:
+        report['models']['optimizer'] = sum(v.nelement() * v.element_size() for state in optimizer.state.values()
+                                            for v in state.values() if torch.is_tensor(v))
+    report['total_bytes'] = (sum(p['total_bytes'] for p in report['pools'].values())
+                             + report.get('sampler_bytes', 0)
+                             + sum(report['models'].values()) + sum(report['caches'].values()))
+    return report
+
+class MemoryMonitor:
+    """训练中每隔interval轮采样一次 memory_report，summary() 返回 [(episode, report), ...]"""
+    def __init__(self, interval=MEMORY_REPORT_INTERVAL):
+        self.interval = interval
+        self.reports = []
+
+    def update(self, episode, memory, policy_net, target_net, optimizer, final=False, caches=None):
+        """caches 为 {名称: 对象}（如当前的 MapCache、地图库），与经验池和网络一起统计"""
+        due = self.interval and (episode + 1) % self.interval == 0
+        if due or (final and (not self.reports or self.reports[-1][0] != episode)):
+            self.reports.append((episode, memory_report(memory, policy_net, target_net, optimizer, caches)))
+
+    def summary(self):
+        return self.reports
+
+def evaluate_on_maps(policy_net, map_bank, map_ids, step_func):
+    """在指定地图上做贪婪测试，返回成功率、成功路径的平均长度以及逐图结果"""
+    previous_map, previous_id = map, current_map_id
+    results = []
+    for map_index in map_ids:
+        use_map(map_bank.maps[map_index], map_index)
+        path = test_net(policy_net, start_pos, target_pos, step_func)
+        results.append({
+            'map_id': map_index,
+            'obstacle_ratio': map_bank.obstacle_ratios[map_index],
+            'reached': path[-1] == target_pos,
+            'length': len(path),
+        })
+    use_map(previous_map, previous_id)
+    reached_lengths = [r['length'] for r in results if r['reached']]
+    return {
+        'success_rate': len(reached_lengths) / len(results) if results else 0.0,
+        'mean_length': float(np.mean(reached_lengths)) if reached_lengths else None,
+        'maps': results,
+    }
+
+def greedy_rollout(policy_net, map_array, start, goal, max_steps=100):
+    """不依赖训练全局变量的贪婪推演，撞墙/障碍时原地不动，返回路径"""
+    size = map_array.shape[0]
+    current_pos = tuple(start)
+    goal = tuple(goal)
+    path = [current_pos]
+    valid_actions = valid_action_mask(map_array) if USE_ACTION_MASK else None
+    for _ in range(max_steps):
+        state = matrix_to_img(current_pos, map_array)
+        action = greedy_action(policy_net, state,
+                               valid_actions[current_pos] if valid_actions is not None else None)
+        dr, dc = ACTIONS[action % len(ACTIONS)]
+        for k in range(action // len(ACTIONS) + 1):  # 宏动作逐格前进，到达终点或前方受阻时停止（与 take_step 相同）
+            nr, nc = current_pos[0] + dr, current_pos[1] + dc
+            if not (0 <= nr < size and 0 <= nc < size and map_array[nr, nc] == 0):
+                if k == 0:
+                    path.append(current_pos)  # 第一格就撞墙/障碍：原地不动也记一步
+                break
+            current_pos = (nr, nc)
+            path.append(current_pos)
+            if current_pos == goal:
+                break
+        if current_pos == goal:
+            break
+    return path
+
+# 异步评估：每隔 EVAL_INTERVAL 轮把策略快照交给独立进程做贪婪推演，0为不评估
+EVAL_INTERVAL = 0
+EVAL_STARTS = 5  # 除起点外额外评估的随机起点数（同一张地图上每次相同）
+EVAL_SHUTDOWN_TIMEOUT = 5.0  # 结束时向评估进程发送结束标记的等待秒数
+
+def evaluation_worker(tasks, results, in_channels, num_actions, num_starts, seed):
+    """评估进程：对每个快照从起点和随机起点做贪婪推演，返回起点路径的成功与否、长度、转折点数以及总体成功率。
+    spawn 的子进程重新导入本模块，看不到运行时修改的 MACRO_MAX_LENGTH，动作数由主进程传入"""
+    torch.set_num_threads(1)
+    try:
+        policy_net = DQN(in_channels, num_actions).to(device)
+        policy_net.eval()
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            episode, state_dict, map_array, start, goal = task
+            start_time = time.time()
+            try:
+                policy_net.load_state_dict(state_dict)
+                rng = np.random.default_rng(seed)
+                reachable = np.argwhere(bfs_distance_field(map_array, goal) > 0)
+                chosen = rng.choice(len(reachable), min(num_starts, len(reachable)), replace=False)
+                starts = [tuple(start)] + [tuple(int(v) for v in reachable[i]) for i in chosen]
+                paths = [greedy_rollout(policy_net, map_array, s, goal) for s in starts]
+            except Exception as e:  # 单个快照评估失败只记录错误，继续处理后续快照
+                results.put({'episode': episode, 'error': repr(e)})
+                continue
+            reached = [path[-1] == tuple(goal) for path in paths]
+            results.put({
+                'episode': episode,
+                'success': reached[0],
+                'path_length': len(paths[0]),
+                'turns': count_turns(paths[0]),
+                'success_rate': float(np.mean(reached)),
+                'eval_time': time.time() - start_time,
+            })
+    except Exception as e:
+        results.put({'episode': -1, 'error': repr(e)})
+    finally:
+        # 无论如何都发送结束标记，主进程据此停止等待
+        results.put(None)
+
+class AsyncEvaluator:
+    """每隔interval轮把策略网络的快照（CPU上的state_dict副本）交给评估进程，训练循环不等待评估结果。
+    评估进程还在处理上一个快照时新快照直接跳过；已完成的结果在每次 update 时取回，summary() 等待剩余评估结束"""
+    def __init__(self, interval=EVAL_INTERVAL, num_starts=EVAL_STARTS, seed=0):
+        self.interval = interval
+        self.num_starts = num_starts
+        self.seed = seed
+        self.process = None
+        self.results = []
+        self.skipped = 0
+
+    def _start(self, in_channels, num_actions):
+        ctx = mp.get_context('spawn')
+        self.tasks = ctx.Queue(maxsize=1)
+        self.outputs = ctx.Queue()
+        self.process = ctx.Process(target=evaluation_worker, daemon=True,
+                                   args=(self.tasks, self.outputs, in_channels, num_actions, self.num_starts, self.seed))
+        self.process.start()
+
+    def _collect(self, timeout=None):
+        """取回已完成的结果，timeout为None时不等待；收到结束标记时返回True"""
+        while True:
+            try:
+                result = self.outputs.get(block=False) if timeout is None else self.outputs.get(timeout=timeout)
+            except Empty:
+                return False
+            if result is None:
+                return True
+            self.results.append(result)
+            if 'error' in result:
+                print(f"Eval - Episode {result['episode']} failed: {result['error']}")
+            else:
+                print(f"Eval - Episode {result['episode']}, Success: {result['success']}, "
+                      f"Length: {result['path_length']}, Turns: {result['turns']}, "
+                      f"Success Rate: {result['success_rate']:.2f}")
+
+    def update(self, episode, policy_net, map_array, start, goal):
+        if not self.interval:
+            return
+        if self.process is None:
+            self._start(policy_net.conv1.in_channels, policy_net.fc2.out_features)
+        self._collect()
+        if (episode + 1) % self.interval != 0:
+            return
+        snapshot = {name: value.detach().to('cpu', copy=True) for name, value in policy_net.state_dict().items()}
+        try:
+            self.tasks.put_nowait((episode, snapshot, map_array.copy(), tuple(start), tuple(goal)))
+        except Full:
+            self.skipped += 1
+
+    def summary(self):
+        """结束评估进程并返回 [每个快照的评估结果, ...]（按轮次排序，评估失败的快照只有 episode 和 error）。
+        评估进程意外退出时不再等待结束标记"""
+        if self.process is not None:
+            try:
+                self.tasks.put(None, timeout=EVAL_SHUTDOWN_TIMEOUT)
+            except Full:
+                pass  # 评估进程已退出，队列中的快照无人取走
+            while not self._collect(timeout=1.0):
+                if not self.process.is_alive():
+                    self._collect()
+                    break
+            self.process.join(timeout=EVAL_SHUTDOWN_TIMEOUT)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        return sorted(self.results, key=lambda r: r['episode'])
+
+# 目标条件网络：目标位置作为输入的一部分，一个网络服务任意(起点, 终点)
+GOAL_REWARD = 20
+GOAL_MAX_STEPS = 200  # 目标条件训练每轮最多步数（起终点随机，远小于固定任务的3000）
+HER_K = 4  # 每步额外重标记的目标数
+GOAL_EVAL_PAIRS = 50
+
+def goal_states(map_array, positions, goals):
+    """批量构造目标条件状态 (B, 2, H, W)：通道0同 matrix_to_img（智能体格子为2），通道1为目标位置的one-hot；
+    map_array 可以是共用的 (H, W) 地图，也可以是每个状态各自的 (B, H, W) 地图"""
+    rows, cols = map_array.shape[-2:]
+    positions = torch.as_tensor(np.asarray(positions), dtype=torch.int64, device=device).view(-1, 2)
+    goals = torch.as_tensor(np.asarray(goals), dtype=torch.int64, device=device).view(-1, 2)
+    batch = torch.arange(len(positions), device=device)
+    states = torch.zeros((len(positions), 2, rows, cols), device=device)
+    states[:, 0] = torch.as_tensor(map_array, dtype=torch.float32, device=device)
+    states[batch, 0, positions[:, 0], positions[:, 1]] = 2
+    states[batch, 1, goals[:, 0], goals[:, 1]] = 1
+    return states
+
+def goal_reward(pos, next_pos, goal):
+    """只依赖 (位置, 下一位置, 目标) 的奖励，便于HER重标记时重新计算：到达目标+20，撞墙/障碍-5，其余每步-1"""
+    if next_pos == goal:
+        return GOAL_REWARD, True
+    if next_pos == pos:
+        return -5, False
+    return -1, False
+
+def step_goal(current_pos, action, goal):
+    """目标条件环境的单步转移，撞墙/障碍时原地不动"""
+    rows, cols = map.shape
+    dr, dc = ACTIONS[action]
+    nr, nc = current_pos[0] + dr, current_pos[1] + dc
+    next_pos = (nr, nc) if 0 <= nr < rows and 0 <= nc < cols and map[nr, nc] == 0 else current_pos
+    reward, done = goal_reward(current_pos, next_pos, goal)
+    return next_pos, reward, done
+
+def sample_start_goal(map_array):
+    """随机选取一个可通行起点和一个从起点可达的不同终点"""
+    free = np.argwhere(map_array == 0)
+    while True:
+        start = tuple(int(v) for v in free[np.random.randint(len(free))])
+        reachable = np.argwhere(bfs_distance_field(map_array, start) > 0)
+        if len(reachable) > 0:
+            return start, tuple(int(v) for v in reachable[np.random.randint(len(reachable))])
+
+def her_transitions(trajectory, goal, map_array, her_k=HER_K):
+    """轨迹 [(pos, action, next_pos), ...] 按原目标生成转移，并按 'future' 策略对每步随机选取
+    her_k 个之后实际到达的位置作为新目标重新计算奖励（hindsight experience replay）"""
+    transitions = []
+    for t, (pos, action, next_pos) in enumerate(trajectory):
+        goals = [goal] + [trajectory[random.randint(t, len(trajectory) - 1)][2] for _ in range(her_k)]
+        for g in goals:
+            if g == pos:
+                continue
+            reward, done = goal_reward(pos, next_pos, g)
+            state = goal_states(map_array, [pos], [g])
+            next_state = None if done else goal_states(map_array, [next_pos], [g])
+            transitions.append((state, action, reward, next_state, done))
+    return transitions
+
+def plan_goals(policy_net, map_array, pairs, max_steps=100):
+    """目标条件网络的批量贪婪规划：所有未到达终点的 (起点, 终点) 每步只做一次批量前向，返回每对的路径。
+    map_array 为 (H, W) 时所有起终点共用一张地图，为 (B, H, W) 时每对使用各自的地图（如分层规划的局部窗口）"""
+    maps = map_array if map_array.ndim == 3 else map_array[None]
+    map_index = np.arange(len(pairs)) if map_array.ndim == 3 else np.zeros(len(pairs), dtype=np.int64)
+    rows, cols = maps.shape[1:]
+    positions = np.array([start for start, _ in pairs], dtype=np.int64).reshape(-1, 2)
+    goals = np.array([goal for _, goal in pairs], dtype=np.int64).reshape(-1, 2)
+    paths = [[tuple(int(v) for v in start)] for start, _ in pairs]
+    active = (positions != goals).any(1)
+    valid_actions = None
+    if USE_ACTION_MASK:
+        valid_actions = torch.as_tensor(np.stack([valid_action_mask(m) for m in maps]), device=device)
+    moves = np.array(ACTIONS)
+    for _ in range(max_steps):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+        with torch.no_grad():
+            q_values = policy_net(goal_states(map_array if map_array.ndim == 2 else map_array[idx],
+                                              positions[idx], goals[idx]))
+        if valid_actions is not None:
+            mask = valid_actions[torch.as_tensor(map_index[idx]),
+                                 torch.as_tensor(positions[idx, 0]), torch.as_tensor(positions[idx, 1])]
+            mask[~mask.any(1)] = True
+            q_values = q_values.masked_fill(~mask, float('-inf'))
+        next_positions = positions[idx] + moves[q_values.argmax(1).cpu().numpy()]
+        free = (next_positions >= 0).all(1) & (next_positions[:, 0] < rows) & (next_positions[:, 1] < cols)
+        free[free] = maps[map_index[idx][free], next_positions[free, 0], next_positions[free, 1]] == 0
+        next_positions[~free] = positions[idx][~free]
+        positions[idx] = next_positions
+        for i, pos in zip(idx, next_positions):
+            paths[i].append((int(pos[0]), int(pos[1])))
+        active[idx] = (next_positions != goals[idx]).any(1)
+    return paths
+
+def evaluate_goal_pairs(policy_net, map_array, pairs, max_steps=100):
+    """在多对 (起点, 终点) 上批量测试目标条件网络，返回成功率、成功路径的平均长度和转折点数量，
+    以及平滑后路径穿过障碍物的比例"""
+    if not pairs:
+        return {'success_rate': 0.0, 'mean_length': None, 'mean_turns': None, 'smoothed_collision_rate': None}
+    from path_analytics import analyze_paths
+    paths = plan_goals(policy_net, map_array, pairs, max_steps)
+    analytics = analyze_paths(paths, map_array, goals=[goal for _, goal in pairs])
+    reached = analytics['reached']
+    return {
+        'success_rate': float(reached.mean()),
+        'mean_length': float(analytics['points'][reached].mean()) if reached.any() else None,
+        'mean_turns': float(analytics['turns'][reached].mean()) if reached.any() else None,
+        'smoothed_collision_rate': float((analytics['collisions'][reached] > 0).mean()) if reached.any() else None,
+    }
+
+# 计算路径转折点数量的函数
+def count_turns(path):
+    from path_analytics import turn_counts
+    return int(turn_counts([path])[0])
 
 def plot_paths_four(path1, path2, path3, title, start_pos, target_pos, map):
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(10, 10))
     plt.imshow(map, cmap='gray_r', origin='lower')
 
@@ -600,34 +2031,11 @@ def plot_paths_four(path1, path2, path3, title, start_pos, target_pos, map):
 
 
 def smooth_path(path, k=3, num_points = 100):
-
+    """单条路径的B样条平滑，批量处理见 path_analytics.smooth_paths"""
     if len(path) < 4:
         return path
-    
-    # 提取路径点的x和y坐标
-    x = [p[1] for p in path]
-    y = [p[0] for p in path]
-    
-    # 生成参数化的点
-    t = np.linspace(0, 1, len(x))
-    
-    # 创建B样条对象
-    try:
-        # x方向的B样条
-        tck_x = interpolate.splrep(t, x, k=min(k, len(x)-1))
-        # y方向的B样条
-        tck_y = interpolate.splrep(t, y, k=min(k, len(y)-1))
-        
-        # 生成平滑路径点
-        t_new = np.linspace(0, 1, num_points)
-        x_smooth = interpolate.splev(t_new, tck_x)
-        y_smooth = interpolate.splev(t_new, tck_y)
-        
-        # 将平滑后的坐标点组合成路径
-        smooth_path = list(zip(y_smooth, x_smooth))
-        return smooth_path
-    except:
-        return path
+    from path_analytics import smooth_paths
+    return [tuple(p) for p in smooth_paths([path], k, num_points)[0]]
 
 def is_valid(pos, size):
     r, c = pos
@@ -778,33 +2186,70 @@ def step_v3(current_pos, action, target_pos, visited_positions=None, prev_action
         return (n_row, n_col), reward, done, visited_positions, prev_actions
 
     return (n_row, n_col), reward, done, visited_positions, prev_actions
+# 将经验列表整理为训练用的张量
+def collate_batch(batch):
+    """返回 state, action, reward, non_final_mask, non_final_next_states, discount 六个张量，
+    discount 为每条转移自举项的折扣系数（单步为GAMMA，n步为GAMMA^n）"""
+    if isinstance(batch, ColumnBatch):
+        return batch.tensors
+    state_batch = torch.cat([item[0].to(device) for item in batch])
+    action_batch = torch.tensor([item[1] for item in batch], device=device, dtype=torch.int64).unsqueeze(1)
+    reward_batch = torch.tensor([item[2] for item in batch], dtype=torch.float32, device=device)
+    non_final_mask = torch.tensor([item[3] is not None for item in batch], device=device, dtype=torch.bool)
+    next_states = [item[3] for item in batch if item[3] is not None]
+    if next_states:
+        non_final_next_states = torch.cat(next_states).to(device)
+    else:
+        non_final_next_states = torch.zeros((0,) + tuple(state_batch.shape[1:]), device=device)
+    discount_batch = torch.tensor([item[5] for item in batch], dtype=torch.float32, device=device)
+    return state_batch, action_batch, reward_batch, non_final_mask, non_final_next_states, discount_batch
+
+# 优化模型函数（算法1：双经验池，smooth L1损失）
+def optimize_model_v1(policy_net, target_net, optimizer, memory, beta=0.4, batch_size=None, scheduler=None):
+    batch_size = batch_size or BATCH_SIZE
+    if len(memory) < batch_size:
+        return None
+    batch, indices, weights = memory.sample(batch_size, beta=beta)
+    if not batch:
+        return None
+    (state_batch, action_batch, reward_batch,
+     non_final_mask, non_final_next_states, discount_batch) = collate_batch(batch)
+    current_q_values = policy_net(state_batch).gather(1, action_batch)
+    next_q_values = torch.zeros(len(batch), device=device)
+    with torch.no_grad():
+        if len(non_final_next_states) > 0:
+            next_actions = select_next_actions(policy_net, non_final_next_states)
+            next_q_values[non_final_mask] = target_net(non_final_next_states).gather(1, next_actions).squeeze()
+    target_q_values = reward_batch + (discount_batch * next_q_values)
+    is_weights = torch.tensor(weights, device=device, dtype=torch.float32)
+    loss = (is_weights * F.smooth_l1_loss(current_q_values.squeeze(), target_q_values, reduction='none')).mean()
+    priorities = (torch.abs(current_q_values.squeeze() - target_q_values) + 1e-5).detach().cpu().numpy()
+    memory.update_priorities(indices, priorities)
+    optimizer.zero_grad()
+    loss.backward()
+    torch.nn.utils.clip_grad_norm_(policy_net.parameters(), 1)
+    optimizer.step()
+    if scheduler is not None:
+        scheduler.record_batch(len(batch))
+    return loss.item()
+
 # 优化模型函数（PERDDQN.py版本）
-def optimize_model_v2(policy_net, target_net, optimizer, memory, beta=0.4):
-    if len(memory) < BATCH_SIZE:
-        return
-
-    transitions, indices, is_weights = memory.sample(BATCH_SIZE, beta)
-    batch = list(zip(*transitions))
-
-    state_batch = torch.cat(batch[0])
-    action_batch = torch.tensor(batch[1], device=device, dtype=torch.int64).unsqueeze(1)
-    reward_batch = torch.tensor(batch[2], dtype=torch.float32, device=device)
-
-    non_final_mask = torch.tensor(
-        [s is not None for s in batch[3]],
-        device=device, dtype=torch.bool
-    )
-    non_final_next_states = torch.cat(
-        [s for s in batch[3] if s is not None]
-    )
-
-    next_q_values = torch.zeros(BATCH_SIZE, device=device)
+def optimize_model_v2(policy_net, target_net, optimizer, memory, beta=0.4, batch_size=None, scheduler=None):
+    batch_size = batch_size or BATCH_SIZE
+    if len(memory) < batch_size:
+        return None
+
+    transitions, indices, is_weights = memory.sample(batch_size, beta)
+    (state_batch, action_batch, reward_batch,
+     non_final_mask, non_final_next_states, discount_batch) = collate_batch(transitions)
+
+    next_q_values = torch.zeros(len(transitions), device=device)
     if len(non_final_next_states) > 0:
         with torch.no_grad():
-            next_actions = policy_net(non_final_next_states).max(1)[1].unsqueeze(1)
+            next_actions = select_next_actions(policy_net, non_final_next_states)
             next_q_values[non_final_mask] = target_net(non_final_next_states).gather(1, next_actions).squeeze()
 
-    target_q_values = reward_batch + (GAMMA * next_q_values)
+    target_q_values = reward_batch + (discount_batch * next_q_values)
     current_q_values = policy_net(state_batch).gather(1, action_batch)
 
     td_errors = torch.abs(current_q_values.squeeze() - target_q_values).detach().cpu().numpy()
@@ -816,39 +2261,37 @@ def optimize_model_v2(policy_net, target_net, optimizer, memory, beta=0.4):
     optimizer.zero_grad()
     loss.backward()
     optimizer.step()
+    if scheduler is not None:
+        scheduler.record_batch(len(transitions))
+    return loss.item()
 
 # 修改优化模型函数，适应算法1双经验池
-def optimize_model_dual(policy_net, target_net, optimizer, memory, beta=0.4):
-    if len(memory) < BATCH_SIZE:
-        return
-    batch, indices, weights = memory.sample(BATCH_SIZE, beta)
+def optimize_model_dual(policy_net, target_net, optimizer, memory, beta=0.4, batch_size=None, scheduler=None):
+    batch_size = batch_size or BATCH_SIZE
+    if len(memory) < batch_size:
+        return None
+    batch, indices, weights = memory.sample(batch_size, beta)
     
     if not batch:  # 如果抽样为空则返回
-        return
+        return None
     # 添加类型检查
     for item in batch:
-        if not isinstance(item, tuple) or len(item) != 5:
+        if not isinstance(item, tuple) or len(item) != 6:
             print(f"警告：发现无效的样本格式: {item}")
-            return
+            return None
     try:
-        state_batch = torch.cat([item[0].to(device) for item in batch])
-        action_batch = torch.tensor([item[1] for item in batch], device=device).unsqueeze(1)
-        reward_batch = torch.tensor([item[2] for item in batch], dtype=torch.float32, device=device)
-
-        non_final_mask = torch.tensor([item[3] is not None for item in batch], 
-                                    device=device, dtype=torch.bool)
-        non_final_next_states = torch.cat([item[3] for item in batch 
-                                         if item[3] is not None]).to(device)
+        (state_batch, action_batch, reward_batch,
+         non_final_mask, non_final_next_states, discount_batch) = collate_batch(batch)
 
         policy_next_q_values = torch.zeros(len(batch), device=device)
         with torch.no_grad():
             if len(non_final_next_states) > 0:
-                selected_actions = policy_net(non_final_next_states).max(1)[1]
+                selected_actions = select_next_actions(policy_net, non_final_next_states)
                 policy_next_q_values[non_final_mask] = target_net(non_final_next_states).gather(
-                    1, selected_actions.unsqueeze(1)
+                    1, selected_actions
                 ).squeeze()
 
-        target_q_values = reward_batch + (GAMMA * policy_next_q_values)
+        target_q_values = reward_batch + (discount_batch * policy_next_q_values)
         current_q_values = policy_net(state_batch).gather(1, action_batch)
 
         is_weights = torch.tensor(weights, device=device, dtype=torch.float32)
@@ -861,56 +2304,217 @@ def optimize_model_dual(policy_net, target_net, optimizer, memory, beta=0.4):
         loss.backward()
         torch.nn.utils.clip_grad_norm_(policy_net.parameters(), 1)
         optimizer.step()
+        if scheduler is not None:
+            scheduler.record_batch(len(batch))
+        return loss.item()
     except Exception as e:
         print(f"优化过程中出错: {e}")
         # 继续训练而不中断
-
-def optimize_model_v3(policy_net, target_net, optimizer, memory):
-    if len(memory) < BATCH_SIZE:
-        return
-    transitions, _, _ = memory.sample(BATCH_SIZE)
-    batch = list(zip(*transitions))
-    
-    # 确保使用 float32
-    state_batch = torch.cat(batch[0]).float()
-    action_batch = torch.tensor(batch[1], device=device, dtype=torch.int64).unsqueeze(1)
-    reward_batch = torch.tensor(batch[2], device=device, dtype=torch.float32)
-    non_final_mask = torch.tensor(
-        [s is not None for s in batch[3]],
-        device=device, dtype=torch.bool
-    )
-    # 确保使用 float32
-    non_final_next_states = torch.cat([s for s in batch[3] if s is not None]).float()
+        return None
+
+def optimize_model_v3(policy_net, target_net, optimizer, memory, beta=0.4, batch_size=None, scheduler=None):
+    batch_size = batch_size or BATCH_SIZE
+    if len(memory) < batch_size:
+        return None
+    transitions, indices, _ = memory.sample(batch_size)
+    if not transitions:
+        return None
+    (state_batch, action_batch, reward_batch,
+     non_final_mask, non_final_next_states, discount_batch) = collate_batch(transitions)
     # 计算当前Q值
     current_q_values = policy_net(state_batch).gather(1, action_batch)
     # 计算目标Q值（传统DDQN方式）
-    next_q_values = torch.zeros(BATCH_SIZE, device=device, dtype=torch.float32)
+    next_q_values = torch.zeros(len(transitions), device=device, dtype=torch.float32)
     with torch.no_grad():
         if len(non_final_next_states) > 0:
-            next_actions = policy_net(non_final_next_states).max(1)[1].unsqueeze(1)
+            next_actions = select_next_actions(policy_net, non_final_next_states)
             next_q_values[non_final_mask] = target_net(non_final_next_states).gather(1, next_actions).squeeze()
     # 计算目标Q值
-    target_q_values = reward_batch + GAMMA * next_q_values
+    target_q_values = reward_batch + discount_batch * next_q_values
     # 计算损失并更新
     loss = F.mse_loss(current_q_values.squeeze(), target_q_values)
     optimizer.zero_grad()
     loss.backward()
     torch.nn.utils.clip_grad_norm_(policy_net.parameters(), 1)
     optimizer.step()
-def run_algorithm_v1():
-    policy_net = DQN().to(device)
-    target_net = DQN().to(device)
-    # 使用预训练值初始化网络
-    initialize_network_weights(policy_net, map, target_pos)
-    target_net.load_state_dict(policy_net.state_dict())
-    target_net.eval()
-    optimizer = optim.Adam(policy_net.parameters(), lr=LEARNING_RATE)
-    epsilon = 0.5
-    eps_decay = 0.99
-    min_epsilon = 0.05
-    normal_capacity = int(MEMORY_SIZE * 0.6)
-    elite_capacity = MEMORY_SIZE - normal_capacity
-    memory = DualPrioritizedReplayMemory(normal_capacity, elite_capacity)
+    # 记录损失用于动态采样（普通经验池忽略）
+    priorities = (torch.abs(current_q_values.squeeze() - target_q_values) + 1e-5).detach().cpu().numpy()
+    memory.update_priorities(indices, priorities)
+    if scheduler is not None:
+        scheduler.record_batch(len(transitions))
+    return loss.item()
+
+# 离线训练的更新函数（数据来自 offline.py 的离线数据集）
+def optimize_offline(policy_net, target_net, optimizer, batch, scheduler=None):
+    """batch 为 collate_batch 格式的张量元组（由离线数据集的工作进程直接生成），损失与算法1相同（smooth L1）"""
+    (state_batch, action_batch, reward_batch,
+     non_final_mask, non_final_next_states, discount_batch) = (t.to(device, non_blocking=True) for t in batch)
+    current_q_values = policy_net(state_batch).gather(1, action_batch).squeeze(1)
+    next_q_values = torch.zeros(len(reward_batch), device=device)
+    with torch.no_grad():
+        if len(non_final_next_states) > 0:
+            next_actions = select_next_actions(policy_net, non_final_next_states)
+            next_q_values[non_final_mask] = target_net(non_final_next_states).gather(1, next_actions).squeeze(1)
+    target_q_values = reward_batch + discount_batch * next_q_values
+    loss = F.smooth_l1_loss(current_q_values, target_q_values)
+    optimizer.zero_grad()
+    loss.backward()
+    torch.nn.utils.clip_grad_norm_(policy_net.parameters(), 1)
+    optimizer.step()
+    if scheduler is not None:
+        scheduler.record_batch(len(reward_batch))
+    return loss.item()
+
+def make_algorithm_memory(algorithm, near_fraction=0.3, **kwargs):
+    """创建各算法默认使用的经验池，kwargs 传给经验池构造函数（alpha、elite_threshold、p0、p1、beta_t等），
+    near_fraction 为算法3中近障碍物经验池占总容量的比例"""
+    if algorithm == 'v1':
+        normal_capacity = int(MEMORY_SIZE * 0.6)
+        elite_capacity = MEMORY_SIZE - normal_capacity
+        return DualPrioritizedReplayMemory(normal_capacity, elite_capacity, **kwargs)
+    if algorithm == 'v2':
+        return make_replay_pool(MEMORY_SIZE, prioritized=True, alpha=kwargs.get('alpha', 0.6))
+    near_capacity = int(MEMORY_SIZE * near_fraction)
+    return DualReplayMemoryObstacle(near_capacity=near_capacity, all_capacity=MEMORY_SIZE - near_capacity, **kwargs)
+
+# 各算法的探索率配置：初始值、每轮衰减系数、最小值
+EPSILON_SCHEDULES = {
+    'v1': {'epsilon': 0.5, 'eps_decay': 0.99, 'min_epsilon': 0.05},
+    'v2': {'epsilon': 0.99, 'eps_decay': 0.99, 'min_epsilon': 0.05},
+    'v3': {'epsilon': 0.99, 'eps_decay': 0.99, 'min_epsilon': 0.05},
+}
+
+def init_agent(algorithm, agent=None):
+    """创建或补全可续训的智能体状态字典：policy_net、target_net、optimizer、探索率配置、gamma 和已训练轮数。
+    把同一个字典（连同经验池）再次传给 run_algorithm_* 即可从上次停下的地方继续训练"""
+    agent = {} if agent is None else agent
+    if 'policy_net' not in agent:
+        policy_net = DQN().to(device)
+        target_net = DQN().to(device)
+        if algorithm == 'v1':
+            # 使用预训练值初始化网络
+            initialize_network_weights(policy_net, map, target_pos)
+        target_net.load_state_dict(policy_net.state_dict())
+        target_net.eval()
+        agent['policy_net'] = policy_net
+        agent['target_net'] = target_net
+        agent['optimizer'] = optim.Adam(policy_net.parameters(), lr=agent.get('lr', LEARNING_RATE))
+    for name, value in EPSILON_SCHEDULES[algorithm].items():
+        agent.setdefault(name, value)
+    agent.setdefault('gamma', GAMMA)
+    agent.setdefault('episodes_done', 0)
+    return agent
+
+def push_n_step_transition(memory, transition, is_episode_end=False, recorder=None):
+    """按经验池类型写入一条 NStepTransitionBuilder 输出的转移，recorder 不为None时同时记录到离线数据集"""
+    state, action, reward, next_state, done, discount, pos = transition
+    if recorder is not None:
+        recorder.add(state, action, reward, next_state, done, discount, current_map_id)
+    pool = memory.memory if isinstance(memory, BatchPrefetcher) else memory
+    if isinstance(pool, DualReplayMemoryObstacle):
+        memory.push(state, action, reward, next_state, done, pos, map,
+                    is_episode_end=is_episode_end, discount=discount, map_id=current_map_id)
+    elif isinstance(pool, DualPrioritizedReplayMemory):
+        memory.push(state, action, reward, next_state, done, discount,
+                    is_episode_end=is_episode_end, map_id=current_map_id)
+    else:
+        memory.push(state, action, reward, next_state, done, discount, current_map_id)
+
+# 示范经验预填充：训练开始前沿BFS最短路径走到终点，按对应算法的奖励函数生成转移写入经验池
+DEMO_PATHS = 0  # 示范路径条数，0为不使用；第一条从起点出发，其余从随机的可达格子出发
+DEMO_PRIORITY = None  # 示范经验在精英池/优先级经验池中的优先级，None为当前最大优先级
+
+def bfs_shortest_path(map_array, start, goal, distance=None):
+    """沿BFS距离场下降得到的最短路径，多条最短路径时随机选择下一步，不可达时返回None"""
+    if distance is None:
+        distance = bfs_distance_field(map_array, goal)
+    if distance[start] < 0:
+        return None
+    rows, cols = map_array.shape
+    path = [tuple(start)]
+    while path[-1] != tuple(goal):
+        r, c = path[-1]
+        candidates = [(r + dr, c + dc) for dr, dc in ACTIONS
+                      if 0 <= r + dr < rows and 0 <= c + dc < cols and distance[r + dr, c + dc] == distance[r, c] - 1]
+        path.append(candidates[np.random.randint(len(candidates))])
+    return path
+
+def push_demonstration(memory, transition, priority=DEMO_PRIORITY):
+    """写入一条示范转移：双经验池（算法1）直接写入精英池，优先级经验池（算法2）使用给定优先级，
+    算法3与普通转移相同；都不计入回合数"""
+    state, action, reward, next_state, done, discount, pos = transition
+    if isinstance(memory, DualPrioritizedReplayMemory):
+        memory.elite_memory.push(state, action, reward, next_state, done, discount, current_map_id, priority=priority)
+    elif isinstance(memory, (PrioritizedReplayMemoryV1, CountReplayMemory, RankPrioritizedReplayMemory)):
+        memory.push(state, action, reward, next_state, done, discount, current_map_id, priority=priority)
+    else:
+        push_n_step_transition(memory, transition)
+
+def seed_demonstrations(memory, algorithm, num_paths=DEMO_PATHS, priority=DEMO_PRIORITY, gamma=GAMMA):
+    """用当前地图上的BFS最短路径预填充经验池，奖励由 step_v1/step_v2/step_v3 给出，返回写入的转移条数"""
+    distance = bfs_distance_field(map, target_pos)
+    if distance[start_pos] < 0:
+        return 0
+    reachable = [(int(r), int(c)) for r, c in np.argwhere(distance > 0)]
+    count = 0
+    for i in range(num_paths):
+        start = start_pos if i == 0 else reachable[np.random.randint(len(reachable))]
+        path = bfs_shortest_path(map, start, target_pos, distance)
+        current_pos = start
+        visited_positions = {}
+        prev_action = None
+        prev_actions = []
+        n_step = NStepTransitionBuilder(gamma=gamma)
+        k = 0
+        while k < len(path) - 1:
+            # 宏动作模式下同一方向的连续格子合并为一次决策
+            direction = ACTIONS.index((path[k + 1][0] - path[k][0], path[k + 1][1] - path[k][1]))
+            length = 1
+            while (length < MACRO_MAX_LENGTH and k + length < len(path) - 1 and
+                   ACTIONS.index((path[k + length + 1][0] - path[k + length][0],
+                                  path[k + length + 1][1] - path[k + length][1])) == direction):
+                length += 1
+            k += length
+            action = (length - 1) * len(ACTIONS) + direction
+            state = matrix_to_img(current_pos, map).to(device)
+            if algorithm == 'v3':
+                next_pos, reward, done, visited_positions, prev_actions, duration = take_step(
+                    step_v3, current_pos, action, target_pos, visited_positions, prev_action, prev_actions,
+                    gamma=gamma)
+            else:
+                step_func = step_v1 if algorithm == 'v1' else step_v2
+                next_pos, reward, done, visited_positions, duration = take_step(
+                    step_func, current_pos, action, target_pos, visited_positions, prev_action, gamma=gamma)
+            next_state = matrix_to_img(next_pos, map).to(device) if not done else None
+            for transition in n_step.append(state, action, reward, next_state, done, current_pos,
+                                            duration=duration):
+                push_demonstration(memory, transition, priority)
+                count += 1
+            prev_action = action
+            current_pos = next_pos
+    print(f'示范经验预填充: {num_paths} 条BFS最短路径, {count} 条转移')
+    return count
+
+def run_algorithm_v1(monitor=None, map_bank=None, memory=None, scheduler=None, agent=None, recorder=None):
+    if monitor is None:
+        monitor = ConvergenceMonitor()
+    if scheduler is None:
+        scheduler = LearnerScheduler()
+    if map_bank is not None:
+        use_map(*map_bank.sample())
+    agent = init_agent('v1', agent)
+    memory_monitor = MemoryMonitor()
+    caches = {'map_bank': map_bank} if map_bank is not None else None
+    evaluator = AsyncEvaluator(EVAL_INTERVAL, EVAL_STARTS)
+    policy_net, target_net, optimizer = agent['policy_net'], agent['target_net'], agent['optimizer']
+    epsilon = agent['epsilon']
+    eps_decay = agent['eps_decay']
+    min_epsilon = agent['min_epsilon']
+    if memory is None:
+        memory = make_algorithm_memory('v1')
+    if DEMO_PATHS > 0 and agent['episodes_done'] == 0:
+        seed_demonstrations(memory, 'v1', DEMO_PATHS, DEMO_PRIORITY, agent['gamma'])
+    memory = start_prefetch(memory, scheduler)
     steps_done = 0
     episode_steps = []
     total_rewards = []
@@ -920,7 +2524,11 @@ def run_algorithm_v1():
     epsilons = []
     losses = []
     for episode in range(NUM_EPISODES):
+        # 多地图训练时每轮从地图库中抽取一张训练地图
+        if map_bank is not None:
+            use_map(*map_bank.sample())
         episode_start_time = time.time()
+        valid_actions = valid_action_mask(map) if USE_ACTION_MASK else None
         current_pos = start_pos
         total_reward = 0
         step_count = 0
@@ -928,43 +2536,30 @@ def run_algorithm_v1():
         prev_action = None
         episode_loss = 0
         loss_count = 0
+        n_step = NStepTransitionBuilder(gamma=agent['gamma'])
         while True:
             state = matrix_to_img(current_pos, map).to(device)
-            action = choose_action(state, policy_net, epsilon) 
-            next_pos, reward, done, visited_positions = step_v1(
-                current_pos, action, target_pos, visited_positions, prev_action)
+            action = choose_action(state, policy_net, epsilon,
+                                   valid_actions[current_pos] if valid_actions is not None else None)
+            next_pos, reward, done, visited_positions, duration = take_step(
+                step_v1, current_pos, action, target_pos, visited_positions, prev_action, gamma=agent['gamma'])
             next_state = matrix_to_img(next_pos, map).to(device) if not done else None
-            memory.push(state, action, reward, next_state, done)
+            transitions = n_step.append(state, action, reward, next_state, done,
+                                        truncated=step_count + duration >= 3000, duration=duration)
+            for i, transition in enumerate(transitions):
+                push_n_step_transition(memory, transition, is_episode_end=i == len(transitions) - 1,
+                                       recorder=recorder)
             prev_action = action
 
-            if steps_done % REPLAY_INTERVAL == 0 and len(memory) >= BATCH_SIZE:
-                batch, indices, weights = memory.sample(BATCH_SIZE, beta=0.4)
-                if batch:
-                    state_batch = torch.cat([item[0].to(device) for item in batch])
-                    action_batch = torch.tensor([item[1] for item in batch], device=device).unsqueeze(1)
-                    reward_batch = torch.tensor([item[2] for item in batch], dtype=torch.float32, device=device)
-                    non_final_mask = torch.tensor([item[3] is not None for item in batch], device=device, dtype=torch.bool)
-                    non_final_next_states = torch.cat([item[3] for item in batch if item[3] is not None]).to(device)
-                    current_q_values = policy_net(state_batch).gather(1, action_batch)
-                    next_q_values = torch.zeros(len(batch), device=device)
-                    with torch.no_grad():
-                        if len(non_final_next_states) > 0:
-                            next_actions = policy_net(non_final_next_states).max(1)[1].unsqueeze(1)
-                            next_q_values[non_final_mask] = target_net(non_final_next_states).gather(1, next_actions).squeeze()
-                    target_q_values = reward_batch + (GAMMA * next_q_values)
-                    is_weights = torch.tensor(weights, device=device, dtype=torch.float32)
-                    loss = (is_weights * F.smooth_l1_loss(current_q_values.squeeze(), target_q_values, reduction='none')).mean()
-                    priorities = (torch.abs(current_q_values.squeeze() - target_q_values) + 1e-5).detach().cpu().numpy()
-                    memory.update_priorities(indices, priorities)
-                    optimizer.zero_grad()
-                    loss.backward()
-                    torch.nn.utils.clip_grad_norm_(policy_net.parameters(), 1)
-                    optimizer.step()
-                    episode_loss += loss.item()
+            for _ in range(scheduler.updates_due(steps_done, len(memory))):
+                loss = optimize_model_v1(policy_net, target_net, optimizer, memory, beta=0.4,
+                                         batch_size=scheduler.batch_size, scheduler=scheduler)
+                if loss is not None:
+                    episode_loss += loss
                     loss_count += 1
-                    soft_update(target_net, policy_net, tau=0.01)
+                    scheduler.after_update(target_net, policy_net)
             current_pos = next_pos
-            step_count += 1
+            step_count += duration  # 按时间步（格子数）计，steps_done 按决策数计
             steps_done += 1
             total_reward += reward
 
@@ -975,7 +2570,7 @@ def run_algorithm_v1():
         # 记录当前学习率
         current_lr = optimizer.param_groups[0]['lr']
         learning_rates.append(current_lr)
-        if episode < 50:
+        if agent['episodes_done'] + episode < 50:
             epsilon = epsilon
         else:
             epsilon = max(min_epsilon, epsilon * eps_decay)
@@ -993,49 +2588,86 @@ def run_algorithm_v1():
                   f'Elite/Normal: {stats["elite_size"]}/{stats["normal_size"]}, '
                   f'Sampling Ratio: {stats["normal_ratio"]:.2f}/{1-stats["normal_ratio"]:.2f}, '
                   f'Epsilon: {epsilon:.3f}, LR: {current_lr:.6f}, Loss: {avg_loss:.6f}')
+        memory_monitor.update(episode, memory, policy_net, target_net, optimizer, caches=caches)
+        evaluator.update(episode, policy_net, map, start_pos, target_pos)
+        if monitor.update(episode, step_count, total_reward,
+                          lambda: test_net(policy_net, start_pos, target_pos, step_v1)):
+            print(f'Algorithm 1 - 第 {episode} 轮已收敛，提前停止训练')
+            break
+    memory, prefetch_stats = stop_prefetch(memory)
+    agent['epsilon'] = epsilon
+    agent['episodes_done'] += len(episode_steps)
+    memory_monitor.update(len(episode_steps) - 1, memory, policy_net, target_net, optimizer, final=True,
+                          caches=caches)
     final_path = test_net(policy_net, start_pos, target_pos, step_v1)
-    return episode_steps, total_rewards, cumulative_times, final_path, learning_rates, policy_net, epsilons
-def run_algorithm_v2():
-    policy_net = DQN().to(device) 
-    target_net = DQN().to(device)
-    target_net.load_state_dict(policy_net.state_dict())
-    target_net.eval()
-    # 修改 run_algorithm_v2 中的优化器
-    optimizer = optim.Adam(policy_net.parameters(), lr=LEARNING_RATE)
-    memory = PrioritizedReplayMemoryV1(MEMORY_SIZE, alpha=0.6, beta_start=0.4)
-    epsilon = 0.99
-    eps_decay = 0.99
-    min_epsilon = 0.05
+    metrics = monitor.summary()
+    metrics['learner'] = scheduler.stats()
+    metrics['memory'] = memory_monitor.summary()
+    if prefetch_stats is not None:
+        metrics['prefetch'] = prefetch_stats
+    if evaluator.interval:
+        metrics['async_eval'] = evaluator.summary()
+    if map_bank is not None:
+        metrics['replay_map_counts'] = replay_map_counts(memory)
+    return episode_steps, total_rewards, cumulative_times, final_path, learning_rates, policy_net, epsilons, metrics
+def run_algorithm_v2(monitor=None, map_bank=None, memory=None, scheduler=None, agent=None, recorder=None):
+    if monitor is None:
+        monitor = ConvergenceMonitor()
+    if scheduler is None:
+        scheduler = LearnerScheduler()
+    if map_bank is not None:
+        use_map(*map_bank.sample())
+    agent = init_agent('v2', agent)
+    memory_monitor = MemoryMonitor()
+    caches = {'map_bank': map_bank} if map_bank is not None else None
+    evaluator = AsyncEvaluator(EVAL_INTERVAL, EVAL_STARTS)
+    policy_net, target_net, optimizer = agent['policy_net'], agent['target_net'], agent['optimizer']
+    if memory is None:
+        memory = make_algorithm_memory('v2')
+    if DEMO_PATHS > 0 and agent['episodes_done'] == 0:
+        seed_demonstrations(memory, 'v2', DEMO_PATHS, DEMO_PRIORITY, agent['gamma'])
+    memory = start_prefetch(memory, scheduler)
+    epsilon = agent['epsilon']
+    eps_decay = agent['eps_decay']
+    min_epsilon = agent['min_epsilon']
     steps_done = 0
     episode_steps = []
     total_rewards = []
     cumulative_times = []
     cumulative_time = 0
     for episode in range(NUM_EPISODES):
+        # 多地图训练时每轮从地图库中抽取一张训练地图
+        if map_bank is not None:
+            use_map(*map_bank.sample())
         episode_start_time = time.time()
+        valid_actions = valid_action_mask(map) if USE_ACTION_MASK else None
         current_pos = start_pos
         total_reward = 0
         step_count = 0
         visited_positions = {}  # 改为字典以记录访问次数
         prev_action = None
+        n_step = NStepTransitionBuilder(gamma=agent['gamma'])
         
         while True:
             state = matrix_to_img(current_pos, map).to(device)
-            action = choose_action(state, policy_net, epsilon)
-            next_pos, reward, done, visited_positions = step_v2(  
-                current_pos, action, target_pos, visited_positions, prev_action)
+            action = choose_action(state, policy_net, epsilon,
+                                   valid_actions[current_pos] if valid_actions is not None else None)
+            next_pos, reward, done, visited_positions, duration = take_step(
+                step_v2, current_pos, action, target_pos, visited_positions, prev_action, gamma=agent['gamma'])
             
             next_state = matrix_to_img(next_pos, map).to(device) if not done else None
-            memory.push(state, action, reward, next_state, done)
+            for transition in n_step.append(state, action, reward, next_state, done,
+                                            truncated=step_count + duration >= 3000, duration=duration):
+                push_n_step_transition(memory, transition, recorder=recorder)
             
             prev_action = action
             
-            if steps_done % REPLAY_INTERVAL == 0:
-                if len(memory) >= BATCH_SIZE:
-                    optimize_model_v2(policy_net, target_net, optimizer, memory, beta=0.4)
-                    soft_update(target_net, policy_net, tau=0.01)
+            for _ in range(scheduler.updates_due(steps_done, len(memory))):
+                if optimize_model_v2(policy_net, target_net, optimizer, memory, beta=0.4,
+                                     batch_size=scheduler.batch_size, scheduler=scheduler) is not None:
+                    scheduler.after_update(target_net, policy_net)
             current_pos = next_pos
-            step_count += 1
+            step_count += duration  # 按时间步（格子数）计，steps_done 按决策数计
             steps_done += 1
             total_reward += reward
             if done or step_count >= 3000:
@@ -1050,104 +2682,95 @@ def run_algorithm_v2():
             print(f'Algorithm 2 (PER-DDQN) - Episode {episode}, Steps: {step_count}, '
                   f'Reward: {total_reward:.1f}, Epsilon: {epsilon:.3f}, '
                   f'Memory: {len(memory)}')
-    
-    final_path = test_net(policy_net, start_pos, target_pos, step_v2)  # 使用step_v1测试
-    return episode_steps, total_rewards, cumulative_times, final_path, policy_net
+        memory_monitor.update(episode, memory, policy_net, target_net, optimizer, caches=caches)
+        evaluator.update(episode, policy_net, map, start_pos, target_pos)
+        if monitor.update(episode, step_count, total_reward,
+                          lambda: test_net(policy_net, start_pos, target_pos, step_v2)):
+            print(f'Algorithm 2 (PER-DDQN) - 第 {episode} 轮已收敛，提前停止训练')
+            break
 
-def run_algorithm_v3():
-    policy_net = DQN().to(device)
-    target_net = DQN().to(device)
-    target_net.load_state_dict(policy_net.state_dict())
-    target_net.eval()
-    optimizer = optim.Adam(policy_net.parameters(), lr=LEARNING_RATE)
-    memory = DualReplayMemoryObstacle(near_capacity=int(MEMORY_SIZE*0.3), all_capacity=int(MEMORY_SIZE*0.7))
+    memory, prefetch_stats = stop_prefetch(memory)
+    agent['epsilon'] = epsilon
+    agent['episodes_done'] += len(episode_steps)
+    memory_monitor.update(len(episode_steps) - 1, memory, policy_net, target_net, optimizer, final=True,
+                          caches=caches)
+    final_path = test_net(policy_net, start_pos, target_pos, step_v2)  # 使用step_v1测试
+    metrics = monitor.summary()
+    metrics['learner'] = scheduler.stats()
+    metrics['memory'] = memory_monitor.summary()
+    if prefetch_stats is not None:
+        metrics['prefetch'] = prefetch_stats
+    if evaluator.interval:
+        metrics['async_eval'] = evaluator.summary()
+    if map_bank is not None:
+        metrics['replay_map_counts'] = replay_map_counts(memory)
+    return episode_steps, total_rewards, cumulative_times, final_path, policy_net, metrics
+
+def run_algorithm_v3(monitor=None, map_bank=None, memory=None, scheduler=None, agent=None, recorder=None):
+    if monitor is None:
+        monitor = ConvergenceMonitor()
+    if scheduler is None:
+        scheduler = LearnerScheduler()
+    if map_bank is not None:
+        use_map(*map_bank.sample())
+    agent = init_agent('v3', agent)
+    memory_monitor = MemoryMonitor()
+    caches = {'map_bank': map_bank} if map_bank is not None else None
+    evaluator = AsyncEvaluator(EVAL_INTERVAL, EVAL_STARTS)
+    policy_net, target_net, optimizer = agent['policy_net'], agent['target_net'], agent['optimizer']
+    if memory is None:
+        memory = make_algorithm_memory('v3')
+    if DEMO_PATHS > 0 and agent['episodes_done'] == 0:
+        seed_demonstrations(memory, 'v3', DEMO_PATHS, DEMO_PRIORITY, agent['gamma'])
+    memory = start_prefetch(memory, scheduler)
     steps_done = 0  
     episode_steps = []
     total_rewards = []
     cumulative_times = []
     cumulative_time = 0
-    epsilon = 0.99
-    N_STEPS = 3  # n步缓存长度
-    eps_decay = 0.99
-    min_epsilon = 0.05
+    epsilon = agent['epsilon']
+    eps_decay = agent['eps_decay']
+    min_epsilon = agent['min_epsilon']
     for episode in range(NUM_EPISODES):
+        # 多地图训练时每轮从地图库中抽取一张训练地图
+        if map_bank is not None:
+            use_map(*map_bank.sample())
         episode_start_time = time.time()
+        valid_actions = valid_action_mask(map) if USE_ACTION_MASK else None
         current_pos = start_pos
         total_reward = 0
         step_count = 0
         visited_positions = {}
         prev_action = None
         prev_actions = []  # 新增，记录历史动作
-        n_step_buffer = deque(maxlen=N_STEPS)
+        n_step = NStepTransitionBuilder(gamma=agent['gamma'])
 
         while True:
             state = matrix_to_img(current_pos, map).to(device)
-            action = choose_action(state, policy_net, epsilon)
-            next_pos, reward, done, visited_positions, prev_actions = step_v3(
-                current_pos, action, target_pos, visited_positions, prev_action, prev_actions)
+            action = choose_action(state, policy_net, epsilon,
+                                   valid_actions[current_pos] if valid_actions is not None else None)
+            next_pos, reward, done, visited_positions, prev_actions, duration = take_step(
+                step_v3, current_pos, action, target_pos, visited_positions, prev_action, prev_actions,
+                gamma=agent['gamma'])
             next_state = matrix_to_img(next_pos, map).to(device) if not done else None
-            n_step_buffer.append((state, action, reward, next_state, done, current_pos))
-
-            if len(n_step_buffer) == N_STEPS:
-                n_reward, n_next_state, n_done = 0, None, False
-                for idx, (_, _, r, ns, d, _) in enumerate(n_step_buffer):
-                    n_reward += (GAMMA ** idx) * r
-                    if d:
-                        n_done = True
-                        n_next_state = ns
-                        break
-                    else:
-                        n_next_state = ns
-                first_state, first_action, _, _, _, first_pos = n_step_buffer[0]
-                memory.push(first_state, first_action, n_reward, n_next_state, n_done, first_pos, map)
+            transitions = n_step.append(state, action, reward, next_state, done, current_pos,
+                                        truncated=step_count + duration >= 3000, duration=duration)
+            for i, transition in enumerate(transitions):
+                # 最后一次 push 传 is_episode_end=True，其余为 False
+                push_n_step_transition(memory, transition, is_episode_end=i == len(transitions) - 1,
+                                       recorder=recorder)
 
             prev_action = action
-            if steps_done % REPLAY_INTERVAL == 0:
-                batch, _, _ = memory.sample(BATCH_SIZE)
-                if batch:
-                    batch = list(batch)
-                    state_batch = torch.cat([item[0].to(device) for item in batch])
-                    action_batch = torch.tensor([item[1] for item in batch], device=device).unsqueeze(1)
-                    reward_batch = torch.tensor([item[2] for item in batch], dtype=torch.float32, device=device)
-                    non_final_mask = torch.tensor([item[3] is not None for item in batch], device=device, dtype=torch.bool)
-                    non_final_next_states = torch.cat([item[3] for item in batch if item[3] is not None]).to(device)
-                    current_q_values = policy_net(state_batch).gather(1, action_batch)
-                    next_q_values = torch.zeros(len(batch), device=device)
-                    with torch.no_grad():
-                        if len(non_final_next_states) > 0:
-                            next_actions = policy_net(non_final_next_states).max(1)[1].unsqueeze(1)
-                            next_q_values[non_final_mask] = target_net(non_final_next_states).gather(1, next_actions).squeeze()
-                    target_q_values = reward_batch + (GAMMA * next_q_values)
-                    loss = F.mse_loss(current_q_values.squeeze(), target_q_values)
-                    optimizer.zero_grad()
-                    loss.backward()
-                    torch.nn.utils.clip_grad_norm_(policy_net.parameters(), 1)
-                    optimizer.step()
-                    # 记录损失用于动态采样
-                    priorities = (torch.abs(current_q_values.squeeze() - target_q_values) + 1e-5).detach().cpu().numpy()
-                    memory.update_priorities(None, priorities)
-                    soft_update(target_net, policy_net, tau=0.01)
+            for _ in range(scheduler.updates_due(steps_done, len(memory))):
+                if optimize_model_v3(policy_net, target_net, optimizer, memory,
+                                     batch_size=scheduler.batch_size, scheduler=scheduler) is not None:
+                    scheduler.after_update(target_net, policy_net)
             current_pos = next_pos
-            step_count += 1
+            step_count += duration  # 按时间步（格子数）计，steps_done 按决策数计
             steps_done += 1
             total_reward += reward
-            # ...在 while True 循环后的 episode 结束处理部分...
+            # 回合结束时n步缓存已在 append 中清空
             if done or step_count >= 3000:
-                while len(n_step_buffer) > 0:
-                    n_reward, n_next_state, n_done = 0, None, False
-                    for idx, (_, _, r, ns, d, _) in enumerate(n_step_buffer):
-                        n_reward += (GAMMA ** idx) * r
-                        if d:
-                            n_done = True
-                            n_next_state = ns
-                            break
-                        else:
-                            n_next_state = ns
-                    first_state, first_action, _, _, _, first_pos = n_step_buffer[0]
-                    # 最后一次 push 传 is_episode_end=True，其余为 False
-                    is_last = len(n_step_buffer) == 1
-                    memory.push(first_state, first_action, n_reward, n_next_state, n_done, first_pos, map, is_episode_end=is_last)
-                    n_step_buffer.popleft()
                 episode_steps.append(step_count)
                 total_rewards.append(total_reward)
                 break
@@ -1159,9 +2782,221 @@ def run_algorithm_v3():
             print(f'Algorithm 3 - Episode {episode}, Steps: {step_count}, '
                   f'Reward: {total_reward:.1f}, Epsilon: {epsilon :.3f}, '
                   f'Memory: {len(memory)}, Near Ratio: {memory.near_ratio:.2f}')
+        memory_monitor.update(episode, memory, policy_net, target_net, optimizer, caches=caches)
+        evaluator.update(episode, policy_net, map, start_pos, target_pos)
+        if monitor.update(episode, step_count, total_reward,
+                          lambda: test_net(policy_net, start_pos, target_pos, step_v3)):
+            print(f'Algorithm 3 - 第 {episode} 轮已收敛，提前停止训练')
+            break
+    memory, prefetch_stats = stop_prefetch(memory)
+    agent['epsilon'] = epsilon
+    agent['episodes_done'] += len(episode_steps)
+    memory_monitor.update(len(episode_steps) - 1, memory, policy_net, target_net, optimizer, final=True,
+                          caches=caches)
     final_path = test_net(policy_net, start_pos, target_pos, step_v3)
-    return episode_steps, total_rewards, cumulative_times, final_path, policy_net
+    metrics = monitor.summary()
+    metrics['learner'] = scheduler.stats()
+    metrics['memory'] = memory_monitor.summary()
+    if prefetch_stats is not None:
+        metrics['prefetch'] = prefetch_stats
+    if evaluator.interval:
+        metrics['async_eval'] = evaluator.summary()
+    if map_bank is not None:
+        metrics['replay_map_counts'] = replay_map_counts(memory)
+    return episode_steps, total_rewards, cumulative_times, final_path, policy_net, metrics
+def run_goal_conditioned(map_bank=None, memory=None, scheduler=None, her_k=HER_K, max_steps=GOAL_MAX_STEPS,
+                         recorder=None):
+    """目标条件DDQN：每轮随机采样起点和终点，轨迹结束后连同HER重标记的转移一起写入经验池"""
+    if scheduler is None:
+        scheduler = LearnerScheduler()
+    if map_bank is not None:
+        use_map(*map_bank.sample())
+    policy_net = DQN(in_channels=2, num_actions=len(ACTIONS)).to(device)  # 目标条件训练只支持单格动作
+    target_net = DQN(in_channels=2, num_actions=len(ACTIONS)).to(device)
+    target_net.load_state_dict(policy_net.state_dict())
+    target_net.eval()
+    optimizer = optim.Adam(policy_net.parameters(), lr=LEARNING_RATE)
+    if memory is None:
+        memory = make_replay_pool(MEMORY_SIZE, prioritized=True, alpha=0.6)
+    memory = start_prefetch(memory, scheduler)
+    memory_monitor = MemoryMonitor()
+    caches = {'map_bank': map_bank} if map_bank is not None else None
+    epsilon = EPSILON_SCHEDULES['v2']['epsilon']
+    eps_decay = EPSILON_SCHEDULES['v2']['eps_decay']
+    min_epsilon = EPSILON_SCHEDULES['v2']['min_epsilon']
+    steps_done = 0
+    episode_steps = []
+    successes = []
+    cumulative_times = []
+    cumulative_time = 0
+    for episode in range(NUM_EPISODES):
+        if map_bank is not None:
+            use_map(*map_bank.sample())
+        episode_start_time = time.time()
+        valid_actions = valid_action_mask(map) if USE_ACTION_MASK else None
+        start, goal = sample_start_goal(map)
+        current_pos = start
+        trajectory = []
+        for _ in range(max_steps):
+            state = goal_states(map, [current_pos], [goal])
+            action = choose_action(state, policy_net, epsilon,
+                                   valid_actions[current_pos] if valid_actions is not None else None)
+            next_pos, reward, done = step_goal(current_pos, action, goal)
+            trajectory.append((current_pos, action, next_pos))
+            for _ in range(scheduler.updates_due(steps_done, len(memory))):
+                if optimize_model_v2(policy_net, target_net, optimizer, memory,
+                                     batch_size=scheduler.batch_size, scheduler=scheduler) is not None:
+                    scheduler.after_update(target_net, policy_net)
+            steps_done += 1
+            current_pos = next_pos
+            if done:
+                break
+        for transition in her_transitions(trajectory, goal, map, her_k):
+            memory.push(*transition, GAMMA, current_map_id)
+            if recorder is not None:
+                recorder.add(*transition, GAMMA, current_map_id)
+        episode_steps.append(len(trajectory))
+        successes.append(current_pos == goal)
+        epsilon = max(min_epsilon, epsilon * eps_decay)
+        cumulative_time += time.time() - episode_start_time
+        cumulative_times.append(cumulative_time)
+        print(f'Goal-conditioned - Episode {episode}, Start: {start}, Goal: {goal}, '
+              f'Steps: {len(trajectory)}, Reached: {current_pos == goal}, '
+              f'Epsilon: {epsilon:.3f}, Memory: {len(memory)}')
+        memory_monitor.update(episode, memory, policy_net, target_net, optimizer, caches=caches)
+    memory, prefetch_stats = stop_prefetch(memory)
+    memory_monitor.update(len(episode_steps) - 1, memory, policy_net, target_net, optimizer, final=True,
+                          caches=caches)
+    metrics = {'learner': scheduler.stats(), 'memory': memory_monitor.summary()}
+    if prefetch_stats is not None:
+        metrics['prefetch'] = prefetch_stats
+    metrics['eval'] = evaluate_goal_pairs(policy_net, map, [sample_start_goal(map) for _ in range(GOAL_EVAL_PAIRS)])
+    return episode_steps, successes, cumulative_times, policy_net, metrics
+
+# 障碍物变化后的增量重规划
+FINE_TUNE_EPISODES = 20  # 微调轮数预算
+
+def transitions_touch_cells(transitions, touched):
+    """touched为布尔地图，返回每条转移的当前格子或下一格子是否落在touched内"""
+    flat_touched = touched.ravel()
+    states = torch.cat([t[0] for t in transitions]).view(len(transitions), -1)
+    hit = flat_touched[states.argmax(1).cpu().numpy()]  # 智能体所在格子值为2，为最大值
+    next_idx = [i for i, t in enumerate(transitions) if t[3] is not None]
+    if next_idx:
+        next_states = torch.cat([transitions[i][3] for i in next_idx]).view(len(next_idx), -1)
+        hit[next_idx] |= flat_touched[next_states.argmax(1).cpu().numpy()]
+    return hit
+
+def invalidate_transitions(memory, changed_cells, map_shape):
+    """删除经验池中与改动格子相邻（含自身，8邻域）的转移，返回删除条数"""
+    touched = np.zeros(map_shape, dtype=bool)
+    for r, c in changed_cells:
+        touched[max(r - 1, 0):r + 2, max(c - 1, 0):c + 2] = True
+    if getattr(memory, 'store', None) is not None:
+        pools = [memory.all_memory]  # 共享存储压缩时近障碍物子集随之更新
+    else:
+        pools = memory.sampler.pools if hasattr(memory, 'sampler') else [memory]
+    # 算法3的近障碍物经验同时存在于全部经验中，只按全部经验计数
+    counted = getattr(memory, 'all_memory', None)
+    removed = 0
+    for pool in pools:
+        transitions = pool.stored_transitions()
+        if len(transitions) == 0:
+            continue
+        keep = ~transitions_touch_cells(transitions, touched)
+        if counted is None or pool is counted:
+            removed += int((~keep).sum())
+        pool.filter(keep)
+    return removed
+
+def fine_tune_policy(policy_net, memory, step_func, optimize_func, num_episodes=FINE_TUNE_EPISODES,
+                     epsilon=0.1, max_steps=3000, map_cache=None, scheduler=None, optimizer=None, target_net=None):
+    """在已有策略和经验池的基础上微调少量轮数，返回每轮步数。
+    传入训练时的 optimizer 和 target_net 可保留Adam的动量估计和滞后的目标网络；未传入时才新建"""
+    if scheduler is None:
+        scheduler = LearnerScheduler()
+    if target_net is None:
+        target_net = type(policy_net)(policy_net.conv1.in_channels, policy_net.fc2.out_features).to(device)
+        target_net.load_state_dict(policy_net.state_dict())
+        target_net.eval()
+    if optimizer is None:
+        optimizer = optim.Adam(policy_net.parameters(), lr=LEARNING_RATE)
+    to_state = map_cache.state if map_cache is not None else (lambda pos: matrix_to_img(pos, map))
+    steps_done = 0
+    episode_steps = []
+    for episode in range(num_episodes):
+        current_pos = start_pos
+        valid_actions = None
+        if USE_ACTION_MASK:
+            valid_actions = map_cache.valid_actions if map_cache is not None else valid_action_mask(map)
+        visited_positions = {}
+        prev_action = None
+        prev_actions = []
+        n_step = NStepTransitionBuilder()
+        for step_count in range(1, max_steps + 1):
+            state = to_state(current_pos)
+            action = choose_action(state, policy_net, epsilon,
+                                   valid_actions[current_pos] if valid_actions is not None else None)
+            if step_func is step_v3:
+                next_pos, reward, done, visited_positions, prev_actions, duration = take_step(
+                    step_v3, current_pos, action, target_pos, visited_positions, prev_action, prev_actions)
+            else:
+                next_pos, reward, done, visited_positions, duration = take_step(
+                    step_func, current_pos, action, target_pos, visited_positions, prev_action)
+            next_state = to_state(next_pos) if not done else None
+            transitions = n_step.append(state, action, reward, next_state, done, current_pos,
+                                        truncated=step_count >= max_steps, duration=duration)
+            for i, transition in enumerate(transitions):
+                push_n_step_transition(memory, transition, is_episode_end=i == len(transitions) - 1)
+            for _ in range(scheduler.updates_due(steps_done, len(memory))):
+                if optimize_func(policy_net, target_net, optimizer, memory,
+                                 batch_size=scheduler.batch_size, scheduler=scheduler) is not None:
+                    scheduler.after_update(target_net, policy_net)
+            prev_action = action
+            current_pos = next_pos
+            steps_done += 1
+            if done:
+                break
+        episode_steps.append(step_count)
+    return episode_steps
+
+def replan_after_change(policy_net, changes, algorithm='v1', memory=None, map_cache=None,
+                        num_episodes=FINE_TUNE_EPISODES, optimizer=None, target_net=None):
+    """障碍物变化后的增量更新：刷新地图缓存、删除受影响的经验、在原策略上短时微调，返回新路径和统计信息。
+    changes 为 (row, col, value) 列表，value为1表示新增障碍物，0表示移除障碍物；
+    optimizer / target_net 为训练时的优化器和目标网络（见 fine_tune_policy）"""
+    if map_cache is None:
+        map_cache = MapCache(map, target_pos)
+    changed_cells = map_cache.apply_diff(changes)
+    use_map(map_cache.map, current_map_id)
+    if memory is None:
+        memory = make_algorithm_memory(algorithm)
+        removed = 0
+    else:
+        removed = invalidate_transitions(memory, changed_cells, map_cache.map.shape)
+    step_func, optimize_func = {
+        'v1': (step_v1, optimize_model_v1),
+        'v2': (step_v2, optimize_model_v2),
+        'v3': (step_v3, optimize_model_v3),
+    }[algorithm]
+    start_time = time.time()
+    fine_tune_steps = []
+    if changed_cells and map_cache.reachable[start_pos]:
+        fine_tune_steps = fine_tune_policy(policy_net, memory, step_func, optimize_func,
+                                           num_episodes, map_cache=map_cache, optimizer=optimizer,
+                                           target_net=target_net)
+    path = test_net(policy_net, start_pos, target_pos, step_func)
+    return path, {
+        'changed_cells': changed_cells,
+        'removed_transitions': removed,
+        'reachable': bool(map_cache.reachable[start_pos]),
+        'fine_tune_steps': fine_tune_steps,
+        'fine_tune_time': time.time() - start_time,
+        'memory': memory_report(memory, policy_net, caches={'map_cache': map_cache}),
+    }
+
 def main():
+    import matplotlib.pyplot as plt
     # 生成20×20地图
     global map, start_pos, target_pos
     map = generate_map(size=20, obstacle_ratio=0.2)
@@ -1171,7 +3006,7 @@ def main():
     # 运行三个算法获取训练好的网络
     print("Running Algorithm 1 (G-DPER-DDQN)...")
     start1 = time.time()
-    steps1, rewards1, times1, path1, learning_rates1, net1, epsilons1 = run_algorithm_v1()
+    steps1, rewards1, times1, path1, learning_rates1, net1, epsilons1, metrics1 = run_algorithm_v1()
     end1 = time.time()
     print(f"算法1运行时间: {end1 - start1:.6f} 秒")
     # 保存算法1训练好的模型
@@ -1180,7 +3015,7 @@ def main():
 
     print("\nRunning Algorithm 2 (PER-DDQN)...")
     start2 = time.time()
-    steps2, rewards2, times2, path2, net2 = run_algorithm_v2()
+    steps2, rewards2, times2, path2, net2, metrics2 = run_algorithm_v2()
     end2 = time.time()
     print(f"算法2运行时间: {end2 - start2:.6f} 秒")
     torch.save(net2.state_dict(), "per_ddqn_model.pth")
@@ -1188,7 +3023,7 @@ def main():
 
     print("\nRunning Algorithm 3 (ECMS-DDQN)...")
     start3 = time.time()
-    steps3, rewards3, times3, path3, net3 = run_algorithm_v3()
+    steps3, rewards3, times3, path3, net3, metrics3 = run_algorithm_v3()
     end3 = time.time()
     print(f"算法3运行时间: {end3 - start3:.6f} 秒")
     torch.save(net3.state_dict(), "ECMSddqn_model.pth")
@@ -1247,70 +3082,126 @@ def main():
     plt.legend()
     plt.show()
 
-    # 路径平滑处理
-    smooth_path1 = smooth_path(path1)
-    smooth_path2 = smooth_path(path2)
-    smooth_path3 = smooth_path(path3)
+    # 路径平滑处理及路径指标（批量计算）
+    from path_analytics import analyze_paths
+    analytics = analyze_paths([path1, path2, path3], map)
+    smooth_path1, smooth_path2, smooth_path3 = analytics['smoothed']
 
     # 显示路径对比（使用平滑后的路径）
     plot_paths_four(smooth_path1, smooth_path2, smooth_path3, 
                    " Paths Comparison", 
                    start_pos, target_pos, map)
     # 输出三种算法的路径长度
-    print(f"G-DPER-DDQN 路径长度: {len(path1)}")
-    print(f"PER-DDQN 路径长度: {len(path2)}")
-    print(f"ECMS-DDQN 路径长度: {len(path3)}")
-    # 计算路径转折点数量的函数
-    def count_turns(path):
-        if len(path) < 3:
-            return 0
-        turns = 0
-        for i in range(2, len(path)):
-            dx1 = path[i-1][0] - path[i-2][0]
-            dy1 = path[i-1][1] - path[i-2][1]
-            dx2 = path[i][0] - path[i-1][0]
-            dy2 = path[i][1] - path[i-1][1]
-            if (dx1, dy1) != (dx2, dy2):
-                turns += 1
-        return turns
-
-    print(f"G-DPER-DDQN 路径转折点数量: {count_turns(path1)}")
-    print(f"PER-DDQN 路径转折点数量: {count_turns(path2)}")
-    print(f"ECMS-DDQN 路径转折点数量: {count_turns(path3)}")
+    names = ['G-DPER-DDQN', 'PER-DDQN', 'ECMS-DDQN']
+    for name, points in zip(names, analytics['points']):
+        print(f"{name} 路径长度: {points}")
+    for name, turns in zip(names, analytics['turns']):
+        print(f"{name} 路径转折点数量: {turns}")
+    for name, collisions in zip(names, analytics['collisions']):
+        print(f"{name} 平滑路径穿过障碍物的点数: {collisions}")
 
 # 保存训练数据到CSV文件
     import pandas as pd
-    # 创建数据字典
+    # 创建数据字典（早停后各算法轮数可能不同，用Series按Episode对齐，缺失处为空）
+    num_rows = max(len(steps1), len(steps2), len(steps3))
     steps_data = {
-        'Episode': range(len(steps1)),
-        'G-DPER-DDQN': steps1,
-        'PER-DDQN': steps2,
-        'MS-DDQN': steps3
+        'Episode': range(num_rows),
+        'G-DPER-DDQN': pd.Series(steps1),
+        'PER-DDQN': pd.Series(steps2),
+        'MS-DDQN': pd.Series(steps3)
     }
     
     rewards_data = {
-        'Episode': range(len(rewards1)),
-        'D-PER-DDQN': rewards1,
-        'PER-DDQN': rewards2,
-        'MS-DDQN': rewards3
+        'Episode': range(num_rows),
+        'D-PER-DDQN': pd.Series(rewards1),
+        'PER-DDQN': pd.Series(rewards2),
+        'MS-DDQN': pd.Series(rewards3)
     }
 
     times_data = {
-        'Episode': range(len(times1)),
-        'D-PER-DDQN': times1,
-        'PER-DDQN': times2,
-        'MS-DDQN': times3
+        'Episode': range(num_rows),
+        'D-PER-DDQN': pd.Series(times1),
+        'PER-DDQN': pd.Series(times2),
+        'MS-DDQN': pd.Series(times3)
+    }
+
+    # 记录各算法的早停轮数（未早停则为空）
+    convergence_data = {
+        'Algorithm': ['G-DPER-DDQN', 'PER-DDQN', 'MS-DDQN'],
+        'StopEpisode': [m['stop_episode'] for m in (metrics1, metrics2, metrics3)],
+        'Episodes': [m['episodes'] for m in (metrics1, metrics2, metrics3)],
+        # 训练结束时各算法经验池、网络和优化器占用的内存
+        'MemoryMB': [m['memory'][-1][1]['total_bytes'] / 2 ** 20 for m in (metrics1, metrics2, metrics3)]
     }
 
     # 创建DataFrame并保存为CSV
     pd.DataFrame(steps_data).to_csv('training_steps.csv', index=False)
     pd.DataFrame(rewards_data).to_csv('training_rewards.csv', index=False)
     pd.DataFrame(times_data).to_csv('training_times.csv', index=False)
+    pd.DataFrame(convergence_data).to_csv('training_convergence.csv', index=False)
     
     print("\nTraining data has been saved to:")
     print("- training_steps.csv")
     print("- training_rewards.csv")
     print("- training_times.csv")
+    print("- training_convergence.csv")
+
+def run_multimap_training(algorithm='v1', map_bank=None):
+    """多地图训练：一个网络在地图库的多张训练地图上训练，训练后在留出地图上测试泛化能力"""
+    global start_pos, target_pos
+    if map_bank is None:
+        map_bank = MapBank()
+    size = map_bank.maps[0].shape[0]
+    start_pos = (size - 1, 0)
+    target_pos = (0, size - 1)
+    print(f"Multi-map training ({algorithm}) on {len(map_bank.train_ids)} maps, "
+          f"{len(map_bank.held_out_ids)} held out...")
+    # 每轮换一张随机地图，相邻两次贪婪检查的路径长度不可比，收敛早停没有意义，始终跑满 NUM_EPISODES
+    monitor = ConvergenceMonitor(enabled=False)
+    if algorithm == 'v1':
+        steps, rewards, times, path, _, policy_net, _, metrics = run_algorithm_v1(monitor, map_bank=map_bank)
+        step_func = step_v1
+    elif algorithm == 'v2':
+        steps, rewards, times, path, policy_net, metrics = run_algorithm_v2(monitor, map_bank=map_bank)
+        step_func = step_v2
+    else:
+        steps, rewards, times, path, policy_net, metrics = run_algorithm_v3(monitor, map_bank=map_bank)
+        step_func = step_v3
+    metrics['train_eval'] = evaluate_on_maps(policy_net, map_bank, map_bank.train_ids, step_func)
+    metrics['held_out_eval'] = evaluate_on_maps(policy_net, map_bank, map_bank.held_out_ids, step_func)
+    print(f"训练地图成功率: {metrics['train_eval']['success_rate']:.2f}, "
+          f"留出地图成功率: {metrics['held_out_eval']['success_rate']:.2f}, "
+          f"留出地图平均路径长度: {metrics['held_out_eval']['mean_length']}")
+    torch.save(policy_net.state_dict(), f"multimap_{algorithm}_model.pth")
+    return policy_net, metrics
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if '--autotune' in sys.argv:
+        # 训练前按本机校准线程数、BATCH_SIZE 和 REPLAY_INTERVAL（结果按主机缓存）
+        sys.argv.remove('--autotune')
+        from autotune import autotune, apply_tuning
+        # 直接调优当前运行的模块，而不是让 autotune 再导入一份 main
+        apply_tuning(autotune(module=sys.modules[__name__]), sys.modules[__name__])
+    if '--demos' in sys.argv:
+        # 用BFS最短路径示范预填充经验池：python main.py --demos 20
+        i = sys.argv.index('--demos')
+        DEMO_PATHS = int(sys.argv[i + 1])
+        del sys.argv[i:i + 2]
+    if '--eval-interval' in sys.argv:
+        # 训练中每隔N轮在独立进程中评估策略快照：python main.py --eval-interval 10
+        i = sys.argv.index('--eval-interval')
+        EVAL_INTERVAL = int(sys.argv[i + 1])
+        del sys.argv[i:i + 2]
+    if len(sys.argv) > 1 and sys.argv[1] == "multimap":
+        # 多地图训练模式：python main.py multimap [v1|v2|v3]
+        run_multimap_training(sys.argv[2] if len(sys.argv) > 2 else 'v1')
+    elif len(sys.argv) > 1 and sys.argv[1] == "goal":
+        # 目标条件训练：python main.py goal，一个模型服务任意(起点, 终点)
+        map = generate_map(size=20, obstacle_ratio=0.2)
+        _, _, _, goal_net, goal_metrics = run_goal_conditioned()
+        print(f"随机起终点测试成功率: {goal_metrics['eval']['success_rate']:.2f}, "
+              f"平均路径长度: {goal_metrics['eval']['mean_length']}")
+        torch.save(goal_net.state_dict(), "goal_dqn_model.pth")
+        np.save("goal_dqn_map.npy", map)
+    else:
+        main()
\ No newline at end of file
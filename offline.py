@@ -0,0 +1,280 @@
+"""离线经验数据集：把 run_algorithm_* 产生的转移记录为分块的紧凑数据集，
+再用 DataLoader 的工作进程流式读取这些数据块，直接做 Double DQN 更新，无需重新仿真。
+
+每条转移只保存地图编号、智能体位置、动作、奖励、下一位置、done、折扣（目标条件数据另存目标位置），
+地图本身在每个数据块中只存一份，每条转移只占几十字节，远小于经验池中保存的 state/next_state 张量。
+record 结束时会按数据块文件大小打印实际的每条转移字节数。
+状态张量由工作进程按批次重建。
+
+用法:
+    python offline.py record v1 data --episodes 50     # 运行算法1并把转移记录到 data/
+    python offline.py train data --epochs 5 --workers 2 # 用 data/ 中的数据离线训练
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+CHUNK_SIZE = 50000  # 每个数据块的转移数
+METADATA_FILE = 'dataset.json'
+
+
+class TransitionRecorder:
+    """把转移追加写入分块数据集，每满 chunk_size 条写一个 chunk_XXXXX.npz，close() 写入元数据。
+    num_actions 为产生数据的网络的动作数（宏动作模式下大于4），离线训练按它创建网络"""
+    def __init__(self, directory, chunk_size=CHUNK_SIZE, num_actions=None):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.num_actions = num_actions
+        self.max_action = -1
+        self.chunks = []
+        self.channels = None
+        self.shape = None
+        os.makedirs(directory, exist_ok=True)
+        self._reset()
+
+    def _reset(self):
+        self.maps = {}  # 地图字节 -> 数据块内的地图下标
+        self.buffer = {name: [] for name in ('map_index', 'map_id', 'pos', 'action', 'reward',
+                                             'next_pos', 'done', 'discount', 'goal')}
+
+    def add(self, state, action, reward, next_state, done, discount, map_id=-1):
+        grid = state[0].detach().cpu().numpy()  # (C, H, W)
+        self.channels, self.shape = grid.shape[0], grid.shape[1:]
+        pos = np.unravel_index(int(grid[0].argmax()), self.shape)  # 智能体所在格子值为2
+        map_array = grid[0].astype(np.uint8)
+        map_array[pos] = 0
+        key = map_array.tobytes()
+        if key not in self.maps:
+            self.maps[key] = len(self.maps)
+        if next_state is None:
+            next_pos = (-1, -1)
+        else:
+            next_pos = np.unravel_index(int(next_state[0, 0].argmax()), self.shape)
+        goal = np.unravel_index(int(grid[1].argmax()), self.shape) if self.channels > 1 else (-1, -1)
+        buffer = self.buffer
+        buffer['map_index'].append(self.maps[key])
+        buffer['map_id'].append(map_id)
+        buffer['pos'].append(pos)
+        buffer['action'].append(action)
+        self.max_action = max(self.max_action, int(action))
+        buffer['reward'].append(reward)
+        buffer['next_pos'].append(next_pos)
+        buffer['done'].append(done)
+        buffer['discount'].append(discount)
+        buffer['goal'].append(goal)
+        if len(buffer['action']) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        size = len(self.buffer['action'])
+        if size == 0:
+            return
+        name = f'chunk_{len(self.chunks):05d}.npz'
+        maps = np.stack([np.frombuffer(key, dtype=np.uint8).reshape(self.shape) for key in self.maps])
+        buffer = self.buffer
+        np.savez_compressed(
+            os.path.join(self.directory, name),
+            maps=maps,
+            map_index=np.array(buffer['map_index'], dtype=np.int32),
+            map_id=np.array(buffer['map_id'], dtype=np.int32),
+            pos=np.array(buffer['pos'], dtype=np.int16),
+            action=np.array(buffer['action'], dtype=np.int8),
+            reward=np.array(buffer['reward'], dtype=np.float32),
+            next_pos=np.array(buffer['next_pos'], dtype=np.int16),
+            done=np.array(buffer['done'], dtype=bool),
+            discount=np.array(buffer['discount'], dtype=np.float32),
+            goal=np.array(buffer['goal'], dtype=np.int16),
+        )
+        self.chunks.append({'file': name, 'size': size,
+                            'bytes': os.path.getsize(os.path.join(self.directory, name))})
+        self._reset()
+
+    def close(self):
+        self.flush()
+        metadata = {
+            'channels': self.channels,
+            'shape': list(self.shape) if self.shape is not None else None,
+            'transitions': sum(chunk['size'] for chunk in self.chunks),
+            'bytes': sum(chunk['bytes'] for chunk in self.chunks),
+            'num_actions': self.num_actions,
+            'max_action': self.max_action,
+            'chunks': self.chunks,
+        }
+        with open(os.path.join(self.directory, METADATA_FILE), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        return metadata
+
+
+def load_metadata(directory):
+    with open(os.path.join(directory, METADATA_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def dataset_num_actions(metadata, default):
+    """数据集的动作数；旧数据集没有记录时用default（当前 main 的动作数）。动作编号超出动作数时报错"""
+    num_actions = metadata.get('num_actions') or default
+    if metadata.get('max_action', -1) >= num_actions:
+        raise ValueError(f"数据集中的动作编号最大为 {metadata['max_action']}，超出动作数 {num_actions}："
+                         f"数据集可能是在宏动作模式下记录的（MACRO_MAX_LENGTH 不同）")
+    return num_actions
+
+
+def build_states(maps, map_index, pos, goal, channels):
+    """由地图和位置批量重建状态张量 (B, C, H, W)，与 matrix_to_img / goal_states 相同"""
+    batch = torch.arange(len(map_index))
+    grid = maps[map_index].clone()
+    grid[batch, pos[:, 0], pos[:, 1]] = 2
+    if channels == 1:
+        return grid.unsqueeze(1)
+    goal_channel = torch.zeros_like(grid)
+    goal_channel[batch, goal[:, 0], goal[:, 1]] = 1
+    return torch.stack((grid, goal_channel), dim=1)
+
+
+class TransitionChunkDataset(IterableDataset):
+    """按数据块流式读取离线数据集，直接产出 collate_batch 格式的批次：
+    (state, action, reward, non_final_mask, non_final_next_states, discount)。
+    多个 DataLoader 工作进程时数据块按编号分给各进程；shuffle 时每轮打乱数据块顺序和块内顺序"""
+    def __init__(self, directory, batch_size=64, shuffle=True, seed=0):
+        self.directory = directory
+        self.metadata = load_metadata(directory)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        chunks = [chunk['file'] for chunk in self.metadata['chunks']]
+        if self.shuffle:
+            chunks = [chunks[i] for i in rng.permutation(len(chunks))]
+        worker = get_worker_info()
+        if worker is not None:
+            chunks = chunks[worker.id::worker.num_workers]
+            rng = np.random.default_rng((self.seed, self.epoch, worker.id))
+        for name in chunks:
+            yield from self.chunk_batches(os.path.join(self.directory, name), rng)
+
+    def chunk_batches(self, path, rng):
+        with np.load(path) as data:
+            arrays = {name: torch.from_numpy(data[name].astype(np.int64) if name in ('pos', 'next_pos', 'goal',
+                                                                                      'map_index', 'action')
+                                             else data[name])
+                      for name in ('map_index', 'pos', 'action', 'reward', 'next_pos', 'discount', 'goal')}
+            maps = torch.from_numpy(data['maps'].astype(np.float32))
+        channels = self.metadata['channels']
+        size = len(arrays['action'])
+        order = torch.from_numpy(rng.permutation(size)) if self.shuffle else torch.arange(size)
+        for start in range(0, size, self.batch_size):
+            idx = order[start:start + self.batch_size]
+            map_index, goal = arrays['map_index'][idx], arrays['goal'][idx]
+            next_pos = arrays['next_pos'][idx]
+            non_final_mask = next_pos[:, 0] >= 0
+            yield (
+                build_states(maps, map_index, arrays['pos'][idx], goal, channels),
+                arrays['action'][idx].unsqueeze(1),
+                arrays['reward'][idx],
+                non_final_mask,
+                build_states(maps, map_index[non_final_mask], next_pos[non_final_mask],
+                             goal[non_final_mask], channels),
+                arrays['discount'][idx],
+            )
+
+
+def record(algorithm, directory, episodes, seed=0, obstacle_ratio=0.2, chunk_size=CHUNK_SIZE):
+    """运行一次训练并记录所有写入经验池的转移"""
+    import main
+    main.seed_everything(seed)
+    main.use_map(main.generate_map(size=20, obstacle_ratio=obstacle_ratio))
+    main.start_pos, main.target_pos = (19, 0), (0, 19)
+    main.NUM_EPISODES = episodes
+    # 目标条件网络只支持单格动作，其余网络的动作数随 MACRO_MAX_LENGTH 变化
+    num_actions = len(main.ACTIONS) * (1 if algorithm == 'goal' else main.MACRO_MAX_LENGTH)
+    recorder = TransitionRecorder(directory, chunk_size, num_actions)
+    if algorithm == 'goal':
+        main.run_goal_conditioned(recorder=recorder)
+    else:
+        run = {'v1': main.run_algorithm_v1, 'v2': main.run_algorithm_v2, 'v3': main.run_algorithm_v3}[algorithm]
+        run(recorder=recorder)
+    return recorder.close()
+
+
+def train_offline(directory, epochs=1, batch_size=None, num_workers=2, lr=None, tau=0.01, seed=0):
+    """用 DataLoader 流式读取离线数据集训练一个新的 DQN，返回网络和训练统计"""
+    import main
+    main.seed_everything(seed)
+    batch_size = batch_size or main.BATCH_SIZE
+    dataset = TransitionChunkDataset(directory, batch_size, shuffle=True, seed=seed)
+    loader = DataLoader(dataset, batch_size=None, num_workers=num_workers,
+                        pin_memory=main.device.type == 'cuda')
+    num_actions = dataset_num_actions(dataset.metadata, len(main.ACTIONS) * main.MACRO_MAX_LENGTH)
+    policy_net = main.DQN(dataset.metadata['channels'], num_actions).to(main.device)
+    target_net = main.DQN(dataset.metadata['channels'], num_actions).to(main.device)
+    target_net.load_state_dict(policy_net.state_dict())
+    target_net.eval()
+    optimizer = torch.optim.Adam(policy_net.parameters(), lr=lr or main.LEARNING_RATE)
+    scheduler = main.LearnerScheduler(batch_size=batch_size, tau=tau)
+    epoch_losses = []
+    start_time = time.time()
+    for epoch in range(epochs):
+        dataset.set_epoch(epoch)
+        losses = []
+        for batch in loader:
+            losses.append(main.optimize_offline(policy_net, target_net, optimizer, batch, scheduler))
+            scheduler.after_update(target_net, policy_net)
+        epoch_losses.append(float(np.mean(losses)) if losses else 0.0)
+        print(f'Offline epoch {epoch}, updates: {len(losses)}, loss: {epoch_losses[-1]:.6f}')
+    elapsed = time.time() - start_time
+    return policy_net, {
+        'epoch_losses': epoch_losses,
+        'updates': scheduler.updates,
+        'samples_per_sec': scheduler.samples_drawn / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线经验数据集的记录与训练')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    record_parser = subparsers.add_parser('record', help='运行算法并记录转移')
+    record_parser.add_argument('algorithm', choices=['v1', 'v2', 'v3', 'goal'])
+    record_parser.add_argument('directory')
+    record_parser.add_argument('--episodes', type=int, default=50)
+    record_parser.add_argument('--seed', type=int, default=0)
+    record_parser.add_argument('--obstacle-ratio', type=float, default=0.2)
+    record_parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    train_parser = subparsers.add_parser('train', help='用离线数据集训练')
+    train_parser.add_argument('directory')
+    train_parser.add_argument('--epochs', type=int, default=1)
+    train_parser.add_argument('--batch-size', type=int, default=None)
+    train_parser.add_argument('--workers', type=int, default=2, help='DataLoader 工作进程数')
+    train_parser.add_argument('--seed', type=int, default=0)
+    train_parser.add_argument('--out', default='offline_model.pth')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        metadata = record(args.algorithm, args.directory, args.episodes, args.seed, args.obstacle_ratio,
+                          args.chunk_size)
+        print(f"已记录 {metadata['transitions']} 条转移，共 {len(metadata['chunks'])} 个数据块")
+        if metadata['transitions']:
+            # 经验池中每条转移保存 state 和 next_state 两个 float32 张量
+            tensor_bytes = 2 * 4 * metadata['channels'] * int(np.prod(metadata['shape']))
+            print(f"每条转移约 {metadata['bytes'] / metadata['transitions']:.1f} 字节（压缩后），"
+                  f"经验池中约 {tensor_bytes} 字节")
+    else:
+        policy_net, stats = train_offline(args.directory, args.epochs, args.batch_size, args.workers,
+                                          seed=args.seed)
+        torch.save(policy_net.state_dict(), args.out)
+        print(f"离线训练完成：{stats['updates']} 次更新，{stats['samples_per_sec']:.0f} 样本/秒，"
+              f"模型已保存为 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""批量路径分析：一次处理多条路径的长度、转折点数量、B样条平滑以及平滑曲线与障碍物的碰撞检查。
+
+所有计算都用数组运算完成：路径拼接后按下标补齐成 (路径数, 最大点数, 2) 的数组；
+B样条插值对坐标是线性的，点数相同的路径共用一个缓存的插值矩阵，平滑只需一次矩阵乘法。
+main.py 的 smooth_path、count_turns 以及评估和绘图都使用本模块。
+"""
+from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+
+
+def pad_paths(paths):
+    """把路径列表补齐为 (B, L, 2) 的坐标数组（较短的路径重复最后一个点），同时返回每条路径的点数"""
+    lengths = np.array([len(p) for p in paths], dtype=np.int64)
+    flat = np.concatenate([np.asarray(p, dtype=np.float64).reshape(-1, 2) for p in paths])
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    steps = np.minimum(np.arange(lengths.max())[None, :], (lengths - 1)[:, None])
+    return flat[offsets[:, None] + steps], lengths
+
+
+def path_lengths(paths):
+    """每条路径的欧氏长度（原地不动的步长度为0），对于栅格路径即实际移动的步数"""
+    coords, _ = pad_paths(paths)
+    return np.linalg.norm(np.diff(coords, axis=1), axis=2).sum(1)
+
+
+def turn_counts(paths):
+    """每条路径的转折点数量，与逐条计算时相同：相邻两步位移不同即记一次转折"""
+    coords, lengths = pad_paths(paths)
+    moves = np.diff(coords, axis=1)
+    changed = (moves[:, 1:] != moves[:, :-1]).any(2)
+    valid = np.arange(changed.shape[1])[None, :] < (lengths - 2)[:, None]
+    return (changed & valid).sum(1)
+
+
+@lru_cache(maxsize=256)
+def spline_operator(num_knots, k, num_points):
+    """num_knots个等距参数点上的k次插值B样条在num_points个等距参数点处的取值矩阵 (num_points, num_knots)，
+    平滑结果 = 矩阵 @ 路径坐标，与对每条路径分别调用 splrep/splev 相同"""
+    from scipy.interpolate import make_interp_spline
+    t = np.linspace(0, 1, num_knots)
+    return make_interp_spline(t, np.eye(num_knots), k=k)(np.linspace(0, 1, num_points))
+
+
+def smooth_paths(paths, k=3, num_points=100):
+    """批量B样条平滑，返回每条路径的 (num_points, 2) 数组（行, 列）；少于4个点的路径原样返回"""
+    coords = [np.asarray(p, dtype=np.float64).reshape(-1, 2) for p in paths]
+    result = [None] * len(coords)
+    groups = defaultdict(list)
+    for i, c in enumerate(coords):
+        if len(c) < 4:
+            result[i] = c
+        else:
+            groups[len(c)].append(i)
+    for num_knots, indices in groups.items():
+        operator = spline_operator(num_knots, min(k, num_knots - 1), num_points)
+        smoothed = np.einsum('pn,bnd->bpd', operator, np.stack([coords[i] for i in indices]))
+        for i, curve in zip(indices, smoothed):
+            result[i] = curve
+    return result
+
+
+def collision_counts(curves, map_array):
+    """每条曲线上落在地图外或障碍物格子（四舍五入到最近格子）上的点数"""
+    rows, cols = map_array.shape
+    counts = np.array([len(c) for c in curves], dtype=np.int64)
+    cells = np.rint(np.concatenate(curves)).astype(np.int64)
+    inside = (cells >= 0).all(1) & (cells[:, 0] < rows) & (cells[:, 1] < cols)
+    blocked = ~inside
+    blocked[inside] = map_array[cells[inside, 0], cells[inside, 1]] == 1
+    path_ids = np.repeat(np.arange(len(curves)), counts)
+    return np.bincount(path_ids, weights=blocked, minlength=len(curves)).astype(np.int64)
+
+
+def analyze_paths(paths, map_array=None, goals=None, k=3, num_points=100):
+    """批量计算路径指标：点数、欧氏长度、转折点数量、平滑曲线；
+    给出map_array时检查平滑曲线是否穿过障碍物，给出goals时判断是否到达终点"""
+    coords, lengths = pad_paths(paths)
+    result = {
+        'points': lengths,
+        'length': path_lengths(paths),
+        'turns': turn_counts(paths),
+        'smoothed': smooth_paths(paths, k, num_points),
+    }
+    if map_array is not None:
+        result['collisions'] = collision_counts(result['smoothed'], map_array)
+    if goals is not None:
+        last = coords[np.arange(len(paths)), lengths - 1]
+        result['reached'] = (last == np.asarray(goals, dtype=np.float64).reshape(-1, 2)).all(1)
+    return result
@@ -0,0 +1,225 @@
+"""基于种群的超参数训练（PBT）：同一个算法的多个成员在并行的工作进程中训练，
+每隔 interval 轮比较一次成绩，排名靠后的成员复制排名靠前成员的网络权重和优化器状态，
+并在其超参数上做随机扰动后继续训练。一次运行的时间内即可找到较好的超参数，而不必串行网格搜索。
+
+用法:
+    python pbt.py v1 --population 4 --generations 10 --interval 10
+
+各成员保留自己的经验池，只复制网络和优化器；算法3的近障碍物经验池容量比例 near_fraction
+只在创建成员时随机选取（经验池已分配后无法调整容量），之后不再扰动。
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import random
+import time
+
+# 超参数搜索空间：名称 -> (下界, 上界, 适用的算法)
+HYPERPARAM_SPACE = {
+    'lr': (1e-4, 2e-2, ('v1', 'v2', 'v3')),
+    'gamma': (0.8, 0.99, ('v1', 'v2', 'v3')),
+    'eps_decay': (0.95, 0.999, ('v1', 'v2', 'v3')),
+    'alpha': (0.3, 0.9, ('v1', 'v2')),
+    'elite_threshold': (0.5, 10.0, ('v1',)),
+    'p0': (0.1, 0.7, ('v1', 'v3')),
+    'p1': (0.2, 0.8, ('v1', 'v3')),
+    'beta_t': (0.1, 0.8, ('v1', 'v3')),
+    'near_fraction': (0.1, 0.5, ('v3',)),
+}
+# 只在创建成员时选取、之后不再扰动的超参数
+INIT_ONLY = ('near_fraction',)
+PERTURB_FACTORS = (0.8, 1.2)
+# spawn 的工作进程重新导入 main，看不到主进程运行时修改的设置，这些设置由主进程传入
+INHERITED_SETTINGS = ('MACRO_MAX_LENGTH', 'USE_ACTION_MASK', 'REPLAY_ENGINE', 'BATCH_SIZE', 'REPLAY_INTERVAL')
+MAX_STEPS = 3000
+JOIN_TIMEOUT = 10  # 结束时等待工作进程退出的秒数，超时则强制终止
+
+
+def sample_hyperparams(algorithm, rng):
+    return {name: rng.uniform(low, high) for name, (low, high, algorithms) in HYPERPARAM_SPACE.items()
+            if algorithm in algorithms}
+
+
+def perturb(hyperparams, rng):
+    """explore：每个超参数乘以0.8或1.2并截断到搜索空间内"""
+    result = dict(hyperparams)
+    for name, value in hyperparams.items():
+        if name in INIT_ONLY:
+            continue
+        low, high, _ = HYPERPARAM_SPACE[name]
+        result[name] = min(high, max(low, value * rng.choice(PERTURB_FACTORS)))
+    return result
+
+
+def score(steps, path, target_pos):
+    """成员成绩：贪婪路径到达终点时为负的路径长度，否则按本阶段平均步数给出更低的分数"""
+    if path and tuple(path[-1]) == tuple(target_pos):
+        return -float(len(path))
+    return -float(MAX_STEPS) - sum(steps) / max(len(steps), 1)
+
+
+def apply_hyperparams(agent, memory, hyperparams):
+    """把超参数写入智能体状态和经验池"""
+    agent['gamma'] = hyperparams['gamma']
+    agent['eps_decay'] = hyperparams['eps_decay']
+    for group in agent['optimizer'].param_groups:
+        group['lr'] = hyperparams['lr']
+    for name in ('elite_threshold', 'p0', 'p1', 'beta_t'):
+        if name in hyperparams:
+            setattr(memory, name, hyperparams[name])
+    if 'alpha' in hyperparams:
+        # PER-DDQN 的经验池本身带 alpha，双经验池把 alpha 传给两个子池
+        memory.alpha = hyperparams['alpha']
+        for pool in (memory.sampler.pools if hasattr(memory, 'sampler') else []):
+            pool.alpha = hyperparams['alpha']
+
+
+def worker(member_id, algorithm, map_array, start_pos, target_pos, hyperparams, total_episodes, seed, conn,
+           settings=None):
+    """工作进程：持有一个成员的网络、优化器和经验池，按主进程的命令训练或交换状态"""
+    import torch
+    import main
+    torch.set_num_threads(1)
+    for name, value in (settings or {}).items():
+        setattr(main, name, value)
+    main.seed_everything(seed + member_id)
+    main.use_map(map_array)
+    main.start_pos, main.target_pos = start_pos, target_pos
+    run = {'v1': main.run_algorithm_v1, 'v2': main.run_algorithm_v2, 'v3': main.run_algorithm_v3}[algorithm]
+    memory_kwargs = {name: hyperparams[name] for name in ('alpha', 'elite_threshold', 'p0', 'p1', 'beta_t')
+                     if name in hyperparams}
+    memory = main.make_algorithm_memory(algorithm, near_fraction=hyperparams.get('near_fraction', 0.3),
+                                        **memory_kwargs)
+    memory.total_episodes = total_episodes
+    agent = main.init_agent(algorithm, {'lr': hyperparams['lr']})
+    apply_hyperparams(agent, memory, hyperparams)
+    scheduler = main.LearnerScheduler()
+    while True:
+        command, payload = conn.recv()
+        if command == 'train':
+            main.NUM_EPISODES = payload
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = run(monitor=main.ConvergenceMonitor(enabled=False), memory=memory,
+                             scheduler=scheduler, agent=agent)
+            conn.send((score(result[0], result[3], target_pos), result[0]))
+        elif command == 'get_state':
+            conn.send({
+                'policy_net': agent['policy_net'].state_dict(),
+                'target_net': agent['target_net'].state_dict(),
+                'optimizer': agent['optimizer'].state_dict(),
+                'epsilon': agent['epsilon'],
+            })
+        elif command == 'load_state':
+            state, hyperparams = payload
+            agent['policy_net'].load_state_dict(state['policy_net'])
+            agent['target_net'].load_state_dict(state['target_net'])
+            agent['optimizer'].load_state_dict(state['optimizer'])
+            agent['epsilon'] = state['epsilon']
+            apply_hyperparams(agent, memory, hyperparams)
+            conn.send(True)
+        elif command == 'save':
+            torch.save(agent['policy_net'].state_dict(), payload)
+            conn.send(True)
+        else:
+            conn.close()
+            return
+
+
+def run_pbt(algorithm='v1', population=4, generations=10, interval=10, truncation=0.25,
+            seed=0, obstacle_ratio=0.2, model_path=None):
+    """运行PBT，返回最优成员的超参数和每一代的成绩记录"""
+    if generations < 1 or population < 1:
+        raise ValueError('generations 和 population 必须至少为1')
+    import main
+    main.seed_everything(seed)
+    map_array = main.generate_map(size=20, obstacle_ratio=obstacle_ratio)
+    start_pos, target_pos = (19, 0), (0, 19)
+    rng = random.Random(seed)
+    hyperparams = [sample_hyperparams(algorithm, rng) for _ in range(population)]
+    settings = {name: getattr(main, name) for name in INHERITED_SETTINGS}
+    ctx = mp.get_context('spawn')
+    connections, processes = [], []
+    for member_id in range(population):
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(target=worker, args=(member_id, algorithm, map_array, start_pos, target_pos,
+                                                   hyperparams[member_id], generations * interval, seed,
+                                                   child_conn, settings), daemon=True)
+        process.start()
+        connections.append(parent_conn)
+        processes.append(process)
+
+    history = []
+    num_replaced = max(1, int(population * truncation)) if population > 1 else 0
+    try:
+        for generation in range(generations):
+            start_time = time.time()
+            for conn in connections:
+                conn.send(('train', interval))
+            results = [conn.recv() for conn in connections]
+            scores = [s for s, _ in results]
+            ranking = sorted(range(population), key=lambda i: scores[i], reverse=True)
+            history.append({
+                'generation': generation,
+                'scores': scores,
+                'hyperparams': [dict(h) for h in hyperparams],
+            })
+            print(f"Generation {generation}: best {scores[ranking[0]]:.1f} (member {ranking[0]}), "
+                  f"worst {scores[ranking[-1]]:.1f}, {time.time() - start_time:.1f}s")
+            if generation == generations - 1:
+                break
+            # exploit：排名末尾的成员复制排名靠前成员的状态；explore：扰动复制来的超参数
+            for loser in ranking[population - num_replaced:]:
+                winner = rng.choice(ranking[:num_replaced])
+                connections[winner].send(('get_state', None))
+                state = connections[winner].recv()
+                new_hyperparams = perturb(hyperparams[winner], rng)
+                for name in INIT_ONLY:
+                    if name in hyperparams[loser]:
+                        new_hyperparams[name] = hyperparams[loser][name]
+                hyperparams[loser] = new_hyperparams
+                connections[loser].send(('load_state', (state, new_hyperparams)))
+                connections[loser].recv()
+        best = ranking[0]
+        if model_path:
+            connections[best].send(('save', model_path))
+            connections[best].recv()
+    finally:
+        # 工作进程可能已经异常退出，发送失败时不能掩盖原来的异常
+        for conn in connections:
+            try:
+                conn.send(('stop', None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in processes:
+            process.join(JOIN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+    return {'best_member': best, 'best_score': history[-1]['scores'][best],
+            'best_hyperparams': hyperparams[best], 'history': history}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='基于种群的超参数训练（PBT）')
+    parser.add_argument('algorithm', nargs='?', default='v1', choices=['v1', 'v2', 'v3'])
+    parser.add_argument('--population', type=int, default=4, help='种群大小（即工作进程数）')
+    parser.add_argument('--generations', type=int, default=10)
+    parser.add_argument('--interval', type=int, default=10, help='每两次exploit/explore之间训练的轮数')
+    parser.add_argument('--truncation', type=float, default=0.25, help='每代被替换的成员比例')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--obstacle-ratio', type=float, default=0.2)
+    args = parser.parse_args()
+
+    model_path = f"pbt_{args.algorithm}_model.pth"
+    result = run_pbt(args.algorithm, args.population, args.generations, args.interval, args.truncation,
+                     args.seed, args.obstacle_ratio, model_path)
+    with open(f"pbt_{args.algorithm}_history.json", 'w', encoding='utf-8') as f:
+        json.dump(result['history'], f, ensure_ascii=False, indent=2)
+    print(f"最优成员 {result['best_member']} 成绩 {result['best_score']:.1f}，模型已保存为 {model_path}")
+    print(json.dumps(result['best_hyperparams'], ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
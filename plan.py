@@ -0,0 +1,101 @@
+"""仅评估/规划入口：加载已保存的.pth模型，在给定地图上规划路径，不运行任何训练代码。
+
+用法示例:
+    python plan.py g_dper_ddqn_model.pth map.npy --start 19 0 --goal 0 19
+    python plan.py goal_dqn_model.pth goal_dqn_map.npy --pairs 19 0 0 19 --pairs 0 0 10 10
+
+目标条件模型（python main.py goal 训练）可一次批量规划多对起终点，普通模型只适用于训练时的终点。
+
+地图文件支持 .npy（np.save保存）以及 .txt/.csv 文本格式（0为可通行，1为障碍物）。
+参数解析（含 --help）不导入 numpy/torch；加载模型时会导入 main，从而导入 torch，冷启动主要耗在这里
+（python -X importtime 实测约2秒）。matplotlib、scipy、pandas 在 main 中是延迟导入的，规划过程不会加载它们。
+"""
+import argparse
+import json
+import time
+
+
+def load_map(map_file):
+    """读取地图文件，返回float32的二维数组"""
+    import numpy as np
+    if map_file.endswith('.npy'):
+        map_array = np.load(map_file)
+    elif map_file.endswith('.csv'):
+        map_array = np.loadtxt(map_file, delimiter=',')
+    else:
+        map_array = np.loadtxt(map_file)
+    return map_array.astype(np.float32)
+
+
+def load_policy(model_path):
+    """加载保存的DQN权重，返回eval模式的网络；输入通道数和动作数从权重推断（2为目标条件模型，动作数大于4为宏动作模型）"""
+    import torch
+    from main import DQN, device
+    state_dict = torch.load(model_path, map_location=device)
+    policy_net = DQN(in_channels=state_dict['conv1.weight'].shape[1],
+                     num_actions=state_dict['fc2.weight'].shape[0]).to(device)
+    policy_net.load_state_dict(state_dict)
+    policy_net.eval()
+    return policy_net
+
+
+def plan_path(model_path, map_file, start, goal, max_steps=100, policy_net=None):
+    """用训练好的模型规划路径，返回路径、路径长度、转折点数量以及是否到达终点"""
+    from main import greedy_rollout
+    map_array = load_map(map_file) if isinstance(map_file, str) else map_file
+    if policy_net is None:
+        policy_net = load_policy(model_path)
+    if policy_net.conv1.in_channels == 2:
+        return plan_paths(model_path, map_array, [(start, goal)], max_steps, policy_net)[0]
+    path = greedy_rollout(policy_net, map_array, tuple(start), tuple(goal), max_steps)
+    return path_result(path, goal)
+
+
+def plan_paths(model_path, map_file, pairs, max_steps=100, policy_net=None):
+    """目标条件模型一次批量前向为多对 (起点, 终点) 规划路径"""
+    from main import plan_goals
+    map_array = load_map(map_file) if isinstance(map_file, str) else map_file
+    if policy_net is None:
+        policy_net = load_policy(model_path)
+    if policy_net.conv1.in_channels != 2:
+        raise ValueError('批量规划需要目标条件模型（python main.py goal 训练）')
+    from path_analytics import turn_counts
+    pairs = [(tuple(start), tuple(goal)) for start, goal in pairs]
+    paths = plan_goals(policy_net, map_array, pairs, max_steps)
+    turns = turn_counts(paths)
+    return [path_result(path, goal, int(t)) for path, (_, goal), t in zip(paths, pairs, turns)]
+
+
+def path_result(path, goal, turns=None):
+    from main import count_turns
+    return {
+        'path': [tuple(int(v) for v in p) for p in path],
+        'length': len(path),
+        'turns': count_turns(path) if turns is None else turns,
+        'reached': tuple(path[-1]) == tuple(goal),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='使用已训练模型进行路径规划（不训练）')
+    parser.add_argument('model', help='.pth 模型文件')
+    parser.add_argument('map', help='地图文件(.npy/.txt/.csv)')
+    parser.add_argument('--start', type=int, nargs=2, default=(19, 0), metavar=('ROW', 'COL'))
+    parser.add_argument('--goal', type=int, nargs=2, default=(0, 19), metavar=('ROW', 'COL'))
+    parser.add_argument('--pairs', type=int, nargs=4, action='append', metavar=('SR', 'SC', 'GR', 'GC'),
+                        help='目标条件模型批量规划的起终点，可重复给出')
+    parser.add_argument('--max-steps', type=int, default=100)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    if args.pairs:
+        pairs = [((sr, sc), (gr, gc)) for sr, sc, gr, gc in args.pairs]
+        result = {'paths': plan_paths(args.model, args.map, pairs, args.max_steps)}
+    else:
+        result = plan_path(args.model, args.map, args.start, args.goal, args.max_steps)
+    result['elapsed'] = time.time() - start_time
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""性能与训练效果回归测试：固定所有随机种子和地图，每个算法只跑少量轮数，
+与基线CSV（格式同 training_steps.csv / training_times.csv）比较总耗时、每秒步数和首次成功所需轮数。
+
+用法:
+    python regression.py                          # 与 regression_baseline/ 中的基线比较
+    python regression.py --baseline-dir baseline  # 与自己保存的基线比较
+    python regression.py --update regression_baseline  # 用当前代码重新生成基线
+    python regression.py --replay-engine rank     # 用按排名的优先级经验池与基线比较收敛
+    python regression.py --replay-benchmark 1000000 --replay-engine standard rank  # 大容量经验池的采样吞吐量
+
+性能优化不应改变学习行为（首次成功轮数），学习相关的改动也不应悄悄降低吞吐量（耗时、每秒步数）。
+基线必须由 --update 在相同的种子和地图下生成（目录中的 harness.json 记录这些设置以及经验池实现，
+--replay-engine 与基线不同时即为两种经验池实现的比较）；
+仓库根目录的 training_*.csv 是不固定种子的完整训练结果，不能作为基线。耗时与机器有关，换机器后应重新生成基线。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+ALGORITHMS = ['v1', 'v2', 'v3']
+# 基线CSV中的列名与 main() 保存的一致
+STEPS_COLUMNS = ['G-DPER-DDQN', 'PER-DDQN', 'MS-DDQN']
+TIMES_COLUMNS = ['D-PER-DDQN', 'PER-DDQN', 'MS-DDQN']
+MAX_STEPS = 3000
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regression_baseline')
+HARNESS_FILE = 'harness.json'
+
+# 允许的偏差：耗时最多慢25%，每秒步数最多低20%，首次成功轮数最多相差5轮
+TOLERANCES = {
+    'wall_time': 0.25,
+    'steps_per_sec': 0.20,
+    'episodes_to_first_success': 5,
+}
+
+
+def first_success(steps):
+    """第一次在步数上限内到达终点的轮次，没有则为None"""
+    return next((i for i, s in enumerate(steps) if s < MAX_STEPS), None)
+
+
+def summarize(steps, cumulative_times):
+    wall_time = cumulative_times[-1]
+    return {
+        'wall_time': wall_time,
+        'steps_per_sec': sum(steps) / wall_time if wall_time > 0 else 0.0,
+        'episodes_to_first_success': first_success(steps),
+    }
+
+
+def run_profile(algorithm, episodes, seed, obstacle_ratio, engine='standard'):
+    """在固定种子和固定地图上运行一个算法的缩减版训练，返回每轮步数和累计时间"""
+    import main
+    main.REPLAY_ENGINE = engine
+    main.seed_everything(seed)
+    main.use_map(main.generate_map(size=20, obstacle_ratio=obstacle_ratio))
+    main.start_pos = (19, 0)
+    main.target_pos = (0, 19)
+    main.NUM_EPISODES = episodes
+    run = {'v1': main.run_algorithm_v1, 'v2': main.run_algorithm_v2, 'v3': main.run_algorithm_v3}[algorithm]
+    # 关闭早停，保证每次都跑满相同轮数；屏蔽逐轮打印
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = run(monitor=main.ConvergenceMonitor(enabled=False))
+    return result[0], result[2]
+
+
+def replay_throughput(engine, capacity, batch_size=64, rounds=200, seed=0):
+    """填满容量为capacity的PER经验池后交替采样和更新优先级，返回写入、采样和更新优先级的每秒次数。
+    经验只存一个小对象，测量的是经验池本身（SumTree / 排名）的开销"""
+    import numpy as np
+    import main
+    main.REPLAY_ENGINE = engine
+    np.random.seed(seed)
+    memory = main.make_replay_pool(capacity, prioritized=True)
+    start_time = time.perf_counter()
+    for i in range(capacity):
+        memory.push(i, 0, 0.0, i, False)
+    push_time = time.perf_counter() - start_time
+    sample_time = update_time = 0.0
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        _, indices, _ = memory.sample(batch_size, 0.4)
+        sample_time += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        memory.update_priorities(indices, np.random.exponential(size=batch_size))
+        update_time += time.perf_counter() - start_time
+    return {
+        'engine': engine,
+        'capacity': capacity,
+        'pushes_per_sec': capacity / push_time,
+        'samples_per_sec': rounds / sample_time,
+        'updates_per_sec': rounds / update_time,
+    }
+
+
+def load_baseline(baseline_dir, episodes, harness=None):
+    """读取 --update 生成的基线和它的 harness.json；harness 为本次运行的 {seed, obstacle_ratio}，与基线不一致时报错"""
+    harness_path = os.path.join(baseline_dir, HARNESS_FILE)
+    if not os.path.exists(harness_path):
+        raise ValueError(f'{baseline_dir} 中没有 {HARNESS_FILE}：基线必须由 regression.py --update 生成')
+    with open(harness_path, encoding='utf-8') as f:
+        recorded = json.load(f)
+    for name, value in (harness or {}).items():
+        if recorded.get(name) != value:
+            raise ValueError(f'基线的 {name} 为 {recorded.get(name)}，本次运行为 {value}')
+    if episodes > recorded['episodes']:
+        raise ValueError(f"基线只有 {recorded['episodes']} 轮，无法比较 {episodes} 轮")
+    return recorded, read_baseline_csv(baseline_dir, episodes)
+
+
+def read_baseline_csv(baseline_dir, episodes):
+    import pandas as pd
+    steps = pd.read_csv(os.path.join(baseline_dir, 'training_steps.csv'))
+    times = pd.read_csv(os.path.join(baseline_dir, 'training_times.csv'))
+    baseline = {}
+    for algorithm, steps_column, times_column in zip(ALGORITHMS, STEPS_COLUMNS, TIMES_COLUMNS):
+        alg_steps = steps[steps_column].dropna().astype(int).tolist()[:episodes]
+        alg_times = times[times_column].dropna().tolist()[:episodes]
+        baseline[algorithm] = summarize(alg_steps, alg_times)
+    return baseline
+
+
+def save_baseline(baseline_dir, runs, harness):
+    import pandas as pd
+    os.makedirs(baseline_dir, exist_ok=True)
+    with open(os.path.join(baseline_dir, HARNESS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(harness, f, ensure_ascii=False, indent=2)
+    num_rows = max(len(runs[a][0]) for a in ALGORITHMS)
+    steps_data = {'Episode': range(num_rows)}
+    times_data = {'Episode': range(num_rows)}
+    for algorithm, steps_column, times_column in zip(ALGORITHMS, STEPS_COLUMNS, TIMES_COLUMNS):
+        steps_data[steps_column] = pd.Series(runs[algorithm][0])
+        times_data[times_column] = pd.Series(runs[algorithm][1])
+    pd.DataFrame(steps_data).to_csv(os.path.join(baseline_dir, 'training_steps.csv'), index=False)
+    pd.DataFrame(times_data).to_csv(os.path.join(baseline_dir, 'training_times.csv'), index=False)
+
+
+def format_value(value):
+    if value is None:
+        return '-'
+    return f'{value:.2f}' if isinstance(value, float) else str(value)
+
+
+def compare(current, baseline, tolerances=TOLERANCES):
+    """返回不满足容差的指标列表"""
+    failures = []
+    if current['wall_time'] > baseline['wall_time'] * (1 + tolerances['wall_time']):
+        failures.append('wall_time')
+    if current['steps_per_sec'] < baseline['steps_per_sec'] * (1 - tolerances['steps_per_sec']):
+        failures.append('steps_per_sec')
+    cur_first, base_first = current['episodes_to_first_success'], baseline['episodes_to_first_success']
+    if (cur_first is None) != (base_first is None) or (
+            cur_first is not None and abs(cur_first - base_first) > tolerances['episodes_to_first_success']):
+        failures.append('episodes_to_first_success')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='固定种子的性能/训练效果回归测试')
+    parser.add_argument('--episodes', type=int, default=30, help='每个算法运行的轮数')
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--obstacle-ratio', type=float, default=0.2)
+    parser.add_argument('--algorithms', nargs='+', default=ALGORITHMS, choices=ALGORITHMS)
+    parser.add_argument('--baseline-dir', default=BASELINE_DIR)
+    parser.add_argument('--update', metavar='DIR', help='把本次结果保存为基线到DIR')
+    parser.add_argument('--replay-engine', nargs='+', default=['standard'], choices=['standard', 'dedup', 'rank'],
+                        help='经验池实现（main.REPLAY_ENGINE），回归比较只使用第一个')
+    parser.add_argument('--replay-benchmark', type=int, metavar='CAPACITY',
+                        help='不训练，只测量该容量下各经验池实现的写入/采样/更新吞吐量')
+    args = parser.parse_args()
+
+    if args.replay_benchmark:
+        if 'dedup' in args.replay_engine:
+            parser.error('--replay-benchmark 只比较 standard 和 rank（去重经验池需要真实的状态张量）')
+        for engine in args.replay_engine:
+            result = replay_throughput(engine, args.replay_benchmark)
+            print('  '.join(f"{key} {format_value(value)}" for key, value in result.items()))
+        return 0
+
+    # 先检查基线，避免跑完训练才发现无法比较
+    harness = {'seed': args.seed, 'obstacle_ratio': args.obstacle_ratio}
+    if not args.update:
+        try:
+            recorded, baseline = load_baseline(args.baseline_dir, args.episodes, harness)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        if recorded['replay_engine'] != args.replay_engine[0]:
+            print(f"经验池实现: 基线 {recorded['replay_engine']}，本次 {args.replay_engine[0]}")
+
+    runs = {}
+    for algorithm in args.algorithms:
+        start_time = time.time()
+        runs[algorithm] = run_profile(algorithm, args.episodes, args.seed, args.obstacle_ratio,
+                                      args.replay_engine[0])
+        print(f"{algorithm}: {args.episodes} episodes in {time.time() - start_time:.1f}s")
+
+    if args.update:
+        if set(args.algorithms) != set(ALGORITHMS):
+            parser.error('--update 需要运行全部三个算法')
+        save_baseline(args.update, runs, dict(harness, replay_engine=args.replay_engine[0], episodes=args.episodes))
+        print(f"基线已保存到 {args.update}")
+        return 0
+
+    failed = False
+    print(f"{'alg':<4}{'metric':<28}{'baseline':>12}{'current':>12}  status")
+    for algorithm in args.algorithms:
+        current = summarize(*runs[algorithm])
+        failures = compare(current, baseline[algorithm])
+        failed = failed or bool(failures)
+        for metric in TOLERANCES:
+            status = 'FAIL' if metric in failures else 'ok'
+            print(f"{algorithm:<4}{metric:<28}{format_value(baseline[algorithm][metric]):>12}"
+                  f"{format_value(current[metric]):>12}  {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
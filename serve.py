@@ -0,0 +1,294 @@
+"""基于asyncio的本地路径规划服务：把并发请求的 (地图, 起点, 终点) 排队，
+所有进行中的推演每一步合并成一次批量前向，新请求在 window_ms 的时间窗口内凑批，
+每条路径完成后立即返回，并统计每个请求的延迟和批大小。
+
+用法:
+    python serve.py goal_dqn_model.pth --port 8765                        # JSON行协议的TCP服务
+    python serve.py goal_dqn_model.pth --benchmark goal_dqn_map.npy --clients 64 --requests 512
+
+TCP协议：每行一个JSON请求 {"map": [[0, 1, ...], ...], "start": [r, c], "goal": [r, c]}，
+map 也可以换成 "map_file": "地图文件路径"，服务按行返回与 plan.py 相同格式的结果以及 latency。
+普通（单通道）模型只适用于训练时的终点，目标条件模型（python main.py goal）可服务任意终点。
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+
+class Rollout:
+    """一个进行中的规划请求"""
+    def __init__(self, map_entry, start, goal, future):
+        self.map_entry = map_entry
+        self.pos = tuple(start)
+        self.goal = tuple(goal)
+        self.path = [self.pos]
+        self.future = future
+        self.submitted = time.perf_counter()
+        self.first_step = None
+        self.batch_sizes = []
+
+
+class PlanningService:
+    """把并发请求的推演合并成批量前向的规划服务：
+    max_batch 为一次前向的最大状态数，window_ms 为空闲时等待更多请求凑批的时间窗口，
+    max_steps 为每条路径的最大步数（同 greedy_rollout）"""
+    def __init__(self, policy_net, max_batch=256, window_ms=2.0, max_steps=100, map_cache_size=64):
+        self.policy_net = policy_net
+        self.in_channels = policy_net.conv1.in_channels
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self.max_steps = max_steps
+        self.map_cache_size = map_cache_size
+        self.maps = OrderedDict()  # 地图字节 -> (地图数组, 地图张量, 有效动作)
+        self.queue = None
+        self.active = []
+        self.task = None
+        self.latencies = []
+        self.forward_batch_sizes = []
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def plan(self, map_array, start, goal):
+        """提交一个规划请求，路径完成后返回结果字典"""
+        import numpy as np
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(Rollout(self._map_entry(np.asarray(map_array, dtype=np.float32)), start, goal, future))
+        return await future
+
+    def _map_entry(self, map_array):
+        """相同地图只转换一次张量并计算一次有效动作（LRU缓存）"""
+        import torch
+        from main import device, valid_action_mask
+        key = (map_array.shape, map_array.tobytes())
+        entry = self.maps.get(key)
+        if entry is None:
+            entry = (map_array, torch.as_tensor(map_array, device=device),
+                     torch.as_tensor(valid_action_mask(map_array), device=device))
+            self.maps[key] = entry
+            if len(self.maps) > self.map_cache_size:
+                self.maps.popitem(last=False)
+        else:
+            self.maps.move_to_end(key)
+        return entry
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self.active:
+                # 空闲时阻塞等待第一个请求，然后在时间窗口内继续收集
+                self.active.append(await self.queue.get())
+                deadline = loop.time() + self.window
+                while len(self.active) < self.max_batch:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        self.active.append(await asyncio.wait_for(self.queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+            # 有推演进行时，新请求直接加入下一步
+            while not self.queue.empty():
+                self.active.append(self.queue.get_nowait())
+            for i in range(0, len(self.active), self.max_batch):
+                await self._step(self.active[i:i + self.max_batch], loop)
+            self.active = [r for r in self.active if not r.future.done()]
+
+    async def _step(self, rollouts, loop):
+        """同一尺寸地图的推演合并为一次前向，各走一步"""
+        groups = {}
+        for rollout in rollouts:
+            if rollout.pos == rollout.goal:
+                self._finish(rollout)
+            else:
+                groups.setdefault(rollout.map_entry[0].shape, []).append(rollout)
+        for group in groups.values():
+            try:
+                states, mask = self._build_batch(group)
+                actions = await loop.run_in_executor(None, self._forward, states, mask)
+            except Exception as e:  # 例如地图尺寸与网络不匹配：只让这一组请求失败，服务继续运行
+                for rollout in group:
+                    if not rollout.future.done():
+                        rollout.future.set_exception(e)
+                continue
+            now = time.perf_counter()
+            self.forward_batch_sizes.append(len(group))
+            for rollout, action in zip(group, actions):
+                self._move(rollout, int(action))
+                if rollout.first_step is None:
+                    rollout.first_step = now
+                rollout.batch_sizes.append(len(group))
+                if rollout.pos == rollout.goal or len(rollout.path) > self.max_steps:
+                    self._finish(rollout)
+
+    def _build_batch(self, group):
+        import torch
+        from main import device, USE_ACTION_MASK
+        positions = torch.tensor([r.pos for r in group], device=device)
+        batch = torch.arange(len(group), device=device)
+        grids = torch.stack([r.map_entry[1] for r in group])
+        grids[batch, positions[:, 0], positions[:, 1]] = 2
+        if self.in_channels == 2:
+            goals = torch.tensor([r.goal for r in group], device=device)
+            goal_channel = torch.zeros_like(grids)
+            goal_channel[batch, goals[:, 0], goals[:, 1]] = 1
+            states = torch.stack((grids, goal_channel), dim=1)
+        else:
+            states = grids.unsqueeze(1)
+        mask = None
+        if USE_ACTION_MASK:
+            mask = torch.stack([r.map_entry[2][r.pos] for r in group])
+            mask[~mask.any(1)] = True
+        return states, mask
+
+    def _forward(self, states, mask):
+        import torch
+        with torch.no_grad():
+            q_values = self.policy_net(states)
+        if mask is not None:
+            from main import tile_action_mask
+            q_values = q_values.masked_fill(~tile_action_mask(mask, q_values.shape[1]), float('-inf'))
+        return q_values.argmax(1).tolist()
+
+    def _move(self, rollout, action):
+        """与 greedy_rollout 相同：撞墙/障碍时原地不动，宏动作逐格前进，前方受阻时停在障碍前，到达终点即停"""
+        from main import ACTIONS
+        map_array = rollout.map_entry[0]
+        rows, cols = map_array.shape
+        dr, dc = ACTIONS[action % len(ACTIONS)]
+        for k in range(action // len(ACTIONS) + 1):
+            nr, nc = rollout.pos[0] + dr, rollout.pos[1] + dc
+            if not (0 <= nr < rows and 0 <= nc < cols and map_array[nr, nc] == 0):
+                if k == 0:
+                    rollout.path.append(rollout.pos)
+                break
+            rollout.pos = (nr, nc)
+            rollout.path.append(rollout.pos)
+            if rollout.pos == rollout.goal:
+                break
+
+    def _finish(self, rollout):
+        from main import count_turns
+        if rollout.future.done():
+            return
+        now = time.perf_counter()
+        latency = now - rollout.submitted
+        self.latencies.append(latency)
+        rollout.future.set_result({
+            'path': [tuple(int(v) for v in p) for p in rollout.path],
+            'length': len(rollout.path),
+            'turns': count_turns(rollout.path),
+            'reached': rollout.pos == rollout.goal,
+            'latency': latency,
+            'queue_wait': (rollout.first_step or now) - rollout.submitted,
+            'mean_batch_size': sum(rollout.batch_sizes) / len(rollout.batch_sizes) if rollout.batch_sizes else 0.0,
+        })
+
+    def stats(self):
+        """已完成请求的延迟分位数和每次前向的批大小"""
+        import numpy as np
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {
+            'completed': len(self.latencies),
+            'in_flight': len(self.active),
+            'latency_mean': float(latencies.mean()),
+            'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p95': float(np.percentile(latencies, 95)),
+            'forwards': len(self.forward_batch_sizes),
+            'mean_batch_size': float(np.mean(self.forward_batch_sizes)) if self.forward_batch_sizes else 0.0,
+        }
+
+
+async def handle_client(service, reader, writer):
+    """JSON行协议：每行一个请求，按完成顺序返回结果（附带请求中的 id 字段）"""
+    from plan import load_map
+    pending = set()
+
+    async def answer(request):
+        try:
+            map_array = load_map(request['map_file']) if 'map_file' in request else request['map']
+            result = await service.plan(map_array, request['start'], request['goal'])
+        except Exception as e:  # 单个请求出错不影响同一连接上的其它请求
+            result = {'error': str(e)}
+        if 'id' in request:
+            result['id'] = request['id']
+        writer.write((json.dumps(result, ensure_ascii=False) + '\n').encode())
+        await writer.drain()
+
+    while line := await reader.readline():
+        task = asyncio.create_task(answer(json.loads(line)))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.wait(pending)
+    writer.close()
+
+
+async def serve(service, host, port):
+    await service.start()
+    server = await asyncio.start_server(lambda r, w: handle_client(service, r, w), host, port)
+    print(f"规划服务已启动: {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+async def benchmark(service, map_array, num_clients, num_requests, seed=0):
+    """num_clients 个并发客户端共发出 num_requests 个请求，返回吞吐量和服务统计"""
+    import numpy as np
+    from main import sample_start_goal
+    np.random.seed(seed)
+    if service.in_channels == 2:
+        pairs = [sample_start_goal(map_array) for _ in range(num_requests)]
+    else:
+        size = map_array.shape[0]
+        pairs = [((size - 1, 0), (0, size - 1))] * num_requests
+    await service.start()
+    next_request = iter(range(num_requests))
+
+    async def client():
+        for i in next_request:
+            await service.plan(map_array, *pairs[i])
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(num_clients)))
+    elapsed = time.perf_counter() - start_time
+    await service.stop()
+    stats = service.stats()
+    stats['requests_per_sec'] = num_requests / elapsed
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量合并推演的本地路径规划服务')
+    parser.add_argument('model', help='.pth 模型文件')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--window-ms', type=float, default=2.0, help='空闲时凑批的等待时间窗口')
+    parser.add_argument('--max-steps', type=int, default=100)
+    parser.add_argument('--benchmark', metavar='MAP', help='不启动服务，在该地图上做并发压测')
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=512)
+    args = parser.parse_args()
+
+    from plan import load_map, load_policy
+    service = PlanningService(load_policy(args.model), args.max_batch, args.window_ms, args.max_steps)
+    if args.benchmark:
+        stats = asyncio.run(benchmark(service, load_map(args.benchmark), args.clients, args.requests))
+        print(json.dumps(stats, ensure_ascii=False))
+    else:
+        asyncio.run(serve(service, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
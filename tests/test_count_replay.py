@@ -0,0 +1,91 @@
+"""去重计数经验池的计数、淘汰、IS权重和删除与暴力计算对比"""
+from collections import Counter, OrderedDict
+
+import numpy as np
+import pytest
+import torch
+
+from main import CountReplayMemory
+
+
+def make_state(cell, size=4):
+    state = torch.zeros(1, 1, size, size)
+    state[0, 0, cell // size, cell % size] = 2
+    return state
+
+
+def push_cell(memory, cell, action, map_id=0):
+    memory.push(make_state(cell), action, -1.0, make_state((cell + 1) % 16), False, 0.9, map_id)
+
+
+def random_cells(rng, count):
+    """格子和动作取值很少，会产生大量重复转移"""
+    return [(int(rng.integers(16)), int(rng.integers(4))) for _ in range(count)]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_count_memory_deduplicates(seed):
+    rng = np.random.default_rng(seed)
+    memory = CountReplayMemory(100)
+    cells = random_cells(rng, 300)
+    for cell, action in cells:
+        push_cell(memory, cell, action)
+    counts = Counter(cells)
+    assert len(memory) == len(counts)
+    stored = Counter({(int(t[0].argmax()), t[1]): memory.counts[slot]
+                      for slot, t in zip(memory.stored_slots(), memory.stored_transitions())})
+    assert stored == counts
+    assert memory.tree.tree[0] == pytest.approx(sum(counts.values()))
+
+
+def test_count_memory_evicts_oldest_distinct_transition():
+    rng = np.random.default_rng(0)
+    capacity = 10
+    memory = CountReplayMemory(capacity)
+    reference = OrderedDict()  # 不同转移按第一次加入的顺序 -> 出现次数
+    for cell, action in random_cells(rng, 200):
+        push_cell(memory, cell, action)
+        key = (cell, action)
+        if key in reference:
+            reference[key] += 1
+        else:
+            if len(reference) == capacity:
+                reference.popitem(last=False)
+            reference[key] = 1
+    stored = {(int(t[0].argmax()), t[1]): memory.counts[slot]
+              for slot, t in zip(memory.stored_slots(), memory.stored_transitions())}
+    assert stored == dict(reference)
+
+
+@pytest.mark.parametrize('exponent', [0.0, 0.5, 1.0])
+def test_count_memory_weights_correct_to_experience_distribution(exponent):
+    """采样概率正比于 count**exponent，IS权重与 (采样概率 / 经验分布)**-1 成正比"""
+    rng = np.random.default_rng(1)
+    memory = CountReplayMemory(64, count_exponent=exponent)
+    for cell, action in random_cells(rng, 400):
+        push_cell(memory, cell, action)
+    slots, weights = memory.draw(rng.random(256))
+    counts = memory.counts[:memory.tree.size]
+    probs = counts[slots] ** exponent / (counts ** exponent).sum()
+    empirical = counts[slots] / counts.sum()
+    expected = (probs / empirical) ** -1
+    np.testing.assert_allclose(weights, expected / expected.max(), rtol=1e-5)
+
+
+def test_count_memory_filter():
+    rng = np.random.default_rng(2)
+    memory = CountReplayMemory(100)
+    for cell, action in random_cells(rng, 200):
+        push_cell(memory, cell, action, map_id=cell % 3)
+    keep = memory.stored_map_ids() != 1
+    kept = len(memory) - int((~keep).sum())
+    memory.filter(keep)
+    assert len(memory) == kept
+    assert (memory.stored_map_ids() != 1).all()
+    slots, _ = memory.draw(rng.random(500))
+    assert (memory.map_ids[slots] != 1).all()
+    # 删除的转移再次出现时重新计数
+    push_cell(memory, 1, 0, map_id=1)
+    assert len(memory) == kept + 1
+    key = memory.transition_key(make_state(1), 0, -1.0, make_state(2), False, 0.9, 1)
+    assert memory.counts[memory.index[key]] == 1
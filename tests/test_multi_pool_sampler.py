@@ -0,0 +1,72 @@
+"""MultiPoolSampler 的子批次分配和抽样与逐池暴力计算对比"""
+import numpy as np
+import pytest
+
+from main import MultiPoolSampler, ReplayMemory
+
+
+def make_pool(pool_id, size):
+    """经验为 (池编号, 下标) 的普通经验池"""
+    pool = ReplayMemory(max(size, 1))
+    for i in range(size):
+        pool.push((pool_id, i), 0, 0.0, None, False)
+    return pool
+
+
+def reference_allocation(sizes, ratios, batch_size):
+    """按比例取整、余数归最后一个池，样本不足的部分由其余池按顺序逐个补足"""
+    ratios = np.asarray(ratios, dtype=np.float64)
+    ratios = ratios / ratios.sum() if ratios.sum() > 0 else np.full(len(sizes), 1.0 / len(sizes))
+    targets = [int(np.floor(batch_size * r)) for r in ratios[:-1]]
+    targets.append(batch_size - sum(targets))
+    counts = [min(t, s) for t, s in zip(targets, sizes)]
+    shortfall = batch_size - sum(counts)
+    for k in range(len(sizes)):
+        extra = min(sizes[k] - counts[k], shortfall)
+        counts[k] += extra
+        shortfall -= extra
+    return counts
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_allocate_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    num_pools = int(rng.integers(1, 5))
+    sizes = [int(s) for s in rng.integers(0, 80, num_pools)]
+    ratios = rng.random(num_pools) * (rng.random(num_pools) > 0.2)
+    batch_size = int(rng.integers(1, 128))
+    sampler = MultiPoolSampler([make_pool(k, s) for k, s in enumerate(sizes)], ratios)
+    counts = sampler.allocate(batch_size)
+    assert list(counts) == reference_allocation(sizes, ratios, batch_size)
+    assert counts.sum() == min(batch_size, sum(sizes))
+    assert (counts <= sizes).all()
+
+
+def test_short_pool_is_filled_by_the_others():
+    """一个池样本不足时，总数仍等于批大小"""
+    sampler = MultiPoolSampler([make_pool(0, 3), make_pool(1, 100)], ratios=(0.6, 0.4))
+    counts = sampler.allocate(32)
+    assert list(counts) == [3, 29]
+    sampler = MultiPoolSampler([make_pool(0, 100), make_pool(1, 5), make_pool(2, 100)], ratios=(0.2, 0.5, 0.3))
+    counts = sampler.allocate(40)
+    assert counts.sum() == 40 and counts[1] == 5
+
+
+def test_sample_draws_from_the_allocated_pools():
+    sizes = (4, 50, 20)
+    sampler = MultiPoolSampler([make_pool(k, s) for k, s in enumerate(sizes)], ratios=(0.5, 0.2, 0.3))
+    batch, (pool_ids, pool_indices), weights = sampler.sample(32)
+    counts = sampler.allocate(32)
+    assert len(batch) == len(pool_ids) == len(weights) == 32
+    np.testing.assert_array_equal(np.bincount(pool_ids, minlength=3), counts)
+    for transition, pool_id, index in zip(batch, pool_ids, pool_indices):
+        assert transition[0] == (pool_id, index)
+        assert 0 <= index < sizes[pool_id]
+
+
+def test_mean_losses_per_pool():
+    sampler = MultiPoolSampler([make_pool(0, 10), make_pool(1, 10)])
+    sampler.update_priorities((np.array([0, 1, 1, 0]), np.array([0, 1, 2, 3])), [1.0, 2.0, 4.0, 3.0])
+    np.testing.assert_allclose(sampler.mean_losses(), [2.0, 3.0])
+    sampler.reset_losses()
+    np.testing.assert_allclose(sampler.mean_losses(), [0.0, 0.0])
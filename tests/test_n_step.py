@@ -0,0 +1,71 @@
+"""NStepTransitionBuilder 与逐条暴力计算的n步回报、折扣对比"""
+import random
+
+import pytest
+
+from main import NStepTransitionBuilder
+
+
+def reference(rewards, durations, n_steps, gamma, done):
+    """第t条转移累计 t..t+m-1 的奖励（m = min(n, T-t)），终止时不自举，否则折扣为 gamma^累计时间步"""
+    transitions = []
+    for t in range(len(rewards)):
+        end = min(t + n_steps, len(rewards))
+        n_reward, elapsed = 0.0, 0
+        for j in range(t, end):
+            n_reward += gamma ** elapsed * rewards[j]
+            elapsed += durations[j]
+        if done and end == len(rewards):
+            transitions.append((t, n_reward, None, True, 0.0))
+        else:
+            transitions.append((t, n_reward, end, False, gamma ** elapsed))
+    return transitions
+
+
+def run_builder(rewards, durations, n_steps, gamma, done):
+    """状态用时间步编号表示，最后一步以 done 或 truncated 结束回合"""
+    builder = NStepTransitionBuilder(n_steps=n_steps, gamma=gamma)
+    transitions = []
+    for t, (reward, duration) in enumerate(zip(rewards, durations)):
+        last = t == len(rewards) - 1
+        transitions.extend(builder.append(t, t, reward, t + 1, last and done, truncated=last and not done,
+                                          duration=duration))
+    return transitions
+
+
+@pytest.mark.parametrize('gamma', [0.0, 0.5, 0.99])
+@pytest.mark.parametrize('n_steps', [1, 3, 5])
+@pytest.mark.parametrize('length', [1, 2, 4, 37])
+@pytest.mark.parametrize('done', [True, False])
+@pytest.mark.parametrize('macro', [False, True])
+def test_matches_reference(gamma, n_steps, length, done, macro):
+    rng = random.Random(length * 31 + n_steps)
+    rewards = [rng.uniform(-2, 2) for _ in range(length)]
+    durations = [rng.randint(1, 3) if macro else 1 for _ in range(length)]
+    transitions = run_builder(rewards, durations, n_steps, gamma, done)
+    expected = reference(rewards, durations, n_steps, gamma, done)
+    assert len(transitions) == len(expected)
+    for (state, action, n_reward, next_state, is_done, discount, _), (t, ref_reward, ref_next, ref_done,
+                                                                       ref_discount) in zip(transitions, expected):
+        assert state == action == t
+        assert n_reward == pytest.approx(ref_reward, abs=1e-9)
+        assert next_state == ref_next
+        assert is_done == ref_done
+        assert discount == pytest.approx(ref_discount, abs=1e-12)
+
+
+def test_terminal_before_n_steps():
+    """第k步（k<n）终止：所有转移都不自举，第一条累计k步的奖励"""
+    gamma, k = 0.9, 2
+    transitions = run_builder([1.0] * k, [1] * k, 5, gamma, done=True)
+    assert [t[4] for t in transitions] == [True, True]
+    assert [t[5] for t in transitions] == [0.0, 0.0]
+    assert transitions[0][2] == pytest.approx(1.0 + gamma)
+
+
+def test_truncation_before_n_steps():
+    """第k步（k<n）超时截断：以最后的next_state自举，折扣为 gamma^k"""
+    gamma, k = 0.9, 3
+    transitions = run_builder([1.0] * k, [1] * k, 5, gamma, done=False)
+    assert [t[3] for t in transitions] == [k, k, k]
+    assert [t[5] for t in transitions] == pytest.approx([gamma ** 3, gamma ** 2, gamma])
@@ -0,0 +1,100 @@
+"""ObstacleTransitionStore 的先进先出淘汰、近障碍物子集和压缩与列表实现的参考模型对比"""
+import numpy as np
+import pytest
+import torch
+
+from main import ObstacleTransitionStore
+
+
+def make_state(transition_id):
+    """状态的第一个格子记录经验编号，便于从列式存储中取回后核对"""
+    state = torch.zeros(1, 1, 3, 3)
+    state[0, 0, 0, 0] = transition_id % 200
+    return state
+
+
+class ReferenceStore:
+    """用列表实现的参考模型：全部经验和近障碍物子集都按写入顺序保存经验编号"""
+    def __init__(self, capacity, near_capacity):
+        self.capacity = capacity
+        self.near_capacity = near_capacity
+        self.all = []
+        self.near = []
+
+    def push(self, transition_id, near):
+        if len(self.all) == self.capacity:
+            evicted = self.all.pop(0)
+            if evicted in self.near:
+                self.near.remove(evicted)
+        self.all.append(transition_id)
+        if near:
+            self.near.append(transition_id)
+            if len(self.near) > self.near_capacity:
+                self.near.pop(0)
+
+
+def stored_ids(store, slots):
+    return [int(r) for r in store.columns['reward'][torch.as_tensor(slots, dtype=torch.int64)].tolist()]
+
+
+def check(store, reference):
+    assert stored_ids(store, store.temporal_order()) == reference.all
+    assert stored_ids(store, store.near_order()) == reference.near
+    assert len(store.all_view) == len(reference.all)
+    assert len(store.near_view) == len(reference.near)
+    assert list(store.all_view.stored_map_ids()) == [i % 7 for i in reference.all]
+    # is_near 与近障碍物下标表一致
+    assert sorted(np.flatnonzero(store.is_near)) == sorted(store.near_order())
+    states = store.gather(store.temporal_order()).tensors[0]
+    assert [int(v) for v in states[:, 0, 0, 0]] == [i % 200 for i in reference.all]
+
+
+def push_random(store, reference, rng, start, count):
+    for transition_id in range(start, start + count):
+        near = bool(rng.random() < 0.4)
+        store.push(make_state(transition_id), transition_id % 4, float(transition_id), make_state(transition_id + 1),
+                   False, 0.9, transition_id % 7, near)
+        reference.push(transition_id, near)
+    return start + count
+
+
+@pytest.mark.parametrize('capacity,near_capacity', [(10, 3), (16, 16), (25, 7)])
+@pytest.mark.parametrize('seed', range(3))
+def test_fifo_eviction(capacity, near_capacity, seed):
+    rng = np.random.default_rng(seed)
+    store, reference = ObstacleTransitionStore(capacity, near_capacity), ReferenceStore(capacity, near_capacity)
+    next_id = 0
+    for _ in range(10):
+        next_id = push_random(store, reference, rng, next_id, int(rng.integers(1, capacity)))
+        check(store, reference)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_compaction_and_drop_near(seed):
+    rng = np.random.default_rng(seed)
+    store, reference = ObstacleTransitionStore(20, 6), ReferenceStore(20, 6)
+    next_id = push_random(store, reference, rng, 0, 37)
+    for _ in range(4):
+        # 从全部经验中删除：存储压缩到开头，近障碍物子集随之删除
+        keep = rng.random(len(reference.all)) < 0.7
+        store.all_view.filter(keep)
+        reference.all = [i for i, k in zip(reference.all, keep) if k]
+        reference.near = [i for i in reference.near if i in reference.all]
+        check(store, reference)
+        # 只移出近障碍物子集，经验仍保留在全部经验中
+        keep = rng.random(len(reference.near)) < 0.5
+        store.near_view.filter(keep)
+        reference.near = [i for i, k in zip(reference.near, keep) if k]
+        check(store, reference)
+        next_id = push_random(store, reference, rng, next_id, int(rng.integers(1, 30)))
+        check(store, reference)
+
+
+def test_views_draw_only_stored_slots():
+    rng = np.random.default_rng(0)
+    store, reference = ObstacleTransitionStore(30, 8), ReferenceStore(30, 8)
+    push_random(store, reference, rng, 0, 45)
+    for view, expected in ((store.all_view, reference.all), (store.near_view, reference.near)):
+        slots, weights = view.draw(rng.random(200))
+        assert set(stored_ids(store, slots)) <= set(expected)
+        assert (weights == 1).all()
@@ -0,0 +1,71 @@
+"""批量路径分析与逐条计算的参考实现（原 count_turns 和 splrep/splev 平滑）对比"""
+import numpy as np
+import pytest
+from scipy import interpolate
+
+from path_analytics import analyze_paths, path_lengths, smooth_paths, turn_counts
+
+
+def reference_turns(path):
+    turns = 0
+    for i in range(2, len(path)):
+        if (path[i - 1][0] - path[i - 2][0], path[i - 1][1] - path[i - 2][1]) != \
+                (path[i][0] - path[i - 1][0], path[i][1] - path[i - 1][1]):
+            turns += 1
+    return turns
+
+
+def reference_smooth(path, k=3, num_points=100):
+    if len(path) < 4:
+        return np.asarray(path, dtype=np.float64)
+    t = np.linspace(0, 1, len(path))
+    t_new = np.linspace(0, 1, num_points)
+    rows = interpolate.splev(t_new, interpolate.splrep(t, [p[0] for p in path], k=min(k, len(path) - 1)))
+    cols = interpolate.splev(t_new, interpolate.splrep(t, [p[1] for p in path], k=min(k, len(path) - 1)))
+    return np.stack((rows, cols), axis=1)
+
+
+def random_paths(seed, count=40):
+    """栅格上的随机游走，含原地不动的步和长度为1~3的短路径"""
+    rng = np.random.default_rng(seed)
+    moves = [(-1, 0), (1, 0), (0, -1), (0, 1), (0, 0)]
+    paths = []
+    for _ in range(count):
+        path = [tuple(int(v) for v in rng.integers(0, 20, 2))]
+        for _ in range(int(rng.integers(0, 30))):
+            dr, dc = moves[int(rng.integers(len(moves)))]
+            path.append((path[-1][0] + dr, path[-1][1] + dc))
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_turn_counts(seed):
+    paths = random_paths(seed)
+    assert list(turn_counts(paths)) == [reference_turns(p) for p in paths]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_path_lengths(seed):
+    paths = random_paths(seed)
+    expected = [sum(np.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(p[:-1], p[1:])) for p in paths]
+    np.testing.assert_allclose(path_lengths(paths), expected)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('k', [2, 3])
+def test_smooth_paths_match_splrep(seed, k):
+    paths = random_paths(seed)
+    for path, curve in zip(paths, smooth_paths(paths, k=k, num_points=50)):
+        np.testing.assert_allclose(curve, reference_smooth(path, k=k, num_points=50), atol=1e-8)
+
+
+def test_analyze_paths_collisions_and_goals():
+    map_array = np.zeros((5, 5))
+    map_array[2, 1:4] = 1
+    paths = [[(0, 0), (0, 1), (0, 2), (0, 3), (0, 4)], [(1, 0), (2, 0), (3, 0), (4, 0), (4, 1)]]
+    result = analyze_paths(paths, map_array, goals=[(0, 4), (4, 4)], num_points=20)
+    assert list(result['turns']) == [0, 1]
+    assert list(result['reached']) == [True, False]
+    expected = [sum(map_array[int(round(r)), int(round(c))] == 1 for r, c in curve) for curve in result['smoothed']]
+    assert list(result['collisions']) == expected
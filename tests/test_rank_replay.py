@@ -0,0 +1,45 @@
+"""按排名的优先级经验池的分段边界、排序和删除与暴力计算对比"""
+import numpy as np
+import pytest
+
+from main import RankPrioritizedReplayMemory
+
+
+@pytest.mark.parametrize('num_ranks,batch_size', [(1, 1), (5, 32), (32, 32), (100, 7), (1000, 64), (50000, 256)])
+@pytest.mark.parametrize('alpha', [0.0, 0.7, 1.5])
+def test_rank_segments(num_ranks, batch_size, alpha):
+    memory = RankPrioritizedReplayMemory(10, alpha=alpha)
+    starts, widths, scaled_probs = memory.segments(num_ranks, batch_size)
+    assert len(starts) == len(widths) == batch_size
+    assert starts[0] == 0 and (np.diff(starts) >= 0).all()
+    assert (widths >= 1).all() and (starts + widths <= num_ranks).all()
+    # 各段连起来恰好覆盖所有排名
+    covered = np.zeros(num_ranks, dtype=bool)
+    for start, width in zip(starts, widths):
+        covered[start:start + width] = True
+    assert covered.all()
+    # 每段的概率质量与 1/batch_size 的差不超过单个排名的最大概率
+    probs = np.arange(1, num_ranks + 1, dtype=np.float64) ** -alpha
+    probs /= probs.sum()
+    ends = np.append(starts[1:], num_ranks)
+    for start, end in zip(starts, ends):
+        assert abs(probs[start:end].sum() - 1 / batch_size) <= probs[0] + 1e-12
+    np.testing.assert_allclose(scaled_probs, num_ranks / (batch_size * widths))
+
+
+def test_rank_memory_orders_by_priority_and_filters():
+    rng = np.random.default_rng(0)
+    memory = RankPrioritizedReplayMemory(50, sort_interval=1)
+    for i in range(80):
+        memory.push(i, 0, 0.0, None, True, map_id=i % 5)
+    slots = memory.stored_slots()
+    priorities = rng.random(len(slots))
+    memory.update_priorities(slots, priorities)
+    memory.draw(rng.random(8))
+    np.testing.assert_array_equal(memory.order, slots[np.argsort(-priorities, kind='stable')])
+    keep = memory.stored_map_ids() != 0
+    memory.filter(keep)
+    assert len(memory) == keep.sum() == len(memory.order)
+    drawn, weights = memory.draw(rng.random(500))
+    assert (memory.map_ids[drawn] != 0).all()
+    assert weights.max() == pytest.approx(1.0)
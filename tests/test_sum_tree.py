@@ -0,0 +1,66 @@
+"""SumTree 的求和树、最小值树和批量检索与暴力计算对比"""
+import numpy as np
+import pytest
+
+from main import SumTree
+
+
+def leaves_in_order(tree, idx=0):
+    """按树的中序（即前缀和的累加顺序）列出叶子节点下标"""
+    left = 2 * idx + 1
+    if left >= len(tree.tree):
+        return [idx]
+    return leaves_in_order(tree, left) + leaves_in_order(tree, left + 1)
+
+
+def random_tree(capacity, operations, seed):
+    """随机写入和更新优先级（含0），返回树和各数据槽位的优先级"""
+    rng = np.random.default_rng(seed)
+    tree = SumTree(capacity)
+    priorities = np.zeros(capacity)
+    for _ in range(operations):
+        if tree.size and rng.random() < 0.4:
+            slot = int(rng.integers(tree.size))
+            priority = 0.0 if rng.random() < 0.2 else float(rng.exponential())
+            tree.update(slot + capacity - 1, priority)
+        else:
+            slot = tree.data_pointer
+            priority = float(rng.exponential())
+            tree.add(priority, slot)
+        priorities[slot] = priority
+    return tree, priorities
+
+
+@pytest.mark.parametrize('capacity', [2, 7, 16, 100])
+@pytest.mark.parametrize('seed', range(3))
+def test_sum_and_min_match_leaves(capacity, seed):
+    tree, priorities = random_tree(capacity, 5 * capacity + 3, seed)
+    leaves = tree.tree[capacity - 1:]
+    np.testing.assert_allclose(leaves, priorities)
+    internal = np.arange(capacity - 1)
+    # 增量传播会累积浮点舍入误差
+    np.testing.assert_allclose(tree.tree[internal], tree.tree[2 * internal + 1] + tree.tree[2 * internal + 2],
+                               atol=1e-9)
+    assert tree.tree[0] == pytest.approx(priorities.sum())
+    positive = priorities[priorities > 0]
+    # 每个内部节点的最小值树取值等于其子树中最小的非零优先级
+    for idx in internal:
+        subtree = [leaf - capacity + 1 for leaf in leaves_in_order(tree, idx)]
+        values = priorities[subtree]
+        expected = values[values > 0].min() if (values > 0).any() else np.inf
+        assert tree.min_tree[idx] == expected
+    assert tree.get_min_priority() == (positive.min() if len(positive) else 1.0)
+
+
+@pytest.mark.parametrize('capacity', [2, 7, 16, 100])
+def test_retrieve_batch_matches_prefix_sums(capacity):
+    tree, _ = random_tree(capacity, 3 * capacity, seed=capacity)
+    order = leaves_in_order(tree)
+    cumulative = np.cumsum(tree.tree[order])
+    values = np.random.default_rng(0).random(500) * tree.tree[0]
+    indices = tree.retrieve_batch(values)
+    # 暴力查找：第一个前缀和不小于查询值的叶子
+    expected = [order[min(np.searchsorted(cumulative, v, side='left'), len(order) - 1)] for v in values]
+    np.testing.assert_array_equal(indices, expected)
+    np.testing.assert_array_equal(indices, [tree.retrieve(0, v) for v in values])
+    assert (tree.tree[indices] > 0).all()